@@ -0,0 +1,99 @@
+"""
+the EnvSnapshot class -- remembers which products the environment says are
+setup, so that the SETUP_* variables are only parsed (and the products that
+they describe only looked up) once, rather than every time that an Eups
+instance asks what's setup.
+"""
+from __future__ import absolute_import
+import os
+import re
+from . import utils
+
+class EnvSnapshot(object):
+    """
+    a snapshot of the SETUP_* variables in the environment, and of the
+    Products that they resolve to.  Typically there is one EnvSnapshot per
+    Eups instance (as Eups.envSnapshot).
+
+    The SETUP_* variables are parsed when first needed; each product is only
+    looked up (via Eups.findSetupVersion() and Eups.findProduct()) when it's
+    asked for.  Eups.setEnv() and Eups.unsetEnv() tell the snapshot about
+    changes to SETUP_* variables via invalidate(); a product's entry is
+    also discarded if the values of its SETUP_* or *_DIR variable have
+    changed behind our back, and the whole snapshot is discarded if
+    os.environ is replaced.  The snapshot must be cleared (via clear()) if
+    the products declared or tagged change.
+    """
+
+    def __init__(self, Eups):
+        self.Eups = Eups
+        self.clear()
+
+    def clear(self):
+        """forget everything that we know about the environment"""
+        self._environ = os.environ
+        self._products = None           # {productName : versionName} as read from SETUP_* variables
+        self._resolved = {}             # {productName : (setupValue, dirValue, Product)}
+
+    def invalidate(self, key):
+        """
+        note that the environment variable key has been set or unset
+
+        @param key      the name of the variable
+        """
+        if key.startswith(utils.setupEnvPrefix()):
+            self._products = None       # each Product is checked against the environment when it's used
+
+    def _checkEnviron(self):
+        if os.environ is not self._environ:
+            self.clear()
+
+    def productNames(self):
+        """
+        return a list of (productName, versionName) for each product that the
+        environment says is setup.  versionName is None if the SETUP_*
+        variable doesn't specify it.
+        """
+        self._checkEnviron()
+
+        if self._products is None:
+            re_setup = re.compile(r"^%s(\w+)$" % utils.setupEnvPrefix())
+
+            self._products = []
+            for key, value in os.environ.items():
+                if not re_setup.search(key):
+                    continue
+
+                productInfo = value.split()
+                if not productInfo:     # Oh dear;  "$setupEnvPrefix()_productName" must be malformed
+                    continue
+
+                self._products.append((productInfo[0], productInfo[1] if len(productInfo) > 1 else None))
+
+        return self._products
+
+    def findSetupProduct(self, productName):
+        """
+        return the Product that the environment says is setup for productName,
+        or None if it isn't setup.  Exceptions raised while looking up the
+        product are passed on, and the product will be looked up again next
+        time.
+        """
+        self._checkEnviron()
+
+        setupValue = os.environ.get(self.Eups._envarSetupName(productName))
+        if setupValue is None:
+            return None
+
+        dirValue = os.environ.get(self.Eups._envarDirName(productName))
+        try:
+            value = self._resolved[productName]
+            if value[0:2] == (setupValue, dirValue):
+                return value[2]
+        except KeyError:
+            pass
+
+        product = self.Eups._findSetupProduct(productName)
+        self._resolved[productName] = (setupValue, dirValue, product)
+
+        return product
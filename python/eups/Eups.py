@@ -20,8 +20,14 @@ from .exceptions import ProductNotFound, EupsException, TableError, TableFileNot
 from .table      import Table, Action
 from .Product    import Product
 from .Uses       import Uses
+from .Resolver   import Resolver
+from .EnvSnapshot import EnvSnapshot
+from .Prefetch   import TablePrefetcher
+from .VersionCompare import sortArgs as versionSortArgs
+from .VersionParser import VersionExpression
 from .utils      import cmp_or_key, xrange, cmp
 from . import hooks
+from . import timing
 
 class Eups(object):
     """
@@ -41,6 +47,9 @@ class Eups(object):
 
     debugFlag = False                   # set via --debug=debug
 
+    envWrites = 0                       # the number of changes made to os.environ by setEnv() etc.
+    envExports = 0                      # the number of variables exported by exportEnv()
+
     # static variable:  the name of the EUPS database directory inside a EUPS-
     #  managed software stack
     ups_db = "ups_db"
@@ -249,9 +258,16 @@ class Eups(object):
 
         self.locallyCurrent = {}        # products declared local only within self
 
+        self.resolver = Resolver(self)  # memo of the dependencies resolved from table files
+        self.envSnapshot = EnvSnapshot(self) # the products that the environment says are setup
+        self._prefetched = set()        # the products whose files have been prefetched during this setup
+
         self._msgs = {}                 # used to suppress messages
         self._msgs["setup"] = {}        # used to suppress messages about setups
 
+        self._envPaths = {}             # path-like variables being modified in place; see flushEnv()
+        self._setupDepth = 0            # the number of active calls to setup()
+        self._dirtyEnv = set()          # variables changed since we last called exportEnv()
         self._stacks = {}               # used for saving/restoring state
         self._stacks["env"] = []        # environment that we'll setup
         self._stacks["vro"] = []        # the VRO
@@ -446,7 +462,7 @@ The what argument tells us what sort of state is expected (allowed values are de
             raise RuntimeError("Programming error: attempt to use stack \"%s\"" % what)
 
         if what == "env":
-            current = os.environ.copy()
+            current = (os.environ.copy(), dict((k, p.copy()) for k, p in self._envPaths.items()))
         elif what == "vro":
             current = self.getPreferredTags()
             if value:
@@ -472,7 +488,7 @@ The what argument tells us what sort of state is expected (allowed values are de
             raise RuntimeError("Programming error: stack \"%s\" doesn't have an element to pop" % what)
 
         if what == "env":
-            os.environ = value
+            os.environ, self._envPaths = value
         elif what == "vro":
             self.setPreferredTags(value)
         elif what == "verbose":
@@ -524,6 +540,7 @@ The what argument tells us what sort of state is expected (allowed values are de
                 pass
         return cachedir
 
+    @timing.timed("loadTags")
     def _loadServerTags(self):
         tags = {}
         for path in self.path:
@@ -583,6 +600,7 @@ The what argument tells us what sort of state is expected (allowed values are de
 
         return tags
 
+    @timing.timed("loadUserTags")
     def _loadUserTags(self):
         for path in self.path:
             # start by looking for a cached list
@@ -782,6 +800,7 @@ The what argument tells us what sort of state is expected (allowed values are de
         return utils.dirEnvNameFor(productName)
 
 
+    @timing.timed("resolveVRO", lambda self, name, *args, **kwargs: dict(product=name))
     def findProductFromVRO(self, name, version=None, versionExpr=None, eupsPathDirs=None, flavor=None,
                            noCache=False, recursionDepth=0, vro=None, optional=False):
         """
@@ -1313,7 +1332,7 @@ The what argument tells us what sort of state is expected (allowed values are de
                 # consult the cache
                 try:
                     vers = self.versions[root].getVersions(name, flavor)
-                    vers.sort(**cmp_or_key(self.version_cmp))
+                    vers.sort(**versionSortArgs(self.version_cmp))
                     if len(vers) == 0:
                         continue
 
@@ -1338,6 +1357,7 @@ The what argument tells us what sort of state is expected (allowed values are de
 
     def _findProductsByExpr(self, name, expr, eupsPathDirs, flavor, noCache):
         # find the products that satisfy the given expression
+        expr = VersionExpression.compile(expr)
         out = []
         outver = []
         for root in eupsPathDirs:
@@ -1352,7 +1372,7 @@ The what argument tells us what sort of state is expected (allowed values are de
                 if len(products) == 0:
                     continue
 
-                products = [z for z in products if self.version_match(z.version, expr)]
+                products = expr.filter(products, self.version_match_prim, lambda z: z.version)
                 for prod in products:
                     if prod.version not in outver:
                         out.append(prod)
@@ -1362,7 +1382,7 @@ The what argument tells us what sort of state is expected (allowed values are de
                 # consult the cache
                 try:
                     vers = self.versions[root].getVersions(name, flavor)
-                    vers = [z for z in vers if self.version_match(z, expr)]
+                    vers = expr.filter(vers, self.version_match_prim)
                     if len(vers) == 0:
                         continue
                     for ver in vers:
@@ -1391,7 +1411,7 @@ The what argument tells us what sort of state is expected (allowed values are de
             if tag.name == "latest":
                 # find the latest version; first order the versions
                 vers = [p.version for p in products]
-                vers.sort(**cmp_or_key(self.version_cmp))
+                vers.sort(**versionSortArgs(self.version_cmp))
 
                 # select the product with the latest version
                 if len(vers) > 0:
@@ -1480,6 +1500,7 @@ The what argument tells us what sort of state is expected (allowed values are de
 
                 self._setProductStack_fromCache(dataDir, [self.flavor])
 
+    @timing.timed("loadCache", lambda self, dataDir, *args: dict(stack=dataDir))
     def _setProductStack_fromCache(self, dataDir, neededFlavors):
         # the product cache.  If cache is non-existent or out of date, the product info will be refreshed from
         # the database
@@ -1499,22 +1520,9 @@ The what argument tells us what sort of state is expected (allowed values are de
     def getSetupProducts(self, requestedProductName=None):
         """Return a list of all Products that are currently setup (or just the specified product)"""
 
-        re_setup = re.compile(r"^%s(\w+)$" % utils.setupEnvPrefix())
-
         productList = []
 
-        for key in [k for k in os.environ.keys() if re.search(re_setup, k)]:
-            try:
-                productInfo = os.environ[key].split()
-                productName = productInfo[0]
-            except IndexError:          # Oh dear;  "$setupEnvPrefix()_productName" must be malformed
-                continue
-
-            try:
-                versionName = productInfo[1]
-            except IndexError:
-                versionName = None
-
+        for productName, versionName in self.envSnapshot.productNames():
             if requestedProductName and productName != requestedProductName:
                 continue
 
@@ -1547,7 +1555,14 @@ The what argument tells us what sort of state is expected (allowed values are de
         """
         return a Product instance for a currently setup product.  None is
         returned if a product with the given name is not currently setup.
+        If environ is specified search it for environment variables; otherwise look in os.environ
         """
+        if not environ or environ is os.environ:
+            return self.envSnapshot.findSetupProduct(productName)
+
+        return self._findSetupProduct(productName, environ)
+
+    def _findSetupProduct(self, productName, environ=None):
         versionName, eupsPathDir, productDir, tablefile, flavor = \
             self.findSetupVersion(productName, environ)
         if versionName is None:
@@ -1564,17 +1579,96 @@ The what argument tells us what sort of state is expected (allowed values are de
         """Set an environmental variable"""
 
         if interpolateEnv:              # replace ${ENV} by its value if known
+            self.flushEnv(re.findall(r"\${([^}]*)}", val))
             val = re.sub(r"(\${([^}]*)})", lambda x : os.environ.get(x.group(2), x.group(1)), val)
 
         if val == None:
             val = ""
+        self._envPaths.pop(key, None)
         os.environ[key] = val
+        self._envChanged(key)
 
     def unsetEnv(self, key):
         """Unset an environmental variable"""
 
+        self._envPaths.pop(key, None)
         if key in os.environ:
             del os.environ[key]
+            self._envChanged(key)
+
+    def _envChanged(self, key):
+        # note that we've changed the value of environment variable key
+        Eups.envWrites += 1
+        self._dirtyEnv.add(key)
+        self.envSnapshot.invalidate(key)
+
+    def exportEnv(self):
+        """
+        Export the variables that we've changed to the process environment
+        (i.e. to our children).  This happens at the end of a setup; it's
+        needed as os.environ may be a copy (see popStack()), in which case
+        changes to it aren't passed on via os.putenv()
+        """
+        for key in self._dirtyEnv:
+            if key in os.environ:
+                os.putenv(key, os.environ[key])
+            elif hasattr(os, "unsetenv"):
+                os.unsetenv(key)
+            Eups.envExports += 1
+
+        self._dirtyEnv = set()
+
+    def getEnvPath(self, key, delim=":"):
+        """
+        Return an OrderedPath holding the value of the path-like environment
+        variable key, to be modified in place;  the new value will be written
+        to os.environ by flushEnv().  Return None if the value contains
+        ${...} (which setEnv(..., interpolateEnv=True) would expand), in
+        which case it should be set using setEnv()
+        """
+        path = self._envPaths.get(key)
+        if path is not None and path.delim == delim:
+            return path
+
+        self.flushEnv([key])
+        value = os.environ.get(key, "")
+        if "${" in value:
+            return None
+
+        path = utils.OrderedPath(value, delim)
+        self._envPaths[key] = path
+
+        return path
+
+    def updateEnvPath(self, key):
+        """
+        Note that the OrderedPath returned by getEnvPath(key) has been
+        modified.  The new value is written to os.environ immediately unless
+        we're in the middle of a setup, in which case that's left to
+        flushEnv()
+        """
+        if not self._setupDepth:
+            self.flushEnv([key])
+
+    def flushEnv(self, keys=None):
+        """
+        Write the values of the path-like variables being modified in place
+        (see getEnvPath()) to os.environ.  This happens at the end of a
+        setup, and whenever their values are needed during it
+
+        @param keys   only write these variables (default: all)
+        """
+        if not self._envPaths:
+            return
+
+        if keys is None:
+            keys = list(self._envPaths.keys())
+
+        for key in keys:
+            path = self._envPaths.pop(key, None)
+            if path is not None:
+                os.environ[key] = str(path)
+                self._envChanged(key)
 
     def setAlias(self, key, val):
         """Set an alias.  The value is in sh syntax --- we'll mangle it for csh later"""
@@ -1677,58 +1771,7 @@ The what argument tells us what sort of state is expected (allowed values are de
     def version_match(self, vname, expr):
         """Return vname if it matches the logical expression expr"""
 
-        expr0 = expr
-        expr = [x for x in re.split(r"\s*(%s|\|\||\s)\s*" % self._relop_re.pattern, expr0) if not re.search(r"^\s*$", x)]
-
-        logop = None                    # the next logical operation to process
-        value = None                    # the value of the current term (e.g. ">= 2.0.0")
-        i = -1
-        while i < len(expr) - 1:
-            i += 1
-
-            if self._relop_re.search(expr[i]):
-                relop = expr[i]; i += 1
-                v = expr[i]
-            elif re.search(r"^[-+.:/\w]+$", expr[i]) and expr[i] not in ("and", "or"):
-                relop = "=="
-                v = expr[i]
-            elif expr[i] == "||" or expr[i] == "or":
-                logop = "or"
-                continue
-            elif expr[i] == "&&" or expr[i] == "and":
-                if not value:
-                    return False        # short circuit
-
-                logop = "and"
-                continue
-            else:
-                print("Unexpected operator %s in \"%s\"" % (expr[i], expr0), file=utils.stdwarn)
-                break
-
-            if not logop and value is not None:
-                print("Expected logical operator || or && in \"%s\" at %s" % (expr0, v), file=utils.stdwarn)
-            else:
-                try:
-                    rhs = self.version_match_prim(relop, vname, v)
-                    if not logop:
-                        value = rhs
-                    elif logop == "and":
-                        if value and rhs:
-                            value = True
-                        else:
-                            value = False
-                    elif logop == "or":
-                        if value or rhs:
-                            return vname
-
-                        value = False
-                except ValueError:           # no sort order is defined
-                    return None
-
-        if value:
-            return vname
-        else:
-            return None
+        return VersionExpression.compile(expr).match(vname, self.version_match_prim)
 
     def version_match_prim(self, op, v1, v2):
         """
@@ -1800,6 +1843,22 @@ The what argument tells us what sort of state is expected (allowed values are de
         @param versionExpr      An expression specifying the desired version
         @param implicitProduct  True iff product is setup due to being specified in implicitProducts
         """
+        self._setupDepth += 1
+        try:
+            return self._setup(productName, versionName, fwd, recursionDepth, setupToplevel, noRecursion,
+                               productRoot, tablefile, versionExpr, optional, implicitProduct)
+        finally:
+            self._setupDepth -= 1
+            if not self._setupDepth:
+                self.flushEnv()
+                self.exportEnv()
+
+    @timing.timed("setup", lambda self, productName, *args: dict(product=productName))
+    def _setup(self, productName, versionName, fwd, recursionDepth, setupToplevel, noRecursion,
+               productRoot, tablefile, versionExpr, optional, implicitProduct):
+        """Do the work for setup()"""
+
+        self.resolver.clear()       # the products that are setup, and hence dependencies, may change
 
         if utils.is_string(versionName) and versionName.startswith(Product.LocalVersionPrefix):
             productRoot = versionName[len(Product.LocalVersionPrefix):]
@@ -1942,6 +2001,7 @@ The what argument tells us what sort of state is expected (allowed values are de
 
                 self.alreadySetupProducts[product.name] = (product, vroReason)
 
+        self.flushEnv(["EUPS_PATH"])     # tables may refer to ${EUPS_PATH[i]}
         try:
             table = product.getTable(quiet=not fwd, verbose=self.verbose)
         except TableFileNotFound as e:
@@ -1972,6 +2032,10 @@ The what argument tells us what sort of state is expected (allowed values are de
         # self._msgs["setup"] is used to suppress multiple messages about setting up the same product
         if recursionDepth == 0:
             self._msgs["setup"] = {}
+            self._prefetched = set()
+
+        if fwd and not noRecursion:
+            self._prefetchDependencies(actions, setupFlavor)
 
         indent = "| " * (recursionDepth//2)
         if recursionDepth%2 == 1:
@@ -2070,14 +2134,15 @@ The what argument tells us what sort of state is expected (allowed values are de
         #
         # Process table file
         #
-        for a in actions:
-            if localProduct:    # we'll set e.g. PATH from localProduct
-                if a.cmd not in (Action.setupOptional,   Action.setupRequired,
-                                 Action.unsetupOptional, Action.unsetupRequired):
-                    continue
+        with timing.span("actions", product=product.name):
+            for a in actions:
+                if localProduct:    # we'll set e.g. PATH from localProduct
+                    if a.cmd not in (Action.setupOptional,   Action.setupRequired,
+                                     Action.unsetupOptional, Action.unsetupRequired):
+                        continue
 
-            a.execute(self, recursionDepth + 1, fwd, noRecursion=noRecursion, tableProduct=product,
-                      implicitProduct=implicitProduct)
+                a.execute(self, recursionDepth + 1, fwd, noRecursion=noRecursion, tableProduct=product,
+                          implicitProduct=implicitProduct)
         #
         # Did we want to use the dependencies from an installed table, but use a different directory?
         #
@@ -2097,14 +2162,40 @@ The what argument tells us what sort of state is expected (allowed values are de
         if recursionDepth == 0:            # we can cleanup
             if fwd:
                 del self._msgs["setup"]
-        #
-        # we made a copy of os.environ so the usual magic putenv doesn't happen
-        #
-        for key, val in os.environ.items():
-            os.putenv(key, val)
-
         return True, product.version, None
 
+    def _prefetchDependencies(self, actions, flavor):
+        """
+        Start reading the files describing the products that actions will setup, in the
+        background, if hooks.config.Eups.setupPrefetchThreads is non-zero.  The setup
+        itself still reads the files in the usual order, so the result is unchanged
+        """
+        nthread = hooks.config.Eups.setupPrefetchThreads
+        if not nthread:
+            return
+
+        prefetcher = None
+        flavors = utils.Flavor().getFallbackFlavors(flavor, True)
+        for a in actions:
+            if a.cmd not in (Action.setupOptional, Action.setupRequired):
+                continue
+            #
+            # Find the product's name and any versions;  we needn't be careful
+            # as we only use them to guess which files to read
+            #
+            args = [arg for i, arg in enumerate(a.args) if not arg.startswith("-") and
+                    not (i > 0 and a.args[i - 1] in ("-f", "--flavor", "-r", "-T", "-t", "--tag", "--vro"))]
+            if not args or args[0] in self._prefetched:
+                continue
+
+            productName = args[0]
+            self._prefetched.add(productName)
+
+            if not prefetcher:
+                prefetcher = TablePrefetcher.get(nthread)
+            for root in self.path:
+                prefetcher.prefetch(self._databaseFor(root), productName, args[1:], flavors)
+
     def unsetup(self, productName, versionName=None, recursionDepth=0, noRecursion=False, optional=False):
         """Unsetup a product"""
 
@@ -2122,6 +2213,10 @@ The what argument tells us what sort of state is expected (allowed values are de
         @param productName   the name of the product to tag
         @param versionName   the version of the product
         """
+
+        self.resolver.clear()       # dependencies may resolve differently once we're done
+        self.envSnapshot.clear()    # as may the products that are setup
+
         # convert tag name to a Tag instance; may raise TagNotRecognized
         tag = self.tags.getTag(tag)
 
@@ -2182,6 +2277,10 @@ The what argument tells us what sort of state is expected (allowed values are de
                                  the first product in the stack with that tag
                                  will be chosen.
         """
+
+        self.resolver.clear()       # dependencies may resolve differently once we're done
+        self.envSnapshot.clear()    # as may the products that are setup
+
         # convert tag name to a Tag instance; may raise TagNotRecognized
         tag = self.tags.getTag(tag)
 
@@ -2323,6 +2422,10 @@ The what argument tells us what sort of state is expected (allowed values are de
         @param declareCurrent  DEPRECATED, if True and tag=None, it is
                                equivalent to tag="current".
         """
+
+        self.resolver.clear()       # dependencies may resolve differently once we're done
+        self.envSnapshot.clear()    # as may the products that are setup
+
         if re.search(r"[^a-zA-Z_0-9]", productName):
             raise EupsException("Product names may only include the characters [a-zA-Z_0-9]: saw %s" % productName)
 
@@ -2761,6 +2864,10 @@ The what argument tells us what sort of state is expected (allowed values are de
         @param undeclareCurrent  DEPRECATED; if True, and tag is None, this
                                 is equivalent to tag="current".
         """
+
+        self.resolver.clear()       # dependencies may resolve differently once we're done
+        self.envSnapshot.clear()    # as may the products that are setup
+
         # this is for backward compatibility
         if isinstance(tag, bool) or (tag is None and undeclareCurrent):
             tag = "current"
@@ -2963,10 +3070,10 @@ The what argument tells us what sort of state is expected (allowed values are de
                     vers = stack.getVersions(pname, flavor)
                     if version:
                         if self.isLegalRelativeVersion(version): # version is actually an expression
-                            vers = [v for v in vers if self.version_match(v, version)]
+                            vers = VersionExpression.compile(version).filter(vers, self.version_match_prim)
                         else:
                             vers = list(fnmatch.filter(vers, version))
-                    vers.sort(**cmp_or_key(self.version_cmp))
+                    vers.sort(**versionSortArgs(self.version_cmp))
 
                     # only include latest if it passes the version constraint
                     if latest is not None and latest.version not in vers:
@@ -3016,7 +3123,8 @@ The what argument tells us what sort of state is expected (allowed values are de
 
         if version:
             if self.isLegalRelativeVersion(version):
-                out = [p for p in out if self.version_match(p.version, version)]
+                out = VersionExpression.compile(version).filter(out, self.version_match_prim,
+                                                                lambda p: p.version)
             else:
                 out = [p for p in out if fnmatch.fnmatch(p.version, version)]
 
@@ -3221,18 +3329,27 @@ The what argument tells us what sort of state is expected (allowed values are de
         this product depends on; if checkRecursive is True, you won't be able to remove any
         product that's in use elsewhere unless force is also True.
 
-        N.b. The checkRecursive option is quite slow (it has to parse
-        every table file on the system).  If you're calling remove
-        repeatedly, you can pass in a userInfo object (returned by
-        self.uses(None)) to save remove() having to processing those
-        table files on every call."""
+        N.b. The checkRecursive option can be slow (it has to resolve the
+        dependencies of every product that might use the products being
+        removed, as found from the stacks' dependency indexes).  If you're
+        calling remove repeatedly, you can pass in a userInfo object
+        (returned by self.uses(None)) to save remove() having to processing
+        those table files on every call."""
         #
         # Gather the required information
         #
         if checkRecursive and not userInfo:
             if self.verbose:
                 print("Calculating product dependencies recursively...", file=utils.stdwarn)
-            userInfo = self.uses(None)
+            #
+            # We only need to know about the users of the products that we might remove
+            #
+            if recursive:
+                productNames = self._possibleDependencies(productName)
+            else:
+                productNames = [productName]
+
+            userInfo = self._makeUses(self._possibleUsers(productNames, self.findProducts()))
         else:
             userInfo = None
 
@@ -3363,42 +3480,129 @@ The what argument tells us what sort of state is expected (allowed values are de
         if not productName and versionName:
             raise EupsException("You may not specify a version \"%s\" but not a product" % versionName)
 
+        if not usesInfo:
+            # start with every known product
+            productList = self.findProducts()
+
+            if not productList:
+                return []
+
+            if productName:
+                # only products that might depend on productName need be examined
+                productList = self._possibleUsers([productName], productList)
+
+            usesInfo = self._makeUses(productList, depth)
+        #
+        # OK, we have the information stored away
+        #
+        if not productName:
+            return usesInfo
+
+        return usesInfo.users(productName, versionName)
+
+    def _makeUses(self, productList, depth=9999):
+        """Return a Uses object describing the dependencies of the products in productList"""
+
         old_exact_version = self.exact_version
         self.exact_version = True       # we want to know exactly which versions were specified
 
-        # start with every known product
-        productList = self.findProducts()
+        usesInfo = Uses()
 
-        if not productList:
-            return []
+        for pi in productList:          # for every known product
+            try:
+                deps = self.getDependentProducts(pi, shouldRaise=False, followExact=None, topological=True)
+            except TableError as e:
+                if not self.quiet:
+                    print(("Warning: %s" % (e)), file=utils.stdwarn)
+                continue
 
-        if not usesInfo:
-            usesInfo = Uses()
+            for dep_product, dep_optional, dep_depth in deps:
+                assert not (pi.name == dep_product.name and pi.version == dep_product.version)
+
+                usesInfo.remember(pi.name, pi.version, (dep_product.name, dep_product.version,
+                                                        dep_optional, dep_depth))
+
+        usesInfo.invert(depth)
+
+        self.exact_version = old_exact_version
+
+        return usesInfo
+
+    def _dependencyNames(self, productList):
+        """Return a dictionary giving the names of the products that products in productList may setup,
+        indexed by product name (so the names for all versions are merged).  The value is None if it can't be
+        known in advance (see Table.dependencyNames())
 
-            for pi in productList:          # for every known product
+        The names are taken from the products' stacks' dependency indexes where possible"""
+
+        names = {}
+        stacks = []
+        for p in productList:
+            stack = p._prodStack
+            if stack:
+                pnames = stack.dependencyNames(p)
+                if stack not in stacks:
+                    stacks.append(stack)
+            else:
                 try:
-                    deps = self.getDependentProducts(pi, shouldRaise=False, followExact=None, topological=True)
-                except TableError as e:
-                    if not self.quiet:
-                        print(("Warning: %s" % (e)), file=utils.stdwarn)
-                    continue
+                    table = p.getTable(quiet=True)
+                    pnames = table.dependencyNames() if table else set()
+                except TableError:
+                    pnames = None
+
+            if p.name not in names:
+                names[p.name] = set()
+            if pnames is None or names[p.name] is None:
+                names[p.name] = None
+            else:
+                names[p.name].update(pnames)
 
-                for dep_product, dep_optional, dep_depth in deps:
-                    assert not (pi.name == dep_product.name and pi.version == dep_product.version)
+        for stack in stacks:
+            stack.saveDependencyIndex()
 
-                    usesInfo.remember(pi.name, pi.version, (dep_product.name, dep_product.version,
-                                                            dep_optional, dep_depth))
+        return names
 
-            usesInfo.invert(depth)
+    def _possibleUsers(self, productNames, productList):
+        """Return the products in productList that may depend, directly or indirectly, on any of the named
+        products (or whose dependencies can't be known in advance)"""
 
-        self.exact_version = old_exact_version
+        depNames = self._dependencyNames(productList)
+
+        usedBy = {}                     # the inverse of depNames
+        for name, deps in depNames.items():
+            for d in deps or []:
+                usedBy.setdefault(d, set()).add(name)
         #
-        # OK, we have the information stored away
+        # Products whose dependencies are unknown may use anything, so they (and their users) are candidates
         #
-        if not productName:
-            return usesInfo
+        todo = list(productNames) + [name for name, deps in depNames.items() if deps is None]
+        users = set([name for name, deps in depNames.items() if deps is None])
+        while todo:
+            for name in usedBy.get(todo.pop(), []):
+                if name not in users:
+                    users.add(name)
+                    todo.append(name)
 
-        return usesInfo.users(productName, versionName)
+        return [p for p in productList if p.name in users]
+
+    def _possibleDependencies(self, productName):
+        """Return the names of all products that productName may depend on, directly or indirectly (including
+        productName itself)"""
+
+        depNames = self._dependencyNames(self.findProducts())
+
+        if [deps for deps in depNames.values() if deps is None]:
+            return list(depNames.keys())
+
+        names = set([productName])
+        todo = [productName]
+        while todo:
+            for name in depNames.get(todo.pop(), []):
+                if name not in names:
+                    names.add(name)
+                    todo.append(name)
+
+        return list(names)
 
     def supportServerTags(self, tags, eupsPathDir=None):
         """
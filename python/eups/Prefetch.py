@@ -0,0 +1,100 @@
+"""
+the TablePrefetcher class -- reads, in background threads, the database and
+table files that setting up a product's dependencies will need, so that
+waiting for a slow (e.g. network) filesystem overlaps with resolving the
+setup.
+"""
+from __future__ import absolute_import
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class TablePrefetcher(object):
+    """
+    a pool of threads that read the version, chain, and table files of
+    products before they are needed.  The files are only read (so that the
+    operating system has them to hand); nothing that is read is passed back,
+    so the result of a setup cannot depend on whether, or in which order,
+    the files were prefetched.
+
+    There is normally a single pool, as returned by TablePrefetcher.get()
+    """
+
+    _instance = None
+    _instanceLock = threading.Lock()
+
+    def __init__(self, nthread):
+        """
+        @param nthread   the number of threads to read files in
+        """
+        self.queue = queue.Queue()
+        self.filesRead = 0              # the number of table files read (approximately; it isn't locked)
+
+        self.threads = []
+        for i in range(nthread):
+            thread = threading.Thread(target=self._run, name="eupsPrefetch%d" % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    @classmethod
+    def get(cls, nthread):
+        """
+        return the shared TablePrefetcher, creating it (with nthread threads)
+        if it doesn't yet exist
+        """
+        cls._instanceLock.acquire()
+        try:
+            if cls._instance is None:
+                cls._instance = cls(nthread)
+        finally:
+            cls._instanceLock.release()
+
+        return cls._instance
+
+    def prefetch(self, db, productName, versionNames, flavors):
+        """
+        read the files for the versions of productName in db that we're likely
+        to setup:  those listed in versionNames, and those that are tagged
+
+        @param db            the Database to read
+        @param productName   the name of the product
+        @param versionNames  versions that were explicitly asked for (may be empty)
+        @param flavors       the acceptable flavors, in order of preference
+        """
+        self.queue.put((db, productName, versionNames, flavors))
+
+    def join(self):
+        """wait until all the files that we've been asked to read have been read"""
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            request = self.queue.get()
+            try:
+                self._fetch(*request)
+            except Exception:           # we'll find out about any problems when the file's used
+                pass
+            self.queue.task_done()
+
+    def _fetch(self, db, productName, versionNames, flavors):
+        versionNames = list(versionNames)
+        for tag, versionName, flavor in db.getTagAssignments(productName): # reads the chain files
+            if flavor in flavors and versionName not in versionNames:
+                versionNames.append(versionName)
+
+        for versionName in versionNames:
+            for flavor in flavors:
+                product = db.findProduct(productName, versionName, flavor) # reads the version file
+                if product:
+                    tablefile = product.tableFileName()
+                    if tablefile:
+                        fd = open(tablefile, "rb")
+                        try:
+                            fd.read()
+                        finally:
+                            fd.close()
+                        self.filesRead += 1
+                    break
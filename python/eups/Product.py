@@ -12,6 +12,7 @@ except ImportError:
     from ConfigParser import ConfigParser
 from . import table as mod_table
 from . import utils
+from . import timing
 from .exceptions import ProductNotFound, TableFileNotFound
 
 macrore = { "PROD_ROOT": re.compile(r"^\$PROD_ROOT\b"),
@@ -123,6 +124,14 @@ class Product(object):
     def tags(self, value):
         self._tags = value
 
+    def __getstate__(self):
+        # the ProductStack reference only makes sense within this process;
+        # don't drag the whole stack along when this product is pickled
+        # (e.g. as the topProduct of a cached Table)
+        state = self.__dict__.copy()
+        state["_prodStack"] = None
+        return state
+
     def __hash__(self):                 # needed for set operations (such as toplogicalSort)
         return (hash(self.name) ^
                 hash(self.version) ^
@@ -423,9 +432,16 @@ class Product(object):
             if not os.path.exists(tablepath):
                 raise TableFileNotFound(tablepath, self.name, self.version,
                                         self.flavor)
-            self._table = mod_table.Table(tablepath, self,
-                                          addDefaultProduct=addDefaultProduct, verbose=verbose,
-                                          ).expandEupsVariables(self, quiet)
+            with timing.span("readTable", product=self.name):
+                if self._prodStack:
+                    # the stack keeps a cache of parsed tables
+                    table = self._prodStack.readTable(tablepath, self,
+                                                      addDefaultProduct=addDefaultProduct,
+                                                      verbose=verbose)
+                else:
+                    table = mod_table.Table(tablepath, self,
+                                            addDefaultProduct=addDefaultProduct, verbose=verbose)
+                self._table = table.expandEupsVariables(self, quiet)
 
             if self._prodStack and self.name and self.version and self.flavor:
                 # pass the loaded table back to the cache
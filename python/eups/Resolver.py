@@ -0,0 +1,113 @@
+"""
+the Resolver class -- memoizes the resolution of the dependencies listed in
+table files so that walking many products' dependency trees (as done by
+"eups list -D", "eups uses", and "eups remove") only resolves each of them
+once.
+"""
+from __future__ import absolute_import
+from .exceptions import ProductNotFound
+
+class Resolver(object):
+    """
+    a memo of the dependencies found in table files, as resolved by an
+    Eups instance.  Typically there is one Resolver per Eups instance (as
+    Eups.resolver).
+
+    Two things are remembered:
+      o  the setupRequired/unsetupRequired actions that a product's table
+         contains for a given flavor and setup type, with their arguments
+         already processed;
+      o  the Product that each dependency resolves to.
+    Each is keyed on the state of the Eups instance that it depends on
+    (e.g. the VRO, flavor, and path) as well as on the dependency itself.
+    The memo must be cleared (via clear()) if the products declared or
+    setup change.
+    """
+
+    def __init__(self, Eups):
+        self.Eups = Eups
+        self.clear()
+
+    def clear(self):
+        """forget all resolved dependencies"""
+        self._requirements = {}
+        self._products = {}
+
+    def requirements(self, table, setupType, listExternalDependencies=False):
+        """
+        return the (un)setupRequired actions in a table that apply to the
+        current flavor and the given setup type, as a list of
+        (action, requestedVRO, productName, productDir, vers, versExpr,
+        extraArgs) tuples; the last six are the values returned by
+        Action.processArgs().  Actions marked as noAction, or that don't
+        match listExternalDependencies, are omitted.
+
+        @param table                    the Table to search
+        @param setupType                the setup types in effect
+        @param listExternalDependencies if True, include only external
+                                           dependencies; otherwise only
+                                           the ones EUPS manages
+        """
+        from .table import Action
+
+        Eups = self.Eups
+        top = table.topProduct
+        key = (table.file, top and top.name, top and top.version, Eups.flavor,
+               tuple(setupType), listExternalDependencies, Eups.ignore_versions)
+
+        if key not in self._requirements:
+            reqs = []
+            for a in table.actions(Eups.flavor, setupType=setupType):
+                if a.cmd not in (Action.setupRequired, Action.unsetupRequired):
+                    continue
+
+                args = a.processArgs(Eups)
+                extraArgs = args[-1]
+                if extraArgs["noAction"]:
+                    continue
+                if extraArgs["isExternal"] != listExternalDependencies:
+                    continue
+
+                reqs.append((a,) + tuple(args))
+
+            self._requirements[key] = reqs
+
+        return self._requirements[key]
+
+    def findProduct(self, productName, vers=None, versExpr=None, requiredVersion=None):
+        """
+        return the Product that a dependency resolves to under the current
+        VRO, raising ProductNotFound if there isn't one.
+
+        @param productName      the name of the desired product
+        @param vers             the version given in the table file
+        @param versExpr         the version expression given in the table file
+        @param requiredVersion  if not None, the version that must be used,
+                                   regardless of vers, versExpr, and the VRO
+        """
+        Eups = self.Eups
+        if productName in Eups.alreadySetupProducts:
+            # the VRO may prefer the version that's been setup; don't remember it
+            product = self._findProduct(productName, vers, versExpr, requiredVersion)
+        else:
+            key = (productName, vers, versExpr, requiredVersion,
+                   tuple([str(t) for t in Eups.getPreferredTags()]),
+                   Eups.flavor, tuple(Eups.path), Eups.ignore_versions)
+            if key not in self._products:
+                self._products[key] = self._findProduct(productName, vers, versExpr,
+                                                        requiredVersion)
+            product = self._products[key]
+
+        if not product:
+            raise ProductNotFound(productName)
+
+        return product
+
+    def _findProduct(self, productName, vers, versExpr, requiredVersion):
+        try:
+            if requiredVersion is not None:
+                return self.Eups.findProduct(productName, requiredVersion)
+            else:
+                return self.Eups.findProductFromVRO(productName, vers, versExpr)[0]
+        except ProductNotFound:
+            return None
@@ -0,0 +1,216 @@
+"""
+the SetupPlanCache class -- remembers the shell commands generated by the
+setup command, so that repeating an identical setup against an unchanged
+stack needn't resolve anything.
+"""
+from __future__ import absolute_import, print_function
+import hashlib
+import os
+import re
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from . import utils
+from . import hooks
+from .db import Database
+from .stack import ProductStack
+
+class SetupPlanCache(object):
+    """
+    a cache of the results of setup commands, kept in the user's data
+    directory.
+
+    A plan is looked up by a key describing the request: the command-line
+    options and products, the EUPS_PATH, the flavor, the customization files
+    that were loaded, the version and source files of eups itself, and the
+    SETUP_* and EUPS_* variables in the starting environment.  Each plan also
+    records the state of the parts of the stacks that it was resolved from:
+    the generation and modification time of each database, and of the
+    database entry and table file of each product that it setup, and the
+    starting values of the environment variables that those table files
+    use or set; if any of these have changed, the plan is discarded and the
+    setup resolved again.  The messages that were printed while the plan was
+    resolved are saved with it, and printed again when it's used.
+    """
+
+    planDirName = "_setupPlans_"
+    planFileExt = "pickleSetupPlan"
+    maxPlans = 100                      # the number of plans to keep
+
+    # environment variables that are part of every key: the products that are setup, and eups's own
+    keyEnvPrefixes = (utils.setupEnvPrefix(), "EUPS_",)
+    # environment variables with those prefixes that cannot affect the result of a setup
+    ignoredEnv = ("EUPS_LOCK_PID",)
+
+    def __init__(self, path, userDataDir=None, verbose=0):
+        """
+        @param path          the list of product stacks in use
+        @param userDataDir   the user's data directory (default: utils.defaultUserDataDir())
+        @param verbose       chattiness
+        """
+        if not userDataDir:
+            userDataDir = utils.defaultUserDataDir()
+
+        self.path = path
+        self.userDataDir = userDataDir
+        self.verbose = verbose
+        self.plandir = os.path.join(userDataDir, "_caches_", self.planDirName)
+
+    def _planFile(self, key):
+        return os.path.join(self.plandir, "%s.%s" % (key, self.planFileExt))
+
+    def key(self, request):
+        """
+        return the key for a request, which should be a repr()-able description
+        of the setup command (e.g. its options and arguments)
+        """
+        self._environ = os.environ.copy() # the starting environment, as used by save()
+
+        environ = sorted([kv for kv in os.environ.items()
+                          if kv[0].startswith(self.keyEnvPrefixes) and kv[0] not in self.ignoredEnv])
+        customizations = [(f, utils.fileStat(f)) for f in (hooks.customisationFiles or [])]
+        code = [utils.version()]
+        for dirpath, dirnames, filenames in os.walk(os.path.dirname(os.path.abspath(__file__))):
+            dirnames.sort()
+            code += [(f, utils.fileStat(os.path.join(dirpath, f)))
+                     for f in sorted(filenames) if f.endswith(".py")]
+
+        key = repr((ProductStack.persistVersion, code, request, self.path, utils.determineFlavor(),
+                    customizations, environ))
+
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def lookup(self, key):
+        """
+        return the commands and messages saved for key as a tuple (cmds,
+        messages), or None if there are none (or the stacks or the environment
+        variables that they use have changed since they were saved)
+        """
+        planFile = self._planFile(key)
+        try:
+            fd = open(planFile, "rb")
+            try:
+                savedKey, stamps, environ, cmds, messages = pickle.load(fd)
+            finally:
+                fd.close()
+        except Exception:               # missing, unreadable, or from another version of eups
+            return None
+
+        if savedKey != key or stamps != self._stamps(stamps[1]) or \
+               environ != [(k, os.environ.get(k)) for k, v in environ]:
+            if self.verbose > 1:
+                print("Setup plan %s is out of date" % planFile, file=utils.stdinfo)
+            return None
+
+        if self.verbose > 1:
+            print("Using setup plan %s" % planFile, file=utils.stdinfo)
+
+        try:
+            os.utime(planFile, None)    # so that it's kept by _prune()
+        except OSError:
+            pass
+
+        return cmds, messages
+
+    def save(self, key, cmds, eupsenv, messages=""):
+        """
+        save the commands generated by a setup for key
+
+        @param eupsenv   the Eups instance that did the setup (and knows what's now setup)
+        @param messages  the messages printed while generating cmds
+        """
+        productNames = set()
+        for environ in (eupsenv.oldEnviron, os.environ):
+            for k, v in environ.items():
+                if k.startswith(utils.setupEnvPrefix()) and v.split():
+                    productNames.add(v.split()[0])
+
+        tablefiles = []
+        for productName in productNames:
+            product = eupsenv.findSetupProduct(productName)
+            if product and utils.isRealFilename(product.tablefile):
+                tablefiles.append(product.tablefile)
+
+        stamps = self._stamps((sorted(productNames), sorted(tablefiles)))
+        #
+        # The variables that the plan depends on: the ones that it changed, and those that its table
+        # files refer to (e.g. envPrepend(PATH, ...), which needn't change PATH if it's already there)
+        #
+        envNames = set([k for k in set(self._environ) | set(os.environ)
+                        if self._environ.get(k) != os.environ.get(k)])
+        for tablefile in tablefiles:
+            try:
+                fd = open(tablefile)
+                try:
+                    contents = fd.read()
+                finally:
+                    fd.close()
+            except IOError:
+                continue
+            envNames.update(_tableEnvRe.findall(contents))
+            envNames.update(_envRefRe.findall(contents))
+        environ = [(k, self._environ.get(k)) for k in sorted(envNames)]
+
+        try:
+            if not os.path.isdir(self.plandir):
+                os.makedirs(self.plandir)
+
+            fd = utils.AtomicFile(self._planFile(key), "wb")
+            pickle.dump((key, stamps, environ, cmds, messages), fd, protocol=2)
+            fd.close()
+
+            self._prune()
+        except (IOError, OSError) as e:
+            if self.verbose > 0:
+                print("Unable to save setup plan: %s" % e, file=utils.stdwarn)
+
+    def _stamps(self, products):
+        # the state of the stacks that a plan for products ((productNames, tablefiles)) depends on
+        productNames, tablefiles = products
+
+        dbs = []
+        for p in self.path:
+            dbpath = os.path.join(p, "ups_db")
+            db = Database(dbpath)
+            userTagDir = utils.userStackCacheFor(p, self.userDataDir)
+
+            dbs.append((dbpath, db.getGeneration(), utils.fileStat(dbpath), db.getGeneration(userTagDir),
+                        [(n, utils.fileStat(os.path.join(dbpath, n)),
+                          utils.fileStat(os.path.join(userTagDir, n)))
+                         for n in productNames]))
+
+        return (dbs, products, [(f, utils.fileStat(f)) for f in tablefiles])
+
+    def _prune(self):
+        # remove all but the maxPlans most recently used plans
+        plans = [os.path.join(self.plandir, f) for f in os.listdir(self.plandir)
+                 if f.endswith("." + self.planFileExt)]
+        if len(plans) <= self.maxPlans:
+            return
+
+        plans = sorted([(utils.fileStat(f), f) for f in plans], key=lambda x: x[0] or (0, 0))
+        for s, f in plans[:len(plans) - self.maxPlans]:
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+    def clear(self):
+        """remove all saved plans"""
+        if not os.path.isdir(self.plandir):
+            return
+
+        for f in os.listdir(self.plandir):
+            if f.endswith("." + self.planFileExt):
+                if self.verbose > 1:
+                    print("removing", os.path.join(self.plandir, f), file=utils.stdinfo)
+                try:
+                    os.remove(os.path.join(self.plandir, f))
+                except OSError:
+                    pass
+
+# the names of the variables set by table files' env* and path* commands, and referred to as ${XXX}
+_tableEnvRe = re.compile(r"^\s*(?:env\w+|path\w+|setenv|unsetenv)\s*\(\s*\"?(\w+)", re.IGNORECASE | re.MULTILINE)
+_envRefRe = re.compile(r"\$\??{(\w+)")
@@ -2,7 +2,6 @@
 the Uses class -- a class for tracking product dependencies (used by the remove()
 function).
 """
-import re
 from .utils import cmp_or_key, cmp
 
 #
@@ -23,16 +22,11 @@ class Uses(object):
 
     def __init__(self):
         self._depends_on = {}           # info about products that depend on key
-        self._setup_by = {}             # info about products that setup key, directly or indirectly
-
-    def _getKey(self, p, v):
-        return "%s:%s" % (p, v)
-
-    def _splitKey(self, k):
-        return k.split(":", 1)
+        self._setup_by = {}             # info about products that setup key, directly or indirectly;
+                                        # indexed by product name, then version
 
     def remember(self, p, v, info):
-        key = self._getKey(p, v)
+        key = (p, v)
 
         if key not in self._depends_on:
             self._depends_on[key] = []
@@ -43,48 +37,43 @@ class Uses(object):
         """ Invert the dependencies to tell us who uses what, not who depends on what"""
 
         self._setup_by = {}
-        for k in self._depends_on.keys():
-            productName, versionName = self._splitKey(k)
-            for dname, dver, doptional, ddepth in self._depends_on[k]:
-                key = self._getKey(dname, dver)
-                if key not in self._setup_by:
-                    self._setup_by[key] = []
+        for (productName, versionName), deps in self._depends_on.items():
+            for dname, dver, doptional, ddepth in deps:
+                versions = self._setup_by.setdefault(dname, {})
+                if dver not in versions:
+                    versions[dver] = []
 
-                self._setup_by[key].append((productName, versionName, Props(dver, doptional, ddepth)))
+                versions[dver].append((productName, versionName, Props(dver, doptional, ddepth)))
 
         #
         # Find the minimum depth for each product, and make sure that if a product is labelled required
         # if it is required at any depth
         #
-        for k in self._setup_by.keys():
-            vmin = {}
-            dmin = {}
-            for val in self._setup_by[k]:
-                p, pv, props = val
+        for versions in self._setup_by.values():
+            for k in versions.keys():
+                vmin = {}
+                dmin = {}
+                for val in versions[k]:
+                    p, pv, props = val
 
-                key = "%s-%s" % (p, pv)
-                if key not in dmin or props.depth < dmin[key]:
-                    dmin[key] = props.depth
-                    vmin[key] = val
+                    key = "%s-%s" % (p, pv)
+                    if key not in dmin or props.depth < dmin[key]:
+                        dmin[key] = props.depth
+                        vmin[key] = val
 
-            self._setup_by[k] = list(set(vmin.values())) # Use set() to make values unique
+                versions[k] = list(set(vmin.values())) # Use set() to make values unique
 
     def users(self, productName, versionName=None):
         """Return a list of the users of productName/productVersion; each element of the list is:
         (user, userVersion, (productVersion, optional)"""
+
+        versions = self._setup_by.get(productName, {})
         if versionName:
-            versionName = re.escape(versionName)
+            consumerList = list(versions.get(versionName, []))
         else:
-            versionName = r"[\w.+\-]+"
-
-        versionName = r"(?P<version>%s)" % versionName
-
-        pattern = re.compile(r"^%s$" % self._getKey(productName, versionName))
-        consumerList = []
-        for k in self._setup_by.keys():
-            mat = pattern.match(k)
-            if mat:
-                consumerList += (self._setup_by[k])
+            consumerList = []
+            for v in versions.values():
+                consumerList += v
         #
         # Be nice; sort list
         #
@@ -1,11 +1,28 @@
 import re
+try:
+    from collections import OrderedDict
+except ImportError:                     # python 2.6
+    OrderedDict = None
 
 from .utils import cmp
 
+_componentSplitRe = re.compile(r"[._]")
+_leadingNonDigitsRe = re.compile(r"^([^0-9]+)")
+_prefixedIntRe = re.compile(r"^([^\d]+)(\d+)$")
+_digitsRe = re.compile(r"^\d+$")
+_versionRe = re.compile(r"^([^-+]+)((-)([^-+]+))?((\+)([^-+]+))?")
+_mpSuffixRe = re.compile(r"(m(\d+)|p(\d+))$")
+
 class VersionCompare(object):
     """
     A comparison function class that compares two product versions.
+
+    Sorting many versions with compare() parses each of them many times;
+    sortKey() returns a key, parsed once and remembered, that orders
+    versions as compare() does (see sortArgs()).
     """
+
+    sortKeyCacheSize = 10000            # the maximum number of sort keys to remember
     def compare(self, v1, v2, mustReturnInt=True):
         """Compare two versions.
 
@@ -40,18 +57,18 @@ If mustReturnInt is False and you don't want to allow the versions to be sorted,
             else:
                 return 0
 
-        c1 = re.split(r"[._]", prim1)
-        c2 = re.split(r"[._]", prim2)
+        c1 = _componentSplitRe.split(prim1)
+        c2 = _componentSplitRe.split(prim2)
         #
         # Check that leading non-numerical parts agree
         #
         if not suffix:
             prefix1, prefix2 = "", ""
-            mat = re.search(r"^([^0-9]+)", c1[0])
+            mat = _leadingNonDigitsRe.search(c1[0])
             if mat:
                 prefix1 = mat.group(1)
 
-            mat = re.search(r"^([^0-9]+)", c2[0])
+            mat = _leadingNonDigitsRe.search(c2[0])
             if mat:
                 prefix2 = mat.group(1)
 
@@ -81,10 +98,10 @@ If mustReturnInt is False and you don't want to allow the versions to be sorted,
             try:                        # try to compare as integers, having stripped a common prefix
                 _c2i = None             # used in test for a successfully removing a common prefix
 
-                mat = re.search(r"^([^\d]+)\d+$", c1[i])
+                mat = _prefixedIntRe.search(c1[i])
                 if mat:
                     prefixi = mat.group(1)
-                    if re.search(r"^%s\d+$" % prefixi, c2[i]):
+                    if c2[i].startswith(prefixi) and _digitsRe.search(c2[i][len(prefixi):]):
                         _c1i = int(c1[i][len(prefixi):])
                         _c2i = int(c2[i][len(prefixi):])
 
@@ -128,20 +145,126 @@ If mustReturnInt is False and you don't want to allow the versions to be sorted,
             # a version string such as rel-0-8-2 with more than one hyphen
             return version, "", ""
 
-        mat = re.search(r"^([^-+]+)((-)([^-+]+))?((\+)([^-+]+))?", version)
+        mat = _versionRe.search(version)
         vvv, eee, fff = mat.group(1), mat.group(4), mat.group(7)
 
         if not eee and not fff:             # maybe they used VVVm# or VVVp#?
-            mat = re.search(r"(m(\d+)|p(\d+))$", version)
+            mat = _mpSuffixRe.search(version)
             if mat:
                 suffix, eee, fff = mat.group(1), mat.group(2), mat.group(3)
                 vvv = re.sub(r"%s$" % suffix, "", version)
 
         return vvv, eee, fff
 
+    def sortKey(self, version):
+        """
+        Return a key for version such that sorting versions by their keys
+        orders them as compare() would.  Keys are remembered (up to
+        sortKeyCacheSize of them, discarding the least recently used), so
+        each version is only parsed once.
+
+        The keys agree with stdCompare() for all but pathological versions
+        (for which stdCompare() doesn't define a consistent order anyway,
+        e.g. 2 < 10 < 1a < 2); versions that stdCompare() considers equal
+        despite being spelled differently (e.g. 1.01 and 1.1) are given an
+        order.
+        """
+        try:
+            cache = self._sortKeys
+        except AttributeError:
+            cache = self._sortKeys = OrderedDict() if OrderedDict else {}
+
+        try:
+            key = cache.pop(version)
+        except KeyError:
+            key = self._sortKey(version)
+            if len(cache) >= self.sortKeyCacheSize:
+                if OrderedDict:
+                    cache.popitem(last=False)
+                else:
+                    cache.clear()
+        cache[version] = key
+
+        return key
+
+    def _sortKey(self, version):
+        if not version:
+            return ()
+
+        prim, sec, ter = self._splitVersion(version)
+
+        components = []
+        for c in _componentSplitRe.split(prim):
+            if not c:
+                components.append((-1,))
+                continue
+
+            try:
+                components.append((0, int(c), ""))
+                continue
+            except ValueError:
+                pass
+
+            mat = _prefixedIntRe.search(c)
+            if mat:
+                components.append((1, mat.group(1), int(mat.group(2))))
+            else:
+                components.append((1, c, -1))
+        #
+        # A decrementing annotation (-2) sorts before no annotation
+        #
+        if sec:
+            return (tuple(components), 0, self.sortKey(sec), self.sortKey(ter))
+        else:
+            return (tuple(components), 1, (), self.sortKey(ter))
+
+    def hasSortKey(self):
+        """
+        Return True if sortKey() orders versions as compare() does.  This isn't
+        guaranteed if a subclass overrides compare() (or the functions that it
+        uses) without also overriding sortKey()
+        """
+        def overridden(name):
+            for cls in type(self).__mro__:
+                if cls is VersionCompare:
+                    return False
+                if name in cls.__dict__:
+                    return True
+            return False
+
+        if overridden("sortKey") or overridden("_sortKey"):
+            return True
+
+        return not [m for m in ("compare", "stdCompare", "_splitVersion") if overridden(m)]
+
     def __call__(self, v1, v2, mustReturnInt=True):
         """
         make an instance behave like a callable function
         """
         return self.compare(v1, v2, mustReturnInt)
 
+
+def sortArgs(version_cmp, getVersion=None):
+    """
+    Return the keyword arguments to pass to sort() to order a list by
+    version using the comparison function version_cmp (usually
+    hooks.version_cmp).  When version_cmp is a VersionCompare whose ordering
+    is unchanged, its precomputed sortKey() is used; otherwise (e.g. a
+    custom hooks.version_cmp) the list is sorted by calling version_cmp.
+
+    @param version_cmp   the function used to compare two versions
+    @param getVersion    a function returning the version of an element of
+                           the list; if None, the elements are versions
+    """
+    from .utils import cmp_or_key
+
+    if isinstance(version_cmp, VersionCompare) and version_cmp.hasSortKey():
+        if getVersion:
+            return dict(key=lambda x: version_cmp.sortKey(getVersion(x)))
+        else:
+            return dict(key=version_cmp.sortKey)
+
+    if getVersion:
+        return cmp_or_key(lambda a, b: version_cmp(getVersion(a), getVersion(b)))
+    else:
+        return cmp_or_key(version_cmp)
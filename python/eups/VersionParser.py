@@ -1,4 +1,5 @@
 """A simple recursive descent parser for logical expressions"""
+from __future__ import print_function
 
 import os
 import re
@@ -181,3 +182,145 @@ names are declared using VersionParser.define()
             return term
 
         return self._next()
+
+class VersionExpression(object):
+    """A version expression such as ">= 3.2 && < 4", parsed once so that it may be applied to many versions.
+
+    The grammar (as accepted by Eups.version_match()) is a sequence of terms separated by || (or) or && (and),
+    evaluated left to right; each term is "relop version" (relop being one of < <= == >= >), or a bare version
+    (meaning == version).
+
+    Use VersionExpression.compile() rather than the constructor, as it remembers the expressions that it has seen
+        """
+
+    _relop_re = re.compile(r"<=?|>=?|==")
+    _split_re = re.compile(r"\s*(%s|\|\||\s)\s*" % _relop_re.pattern)
+    _version_re = re.compile(r"^[-+.:/\w]+$")
+
+    _compiled = {}                      # expressions that we've already compiled
+    maxCompiled = 1000                  # the maximum number of compiled expressions to remember
+
+    @classmethod
+    def compile(cls, expr):
+        """Return the VersionExpression for the string expr, reusing a previously compiled one if possible"""
+
+        try:
+            return cls._compiled[expr]
+        except KeyError:
+            pass
+
+        if len(cls._compiled) >= cls.maxCompiled:
+            cls._compiled.clear()
+
+        compiled = cls(expr)
+        cls._compiled[expr] = compiled
+
+        return compiled
+
+    def __init__(self, expr):
+        from .utils import stdwarn
+
+        self.expr = expr
+        #
+        # Convert the expression to a list of steps:
+        #   ("term", relop, version)
+        #   ("or",) or ("and",)
+        #   ("skip",)               a term not preceded by a logical operator; ignored
+        #   ("stop",)               an unexpected operator; evaluation stops
+        #   ("truncated",)          a relop at the end of the expression
+        #
+        tokens = [x for x in self._split_re.split(expr) if x and not x.isspace()]
+
+        self._steps = []
+        sawTerm, sawLogop = False, False
+        i = -1
+        while i < len(tokens) - 1:
+            i += 1
+
+            if self._relop_re.search(tokens[i]):
+                relop = tokens[i]; i += 1
+                if i == len(tokens):
+                    self._steps.append(("truncated",))
+                    break
+                v = tokens[i]
+            elif self._version_re.search(tokens[i]) and tokens[i] not in ("and", "or"):
+                relop = "=="
+                v = tokens[i]
+            elif tokens[i] == "||" or tokens[i] == "or":
+                self._steps.append(("or",))
+                sawLogop = True
+                continue
+            elif tokens[i] == "&&" or tokens[i] == "and":
+                self._steps.append(("and",))
+                sawLogop = True
+                continue
+            else:
+                print("Unexpected operator %s in \"%s\"" % (tokens[i], expr), file=stdwarn)
+                self._steps.append(("stop",))
+                break
+
+            if not sawLogop and sawTerm:
+                print("Expected logical operator || or && in \"%s\" at %s" % (expr, v), file=stdwarn)
+                self._steps.append(("skip",))
+            else:
+                self._steps.append(("term", relop, v))
+                sawTerm = True
+
+    def match(self, vname, compare):
+        """Return vname if it matches the expression, else None (or False)
+
+        @param compare    a function compare(relop, vname, version) returning True if vname relop version
+                          is satisfied; it should raise ValueError if the versions cannot be ordered
+                          (e.g. Eups.version_match_prim)
+        """
+        logop = None                    # the next logical operation to process
+        value = None                    # the value of the current term (e.g. ">= 2.0.0")
+        for step in self._steps:
+            what = step[0]
+            if what == "or":
+                logop = "or"
+                continue
+            elif what == "and":
+                if not value:
+                    return False        # short circuit
+
+                logop = "and"
+                continue
+            elif what == "skip":
+                continue
+            elif what == "stop":
+                break
+            elif what == "truncated":
+                raise IndexError("Expected a version after the last operator in \"%s\"" % self.expr)
+
+            try:
+                rhs = compare(step[1], vname, step[2])
+            except ValueError:          # no sort order is defined
+                return None
+
+            if not logop:
+                value = rhs
+            elif logop == "and":
+                value = bool(value and rhs)
+            elif logop == "or":
+                if value or rhs:
+                    return vname
+
+                value = False
+
+        if value:
+            return vname
+        else:
+            return None
+
+    def filter(self, items, compare, getVersion=None):
+        """Return the elements of items whose versions match the expression
+
+        @param compare     as for match()
+        @param getVersion  a function returning the version of an element of items; if None, the elements
+                           are versions
+        """
+        if getVersion:
+            return [x for x in items if self.match(getVersion(x), compare)]
+        else:
+            return [x for x in items if self.match(x, compare)]
@@ -3,7 +3,7 @@ from .exceptions import *
 from .tags       import Tags, Tag, TagNotRecognized
 from .Product    import Product
 from .Eups       import Eups
-from .cmd        import commandCallbacks
+from .cmdbase    import commandCallbacks
 
 from . import utils
 
@@ -10,16 +10,17 @@ try:
     import cPickle as pickle
 except ImportError:
     import pickle
-from .distrib import builder
 from .Eups           import Eups
 from .exceptions     import ProductNotFound
 from .tags           import Tag, checkTagsList
 from .Product import Product
 from .VersionParser  import VersionParser
+from .VersionCompare import sortArgs as versionSortArgs
 from .stack          import ProductStack, persistVersionName as cacheVersion
-from . import utils, table, hooks
+from .SetupPlan      import SetupPlanCache
+from . import utils, table, hooks, timing
 from .exceptions import EupsException
-from .utils import cmp_or_key, cmp
+from .utils import cmp
 
 def printProducts(ostrm, productName=None, versionName=None, eupsenv=None,
                   tags=None, setup=False, tablefile=False, directory=False,
@@ -333,6 +334,8 @@ def printUses(outstrm, productName, versionName=None, eupsenv=None,
         fd = open(pickleFile[1:])
         usesInfo = pickle.load(fd)
         fd.close()
+    elif not pickleFile:
+        usesInfo = None                 # only look at products that might use productName
     else:
         usesInfo = eupsenv.uses()
         if pickleFile:
@@ -412,6 +415,8 @@ def expandBuildFile(ofd, ifd, product, version, svnroot=None, cvsroot=None, repo
     @param verbose  an integer verbosity level where larger values result
                        in more messages
     """
+    from .distrib import builder
+
     builderVars = hooks.config.distrib["builder"]["variables"]
 
     if cvsroot:
@@ -551,7 +556,9 @@ def undeclare(productName, versionName=None, eupsPathDir=None, tag=None,
 
 def clearCache(path=None, flavors=None, inUserDir=False, verbose=0):
     """
-    remove the product cache for given stacks/databases and flavors
+    remove the product cache for given stacks/databases and flavors, along
+    with the cache of parsed table files kept next to it and the user's
+    cache of setup plans
     @param path     the stacks to clear caches for.  This can be given either
                         as a python list or a colon-delimited string.  If
                         None (default), EUPS_PATH will be used.
@@ -563,6 +570,62 @@ def clearCache(path=None, flavors=None, inUserDir=False, verbose=0):
                         cleared.
     @params verbose   chattiness
     """
+    if utils.is_string(flavors):
+        flavors = flavors.split()
+
+    for p, dbpath, persistDir in _cacheDirs(path, inUserDir):
+        flavs = flavors
+        if flavs is None:
+            flavs = ProductStack.findCachedFlavors(persistDir)
+        if not flavs:
+            # there may still be parsed tables to clear
+            if os.path.isdir(dbpath):
+                ProductStack(dbpath, persistDir,
+                             autosave=False).clearTableCache(verbose=verbose)
+            continue
+
+        ProductStack.fromCache(dbpath, flavs, persistDir=persistDir,
+                               autosave=False).clearCache(verbose=verbose)
+
+    SetupPlanCache(path, verbose=verbose).clear() # the plans may refer to the cleared caches
+
+def verifyCache(path=None, flavors=None, inUserDir=False, verbose=0):
+    """
+    check the product cache for given stacks/databases and flavors against
+    every file in the databases, updating any products found to be out of
+    date.  Normally a cache is only checked against its database's
+    generation, which is not maintained by older versions of EUPS (or by
+    editing the database by hand).
+    @param path     the stacks to verify caches for.  This can be given either
+                        as a python list or a colon-delimited string.  If
+                        None (default), EUPS_PATH will be used.
+    @param flavors  the flavors to verify the cache for.  This can either
+                        be a python list or space-delimited string.  If None,
+                        verify caches for all flavors.
+    @param inUserDir  if True, it will be assumed that it is the cache in the
+                        user's data directory that should be verified.
+    @params verbose   chattiness
+    """
+    if utils.is_string(flavors):
+        flavors = flavors.split()
+
+    for p, dbpath, persistDir in _cacheDirs(path, inUserDir):
+        flavs = flavors
+        if flavs is None:
+            flavs = ProductStack.findCachedFlavors(persistDir)
+        if not flavs:
+            continue
+
+        userTagDir = None
+        if persistDir != dbpath:
+            userTagDir = persistDir
+
+        ProductStack.fromCache(dbpath, flavs, persistDir=persistDir,
+                               userTagDir=userTagDir, autosave=False,
+                               verify=True, verbose=verbose)
+
+def _cacheDirs(path=None, inUserDir=False):
+    # return (stack, database, cache directory) for each stack in path with a cache
     if path is None:
         path = os.environ["EUPS_PATH"]
     if utils.is_string(path):
@@ -572,11 +635,9 @@ def clearCache(path=None, flavors=None, inUserDir=False, verbose=0):
     path.append(userDataDir)
 
     if not inUserDir:
-        userDataDir = None              # Clear the system cache, not the one in userDataDir
-
-    if utils.is_string(flavors):
-        flavors = flavors.split()
+        userDataDir = None              # Use the system cache, not the one in userDataDir
 
+    out = []
     for p in path:
         dbpath = os.path.join(p, Eups.ups_db)
 
@@ -588,14 +649,8 @@ def clearCache(path=None, flavors=None, inUserDir=False, verbose=0):
             print("No cache yet for %s; skipping..." % p, file=utils.stdwarn)
             continue
 
-        flavs = flavors
-        if flavs is None:
-            flavs = ProductStack.findCachedFlavors(persistDir)
-        if not flavs:
-            continue
-
-        ProductStack.fromCache(dbpath, flavs, persistDir=persistDir,
-                               autosave=False).clearCache(verbose=verbose)
+        out.append((p, dbpath, persistDir))
+    return out
 
 def listCache(path=None, verbose=0, flavor=None):
     if path is None:
@@ -630,7 +685,7 @@ def listCache(path=None, verbose=0, flavor=None):
 
         for productName in productNames:
             versionNames = cache.getVersions(productName)
-            versionNames.sort(**cmp_or_key(hooks.version_cmp))
+            versionNames.sort(**versionSortArgs(hooks.version_cmp))
 
             print("  %-20s %s" % (productName, " ".join(versionNames)))
 
@@ -703,11 +758,95 @@ def setup(productName, version=None, prefTags=None, productRoot=None,
     if postTags:
         checkTagsList(eupsenv, postTags)
 
+    ok, version, reason = _setupProduct(productName, version, prefTags, productRoot,
+                                        eupsenv, fwd, tablefile, postTags)
+
+    if ok:
+        cmds = _setupCommands(eupsenv, [productName], fwd)
+    else:
+        cmds = _setupFailed(productName, version, reason, eupsenv, fwd)
+
+    return cmds
+
+def setupMany(products, prefTags=None, eupsenv=None, fwd=True, exact_version=False, postTags=[]):
+    """
+    Return a set of shell commands which, when sourced, will setup (or, if
+    fwd is false, unsetup) a number of products.  The products are all
+    setup by the same Eups instance, so the cost of creating it (loading
+    customizations, caches, and tags) is only paid once, and a single list
+    of commands reflecting all of the changes to the environment is
+    returned.  Products are setup in the order given, so later products
+    see the environment (and versions) established by earlier ones.
+
+    If a product cannot be setup, a message is printed, the remaining
+    products are still setup, and the returned commands end with "false"
+    so that sourcing them reports failure.
+
+    @param products        the products to setup.  Each element is a
+                             product name, a (name, version) tuple, or a
+                             string of the form "name [version]".
+    @param prefTags        the list of requested tags (n.b. the VRO already knows about them)
+    @param eupsenv         the Eups instance to use to do the setup.  If
+                             None, one will be created for it.
+    @param fwd             If False, actually do an unsetup.
+    @param postTags        the list of requested post-tags (n.b. the VRO already knows about them)
+    """
+    specs = []
+    for p in products:
+        if utils.is_string(p):
+            p = p.split()
+        else:
+            p = list(p)
+        if not p or len(p) > 2:
+            raise EupsException("Invalid product specification: %s" % (products,))
+        if len(p) == 1:
+            p.append(None)
+        specs.append(tuple(p))
+
+    if not eupsenv:
+        eupsenv = Eups(readCache=False, exact_version=exact_version)
+        versions = [v for n, v in specs if v]
+        if versions:
+            eupsenv.selectVRO(versionName=versions[0])
+
+    if utils.is_string(prefTags):
+        prefTags = prefTags.split()
+    elif isinstance(prefTags, Tag):
+        prefTags = [prefTags]
+
+    if prefTags is None:
+        prefTags = []
+    if postTags is None:
+        postTags = []
+
+    if prefTags:
+        checkTagsList(eupsenv, prefTags)
+    if postTags:
+        checkTagsList(eupsenv, postTags)
+
+    failed = []
+    for productName, version in specs:
+        ok, version, reason = _setupProduct(productName, version, prefTags, None,
+                                            eupsenv, fwd, None, postTags)
+        if not ok:
+            failed += _setupFailed(productName, version, reason, eupsenv, fwd)
+
+    cmds = _setupCommands(eupsenv, [n for n, v in specs], fwd)
+    if failed:
+        cmds += ["false"]               # as in /bin/false
+
+    return cmds
+
+def _setupProduct(productName, version, prefTags, productRoot, eupsenv, fwd, tablefile, postTags):
+    """
+    (un)setup a product using eupsenv, checking that the version set up is
+    the one requested by tag.  Return (ok, version, reason) as returned by
+    Eups.setup()
+    """
     versionRequested = version
     ok, version, reason = eupsenv.setup(productName, version, fwd,
                                         productRoot=productRoot, tablefile=tablefile)
 
-    cmds = []
     if ok:
         #
         # Check that we got the desired tag
@@ -742,101 +881,120 @@ def setup(productName, version=None, prefTags=None, productRoot=None,
                         print("No versions of %s are tagged%s %s; setup version is %s" % \
                               (productName, extra, ",".join(prefTags + postTags), version), file=utils.stdwarn)
 
-        #
-        # Set new variables
-        #
-        for key, val in os.environ.items():
-            try:
-                if val == eupsenv.oldEnviron[key]:
-                    continue
-            except KeyError:
-                pass
 
-            if val and not re.search(r"^['\"].*['\"]$", val) and \
-                   re.search(r"[\s<>|&;()]", val):   # quote characters that the shell cares about
-                val = "'%s'" % val
+    return ok, version, reason
+
+@timing.timed("setupCommands")
+def _setupCommands(eupsenv, productNames, fwd):
+    """
+    Return the shell commands that reproduce the changes that eupsenv has made
+    to the environment (and aliases) while (un)setting up productNames
+    """
+    cmds = []
+    #
+    # Set new variables
+    #
+    for key, val in os.environ.items():
+        try:
+            if val == eupsenv.oldEnviron[key]:
+                continue
+        except KeyError:
+            pass
 
-            if eupsenv.shell in ("sh", "zsh",):
-                cmd = "export %s=%s" % (key, val)
-            elif eupsenv.shell in ("csh",):
-                cmd = "setenv %s %s" % (key, val)
+        if val and not re.search(r"^['\"].*['\"]$", val) and \
+               re.search(r"[\s<>|&;()]", val):   # quote characters that the shell cares about
+            val = "'%s'" % val
 
-            if eupsenv.noaction:
-                if eupsenv.verbose < 2 and re.search(utils.setupEnvPrefix(), key):
-                    continue            # these variables are an implementation detail
+        if eupsenv.shell in ("sh", "zsh",):
+            cmd = "export %s=%s" % (key, val)
+        elif eupsenv.shell in ("csh",):
+            cmd = "setenv %s %s" % (key, val)
 
-                cmd = "echo \"%s\"" % cmd
+        if eupsenv.noaction:
+            if eupsenv.verbose < 2 and re.search(utils.setupEnvPrefix(), key):
+                continue            # these variables are an implementation detail
 
-            cmds += [cmd]
-        #
-        # Extra environment variables that EUPS uses
-        #
-        if not fwd and productName == "eups":
-            for k in ("EUPS_PATH", "EUPS_PKGROOT", "EUPS_SHELL",):
-                if k in os.environ:
-                    del os.environ[k]
-        #
-        # unset ones that have disappeared
-        #
-        for key in eupsenv.oldEnviron.keys():
-            if productName != "eups":   # the world will break if we delete these
-                if re.search(r"^EUPS_(DIR|PATH|PKGROOT|SHELL)$", key):
-                    continue
+            cmd = "echo \"%s\"" % cmd
 
-            if key in os.environ:
+        cmds += [cmd]
+    #
+    # Extra environment variables that EUPS uses
+    #
+    if not fwd and "eups" in productNames:
+        for k in ("EUPS_PATH", "EUPS_PKGROOT", "EUPS_SHELL",):
+            if k in os.environ:
+                del os.environ[k]
+    #
+    # unset ones that have disappeared
+    #
+    for key in eupsenv.oldEnviron.keys():
+        if "eups" not in productNames: # the world will break if we delete these
+            if re.search(r"^EUPS_(DIR|PATH|PKGROOT|SHELL)$", key):
                 continue
 
-            if eupsenv.shell == "sh" or eupsenv.shell == "zsh":
-                cmd = "unset %s" % (key)
-            elif eupsenv.shell == "csh":
-                cmd = "unsetenv %s" % (key)
+        if key in os.environ:
+            continue
 
-            if eupsenv.noaction:
-                if eupsenv.verbose < 2 and re.search(utils.setupEnvPrefix(), key):
-                    continue            # an implementation detail
+        if eupsenv.shell == "sh" or eupsenv.shell == "zsh":
+            cmd = "unset %s" % (key)
+        elif eupsenv.shell == "csh":
+            cmd = "unsetenv %s" % (key)
 
-                cmd = "echo \"%s\"" % cmd
+        if eupsenv.noaction:
+            if eupsenv.verbose < 2 and re.search(utils.setupEnvPrefix(), key):
+                continue            # an implementation detail
 
-            cmds += [cmd]
-        #
-        # Now handle aliases
-        #
-        for key in eupsenv.aliases.keys():
-            value = eupsenv.aliases[key]
+            cmd = "echo \"%s\"" % cmd
 
-            try:
-                if value == eupsenv.oldAliases[key]:
-                    continue
-            except KeyError:
-                pass
+        cmds += [cmd]
+    #
+    # Now handle aliases
+    #
+    for key in eupsenv.aliases.keys():
+        value = eupsenv.aliases[key]
 
-            if eupsenv.shell == "sh":
-                cmd = "%s() { %s ; }" % (key, value)
-            elif eupsenv.shell == "csh":
-                value = re.sub(r'"?\$@"?', r"\!*", value)
-                cmd = "alias %s \'%s\'" % (key, value)
+        try:
+            if value == eupsenv.oldAliases[key]:
+                continue
+        except KeyError:
+            pass
 
-            if eupsenv.noaction:
-                cmd = "echo \"%s\"" % re.sub(r"`", r"\`", cmd)
+        if eupsenv.shell == "sh":
+            cmd = "%s() { %s ; }" % (key, value)
+        elif eupsenv.shell == "csh":
+            value = re.sub(r'"?\$@"?', r"\!*", value)
+            cmd = "alias %s \'%s\'" % (key, value)
 
-            cmds += [cmd]
-        #
-        # and unset ones that used to be present, but are now gone
-        #
-        for key in eupsenv.oldAliases.keys():
-            if key in eupsenv.aliases:
-                continue
+        if eupsenv.noaction:
+            cmd = "echo \"%s\"" % re.sub(r"`", r"\`", cmd)
 
-            if eupsenv.shell == "sh" or eupsenv.shell == "zsh":
-                cmd = "unset %s" % (key)
-            elif eupsenv.shell == "csh":
-                cmd = "unalias %s" % (key)
+        cmds += [cmd]
+    #
+    # and unset ones that used to be present, but are now gone
+    #
+    for key in eupsenv.oldAliases.keys():
+        if key in eupsenv.aliases:
+            continue
 
-            if eupsenv.noaction:
-                cmd = "echo \"%s\"" % cmd
+        if eupsenv.shell == "sh" or eupsenv.shell == "zsh":
+            cmd = "unset %s" % (key)
+        elif eupsenv.shell == "csh":
+            cmd = "unalias %s" % (key)
 
-            cmds += [cmd]
-    elif fwd and version is None:
+        if eupsenv.noaction:
+            cmd = "echo \"%s\"" % cmd
+
+        cmds += [cmd]
+
+    return cmds
+
+def _setupFailed(productName, version, reason, eupsenv, fwd):
+    """
+    Report a failure to (un)setup a product, returning the shell commands to
+    issue
+    """
+    cmds = []
+    if fwd and version is None:
         print("Unable to find an acceptable version of", productName, file=utils.stderr)
         if eupsenv.verbose and os.path.exists(productName):
             print("(Did you mean setup -r %s?)" % productName, file=utils.stderr)
@@ -36,14 +36,12 @@ import re
 import os
 import sys
 import copy
-import optparse
 import eups
 from . import lock
 from . import tags
 from . import utils
-from . import distrib
 from . import hooks
-from .distrib.server import ServerConf, Mapping, importClass
+from .cmdbase import CommandCallbacks, commandCallbacks, EupsOptionParser
 
 _errstrm = utils.stderr
 
@@ -98,7 +96,7 @@ Common"""
 
     def addOptions(self):
         self.clo.add_option("--debug", dest="debug", action="store", default="",
-                            help="turn on specified debugging behaviors (allowed: debug, profile, raise)")
+                            help="turn on specified debugging behaviors (allowed: debug, profile, raise, timing)")
         self.clo.add_option("-h", "--help", dest="help", action="store_true",
                             help="show command-line help and exit")
         self.clo.add_option("--noCallbacks", dest="noCallbacks", action="store_true",
@@ -346,52 +344,6 @@ Common"""
 
         return myeups
 
-#-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
-
-class CommandCallbacks(object):
-    """Callback to allow users to customize behaviour by defining hooks in EUPS_STARTUP
-        and calling eups.commandCallbacks.add(hook)"""
-
-    callbacks = []
-
-    def __init__(self):
-        pass
-
-    def add(self, callback):
-        """
-        Add a command callback.
-
-        The arguments are the command (e.g. "admin" if you type "eups admin")
-        and sys.argv, which you may modify;  cmd == argv[1] if len(argv) > 1 otherwise None
-
-        E.g.
-        if cmd == "fetch":
-            argv[1:2] = ["distrib", "install"]
-        """
-        CommandCallbacks.callbacks += [callback]
-
-    def apply(self, myeups, cmd, opts, args):
-        """Call the command callbacks on cmd"""
-
-        if opts.noCallbacks:
-            return
-
-        for hook in CommandCallbacks.callbacks:
-            hook(myeups, cmd, opts, args)
-
-    def clear(self):
-        """Clear the list of command callbacks"""
-        CommandCallbacks.callbacks = []
-
-    def list(self):
-        for hook in CommandCallbacks.callbacks:
-            print(hook, file=sys.stderr)
-
-try:
-    type(commandCallbacks)
-except NameError:
-    commandCallbacks = CommandCallbacks()
-
 #=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-==-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
 
 class FlavorCmd(EupsCmd):
@@ -1519,7 +1471,7 @@ where it is installed.
 
 class AdminCmd(EupsCmd):
 
-    usage = "%prog admin [buildCache|clearCache|listCache|clearLocks|listLocks|clearServerCache|info|show] [-h|--help] [-r root]"
+    usage = "%prog admin [buildCache|clearCache|listCache|verifyCache|clearLocks|listLocks|clearServerCache|info|show] [-h|--help] [-r root]"
 
     # set this to True if the description is preformatted.  If false, it
     # will be automatically reformatted to fit the screen
@@ -1624,6 +1576,36 @@ class AdminClearCacheCmd(EupsCmd):
 
         return 0
 
+class AdminVerifyCacheCmd(EupsCmd):
+
+    usage = "%prog admin verifyCache [-h|--help] [options]"
+
+    # set this to True if the description is preformatted.  If false, it
+    # will be automatically reformatted to fit the screen
+    noDescriptionFormatting = False
+
+    description = \
+"""Check the cache against every file in the database, updating any out-of-date products.
+This is only needed if the database was modified other than by this version of eups."""
+
+    def addOptions(self):
+        # always call the super-version so that the core options are set
+        EupsCmd.addOptions(self)
+
+        self.clo.add_option("-A", "--admin-mode", dest="asAdmin", action="store_true", default=False,
+                            help="apply cache operations to caches under EUPS_PATH")
+
+    def execute(self):
+        self.args.pop(0)                # remove the "admin"
+
+        if len(self.args) > 0:
+            self.err("Unexpected arguments: %s" % " ".join(self.args))
+            return 1
+
+        eups.verifyCache(inUserDir=not self.opts.asAdmin, verbose=self.opts.verbose)
+
+        return 0
+
 class AdminClearLocksCmd(EupsCmd):
 
     usage = "%prog admin clearLocks [-h|--help] [options]"
@@ -1712,6 +1694,8 @@ class AdminClearServerCacheCmd(EupsCmd):
                             "(may be a URL or scp specification).  Default: find in $EUPS_PKGROOT")
 
     def execute(self):
+        from .distrib.server import ServerConf
+
         self.args.pop(0)                # remove the "admin"
 
         if len(self.args) > 0:
@@ -1980,6 +1964,9 @@ If no product or version is provided, all defined tags are defined.
         EupsCmd.addOptions(self)
 
     def execute(self):
+        from . import distrib
+        from .distrib.server import importClass
+
         # get rid of sub-command arg
         self.args.pop(0)
 
@@ -2089,6 +2076,8 @@ slowly as each product's availability will be checked.
                             help="equivalent to --server-dir (deprecated)")
 
     def execute(self):
+        from . import distrib
+
         myeups = eups.Eups(readCache=False)
         if self.opts.tag:
             # Note: tag may not yet be registered locally, yet; though it may be
@@ -2182,6 +2171,8 @@ tag will be installed.
 """
 
     def addOptions(self):
+        from . import distrib
+
         self.clo.enable_interspersed_args()
 
         self.clo.add_option("-d", "--declareAs", dest="alsoTag", action="append", metavar="TAG",
@@ -2216,6 +2207,8 @@ tag will be installed.
                             help="Build products in this directory")
         self.clo.add_option("--nobuild", dest="nobuild", action="store_true", default=False,
                             help="Don't attempt to build the product; just declare it")
+        self.clo.add_option("--jobs", dest="jobs", action="store", type="int", default=1, metavar="N",
+                            help="Build up to N independent products at once")
 
         # these options are used to configure the Eups instance
         self.addEupsOptions()
@@ -2241,6 +2234,8 @@ tag will be installed.
                             help="Make top level product current (equivalent to --tag current)")
 
     def execute(self):
+        from . import distrib
+
         try:
             _opts = copy.deepcopy(self.opts)
             _opts.tag = None
@@ -2364,7 +2359,7 @@ tag will be installed.
             repos.install(productName, versionName, updateTags,
                           self.opts.alsoTag, self.opts.depends,
                           self.opts.noclean, self.opts.noeups, dopts,
-                          self.opts.manifest, self.opts.searchDep)
+                          self.opts.manifest, self.opts.searchDep, jobs=self.opts.jobs)
         except eups.EupsException as e:
             e.status = 1
             if log:
@@ -2402,11 +2397,15 @@ class DistribCleanCmd(EupsCmd):
 This will remove the build directory as well as (if possible) a partially
 installed product if they exist.  If the -R is provided, the installed
 product will be fully removed, even if its installation was successful.
+With --cache, empty the cache of downloaded files kept in your user data
+directory (in which case the product and version are optional).
 """
 
     def addOptions(self):
         self.clo.enable_interspersed_args()
 
+        self.clo.add_option("--cache", dest="cache", action="store_true", default=False,
+                            help="Empty the cache of files downloaded from servers")
         self.clo.add_option("-P", "--product-dir", dest="pdir", action="store", metavar="DIR",
                             help="Assume the DIR is the product's installation/root directory")
         self.clo.add_option("-R", "--remove", dest="remove", action="store_true", default=False,
@@ -2435,9 +2434,22 @@ product will be fully removed, even if its installation was successful.
                             help="equivalent to --repository (deprecated)")
 
     def execute(self):
+        from . import distrib
+
         # get rid of sub-command arg
         self.args.pop(0)
 
+        if self.opts.cache:
+            from .distrib.DownloadCache import DownloadCache
+
+            downloadCache = DownloadCache(0, verbose=self.opts.verbose)
+            nfile, nbyte = downloadCache.clean()
+            if self.opts.verbose > 0:
+                print("Removed %d files (%.1f Mb) from %s" % (nfile, nbyte/1024.0/1024, downloadCache.cacheDir),
+                      file=utils.stdinfo)
+            if len(self.args) == 0:
+                return 0
+
         if len(self.args) == 0:
             self.err("Please specify a product name and version")
             return 2
@@ -2566,6 +2578,9 @@ class DistribCreateCmd(EupsCmd):
 
 
     def execute(self):
+        from . import distrib
+        from .distrib.server import Mapping
+
         # get rid of sub-command arg
         self.args.pop(0)
 
@@ -2831,6 +2846,8 @@ The tagname may be a glob pattern.
                             help="equivalent to --server-dir (deprecated)")
 
     def execute(self):
+        from . import distrib
+
         myeups = eups.Eups(readCache=False)
 
         # get rid of sub-command arg
@@ -3134,41 +3151,6 @@ def makeEupsCmd(cmdName, cmd):
 
     return ecmd
 
-#=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-==-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
-
-class EupsOptionParser(optparse.OptionParser):
-    """
-    a specialization for parsing the eups command line.  In particular, the
-    options that appear in the help messages will depend on the command
-    being accessed.
-    """
-
-    def __init__(self, helpstrm=None, usage=None, description=None,
-                 formatdesc=True, prog=None):
-
-        optparse.OptionParser.__init__(self, usage=usage,
-                                       description=description,
-                                       prog=prog,
-                                       add_help_option=False,
-                                       conflict_handler="resolve")
-
-        self._preformattedDescr = not formatdesc
-        if not helpstrm:
-            helpstrm = _errstrm
-        self._helpstrm = helpstrm
-
-    def print_help(self):
-        optparse.OptionParser.print_help(self, self._helpstrm) # optparse.OptionParser is an old-style class, damn them
-
-    def format_description(self, formatter):
-        """
-        a specialization of the optparse.OptionParser method.
-        """
-        if self._preformattedDescr:
-            return self.description
-        else:
-            return optparse.OptionParser.format_description(self, formatter)
-
 #=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-==-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
 #
 #  REGISTER
@@ -3189,6 +3171,7 @@ register("remove",       RemoveCmd)
 register("admin",                  AdminCmd, lockType=None) # must be None, as subcommands take locks
 register("admin buildCache",       AdminBuildCacheCmd)
 register("admin clearCache",       AdminClearCacheCmd)
+register("admin verifyCache",      AdminVerifyCacheCmd)
 register("admin clearServerCache", AdminClearServerCacheCmd)
 register("admin clearLocks",       AdminClearLocksCmd, lockType=None)
 register("admin listLocks",        AdminListLocksCmd, lockType=None)
@@ -0,0 +1,90 @@
+"""
+the parts of the EUPS command-line tools that every command needs (including
+setup, which doesn't otherwise need eups.cmd): the user's command callbacks
+and the option parser.  They are available from eups.cmd too.
+"""
+from __future__ import absolute_import, print_function
+import sys
+import optparse
+from . import utils
+
+_errstrm = utils.stderr
+
+class CommandCallbacks(object):
+    """Callback to allow users to customize behaviour by defining hooks in EUPS_STARTUP
+        and calling eups.commandCallbacks.add(hook)"""
+
+    callbacks = []
+
+    def __init__(self):
+        pass
+
+    def add(self, callback):
+        """
+        Add a command callback.
+
+        The arguments are the command (e.g. "admin" if you type "eups admin")
+        and sys.argv, which you may modify;  cmd == argv[1] if len(argv) > 1 otherwise None
+
+        E.g.
+        if cmd == "fetch":
+            argv[1:2] = ["distrib", "install"]
+        """
+        CommandCallbacks.callbacks += [callback]
+
+    def apply(self, myeups, cmd, opts, args):
+        """Call the command callbacks on cmd"""
+
+        if opts.noCallbacks:
+            return
+
+        for hook in CommandCallbacks.callbacks:
+            hook(myeups, cmd, opts, args)
+
+    def clear(self):
+        """Clear the list of command callbacks"""
+        CommandCallbacks.callbacks = []
+
+    def list(self):
+        for hook in CommandCallbacks.callbacks:
+            print(hook, file=sys.stderr)
+
+try:
+    type(commandCallbacks)
+except NameError:
+    commandCallbacks = CommandCallbacks()
+
+#=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-==-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+
+class EupsOptionParser(optparse.OptionParser):
+    """
+    a specialization for parsing the eups command line.  In particular, the
+    options that appear in the help messages will depend on the command
+    being accessed.
+    """
+
+    def __init__(self, helpstrm=None, usage=None, description=None,
+                 formatdesc=True, prog=None):
+
+        optparse.OptionParser.__init__(self, usage=usage,
+                                       description=description,
+                                       prog=prog,
+                                       add_help_option=False,
+                                       conflict_handler="resolve")
+
+        self._preformattedDescr = not formatdesc
+        if not helpstrm:
+            helpstrm = _errstrm
+        self._helpstrm = helpstrm
+
+    def print_help(self):
+        optparse.OptionParser.print_help(self, self._helpstrm) # optparse.OptionParser is an old-style class, damn them
+
+    def format_description(self, formatter):
+        """
+        a specialization of the optparse.OptionParser method.
+        """
+        if self._preformattedDescr:
+            return self.description
+        else:
+            return optparse.OptionParser.format_description(self, formatter)
@@ -2,12 +2,13 @@ from __future__ import absolute_import
 
 import os
 import re
+import uuid
 from .VersionFile import VersionFile
 from .ChainFile import ChainFile
 import eups.tags
 from eups.Product import Product
 from eups.exceptions import UnderSpecifiedProduct, ProductNotFound, TableFileNotFound
-from eups.utils import xrange, cmp_or_key, is_string
+from eups.utils import xrange, cmp_or_key, is_string, AtomicFile
 
 versionFileExt = "version"
 versionFileTmpl = "%s." + versionFileExt
@@ -15,6 +16,14 @@ versionFileRe = re.compile(r'^(\w.*)\.%s$' % versionFileExt)
 tagFileExt = "chain"
 tagFileTmpl = "%s." + tagFileExt
 tagFileRe = re.compile(r'^(\w.*)\.%s$' % tagFileExt)
+generationFile = "_generation_"
+journalFile = "_journal_"
+journalHeaderRe = re.compile(r'^#.* from generation (\d+)')
+
+# the journal is trimmed to the most recent journalKeep generations once it
+# covers more than journalMax of them
+journalMax = 2000
+journalKeep = 1000
 
 try:
     _databases
@@ -238,6 +247,183 @@ class _Database(object):
                     break
         return out
 
+    def getProductTimestamps(self, productNames=None):
+        """
+        return the modification times of the files that record the declared
+        state of each product.  The result is a dictionary keyed by product
+        name; each value is a dictionary mapping the names of the product's
+        version and chain files to their modification times, with the time
+        of the product directory itself recorded under ".".  Comparing the
+        results of two calls reveals which products have changed in between.
+
+        @param productNames  the products of interest.  If None, all product
+                                directories in the database are examined.
+        """
+        if productNames is None:
+            productNames = [z for z in os.listdir(self.dbpath) if not z.startswith('.') and
+                            os.path.isdir(os.path.join(self.dbpath,z))]
+
+        out = {}
+        for name in productNames:
+            pdir = self._productDir(name)
+            try:
+                times = { ".": os.stat(pdir).st_mtime }
+                for file in os.listdir(pdir):
+                    if versionFileRe.match(file) or tagFileRe.match(file):
+                        times[file] = os.stat(os.path.join(pdir, file)).st_mtime
+            except OSError:
+                # product is not (or no longer) declared
+                continue
+            out[name] = times
+
+        return out
+
+    def getGeneration(self, dbdir=None):
+        """
+        return the generation of the database: a string that changes every
+        time a product is declared, undeclared, tagged or untagged via this
+        interface.  None is returned if no generation has been recorded
+        (e.g. the database has only been updated by older versions of EUPS).
+
+        @param dbdir   the database directory to consult; if None, this
+                          defaults to the database root.  This may also be
+                          a user tag directory.
+        """
+        if not dbdir:
+            dbdir = self.dbpath
+        try:
+            fd = open(os.path.join(dbdir, generationFile))
+            try:
+                return fd.read().strip() or None
+            finally:
+                fd.close()
+        except IOError:
+            return None
+
+    def getChangedProducts(self, generation, dbdir=None):
+        """
+        return the names of the products changed since the database was at a
+        given generation, as recorded in the database's journal.  None is
+        returned if the journal does not reach back that far (or the
+        generation is not one written by this interface).
+
+        @param generation  a generation as returned by getGeneration();  None
+                              means that no generation had been recorded
+        @param dbdir       the database directory to consult; if None, this
+                              defaults to the database root.  This may also be
+                              a user tag directory.
+        """
+        if not dbdir:
+            dbdir = self.dbpath
+        if generation is None:
+            # no generation had been written, so a journal started by the first (generation 1)
+            # holds every change
+            since, oldest = 0, 1
+        else:
+            try:
+                since = int(generation.split()[0])
+            except (AttributeError, ValueError):
+                return None
+            oldest = since
+
+        try:
+            fd = open(os.path.join(dbdir, journalFile))
+        except IOError:
+            return None
+
+        # entries for the generation itself are included as two updates
+        # racing without a lock may have been given the same number
+        first = None
+        out = set()
+        try:
+            for line in fd:
+                if line.startswith("#"):
+                    mat = journalHeaderRe.search(line)
+                    if mat:
+                        first = int(mat.group(1))
+                    continue
+
+                fields = line.split()
+                try:
+                    if int(fields[0]) >= since:
+                        out.add(fields[2])
+                except (IndexError, ValueError):
+                    return None         # corrupted
+        finally:
+            fd.close()
+
+        if first is None or first > oldest:
+            return None
+
+        out = list(out)
+        out.sort()
+        return out
+
+    def _bumpGeneration(self, dbdir=None, changes=[]):
+        # record that the contents of the database in dbdir have changed.
+        # The generation is a counter plus a unique token so that two
+        # updates racing to bump the counter still leave a new value.
+        # The changes, a list of (operation, product, version, flavors, tag)
+        # tuples, are appended to the journal under the new generation;
+        # writers are expected to hold the exclusive lock on the database.
+        if not dbdir:
+            dbdir = self.dbpath
+        try:
+            count = int(self.getGeneration(dbdir).split()[0])
+        except (AttributeError, ValueError):
+            count = 0
+        count += 1
+
+        journal = os.path.join(dbdir, journalFile)
+        first = None
+        if os.path.exists(journal):
+            fd = open(journal)
+            try:
+                mat = journalHeaderRe.search(fd.readline())
+                if mat:
+                    first = int(mat.group(1))
+            finally:
+                fd.close()
+
+        if first is None:
+            # no (usable) journal: start a new one
+            fd = AtomicFile(journal, "w")
+            _writeJournalHeader(fd, count)
+            fd.close()
+        elif count - first > journalMax:
+            self._trimJournal(journal, count - journalKeep)
+
+        fd = open(journal, "a")
+        try:
+            for op, productName, version, flavors, tag in changes:
+                if flavors and not is_string(flavors):
+                    flavors = ",".join(flavors)
+                fd.write("%d %s\n" % (count, " ".join([str(x or "-") for x in
+                                                   (op, productName, version, flavors, tag)])))
+        finally:
+            fd.close()
+
+        fd = AtomicFile(os.path.join(dbdir, generationFile), "w")
+        fd.write("%d %s\n" % (count, uuid.uuid4().hex))
+        fd.close()
+
+    def _trimJournal(self, journal, first):
+        # drop the journal entries for generations before first
+        fd = open(journal)
+        try:
+            lines = [l for l in fd if not l.startswith("#")]
+        finally:
+            fd.close()
+
+        fd = AtomicFile(journal, "w")
+        _writeJournalHeader(fd, first)
+        for line in lines:
+            try:
+                if int(line.split()[0]) >= first:
+                    fd.write(line)
+            except (IndexError, ValueError):
+                pass
+        fd.close()
 
     def findVersions(self, productName):
         """
@@ -465,6 +651,7 @@ class _Database(object):
                 trimDir = None
 
         versionFile.write(trimDir)
+        self._bumpGeneration(changes=[("declare", prod.name, prod.version, prod.flavor, None)])
 
         # now assign any tags
         for tag in prod.tags:
@@ -504,7 +691,10 @@ class _Database(object):
                 self.unassignTag(tag, product.name, product.flavor)
 
         changed = versionFile.removeFlavor(product.flavor)
-        if changed:  versionFile.write()
+        if changed:
+            versionFile.write()
+            self._bumpGeneration(changes=[("undeclare", product.name, product.version,
+                                           product.flavor, None)])
 
         # do a little clean up: if we got rid of the version file, try
         # deleting the directory
@@ -624,6 +814,8 @@ class _Database(object):
 
         tagFile.setVersion(version, flavors)
         tagFile.write()
+        self._bumpGeneration(writeableDB,
+                             [("assignTag", productName, version, flavors, tag.name)])
 
 
     def unassignTag(self, tag, productNames, flavors=None):
@@ -655,7 +847,7 @@ class _Database(object):
         if flavors is not None and not isinstance(flavors, list):
             flavors = [flavors]
 
-        unassigned = False
+        unassigned = []
         for prod in productNames:
             tfile = self._tagFileInDir(self._productDir(prod,dbroot), tag)
             if not os.path.exists(tfile):
@@ -664,7 +856,7 @@ class _Database(object):
             if flavors is None:
                 # remove all flavors
                 os.remove(tfile)
-                unassigned = True
+                unassigned.append(prod)
                 continue
 
             tf = ChainFile(tfile)
@@ -675,9 +867,12 @@ class _Database(object):
 
             if changed:
                 tf.write()
-                unassigned = True
+                unassigned.append(prod)
 
-        return unassigned
+        if unassigned:
+            self._bumpGeneration(dbroot, [("unassignTag", prod, None, flavors, tag)
+                                          for prod in unassigned])
+        return len(unassigned) > 0
 
     def isNewerThan(self, timestamp, dbrootdir=None):
         """
@@ -714,6 +909,10 @@ class _Database(object):
 
         return False
 
+def _writeJournalHeader(fd, first):
+    # the columns are: generation operation product version flavors tag
+    fd.write("# EUPS database journal from generation %d\n" % first)
+
 def _cmp_by_verflav(a, b):
     c = _cmp_str(a.version,b.version)
     if c == 0:
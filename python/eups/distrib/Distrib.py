@@ -133,6 +133,10 @@ class Distrib(object):
 
         self.buildDir = self.getOption('buildDir', 'EupsBuildDir')
 
+        # the checksums ("sha256:...") that the packages at given locations should have, as listed
+        # in their manifests;  installPackage() should pass them on to DistribServer.getFileForProduct()
+        self.checksums = {}
+
         self._alwaysExpandTableFiles = True # returned by self.alwaysExpandTableFiles()
 
     # @staticmethod   # requires python 2.4
@@ -242,6 +246,38 @@ class Distrib(object):
         """
         self.unimplemented("installPackage");
 
+    def prefetchPackage(self, location, product, version, checksum=None):
+        """start retrieving, in the background, the files that installPackage()
+        will need to install a package, so that they are available locally when
+        it's called.
+
+        This implementation does nothing.  Subclasses that download their
+        packages with DistribServer.getFileForProduct() should override it to
+        call DistribServer.prefetchFileForProduct() with the same arguments.
+
+        @param location     the location of the package on the server, as for
+                               installPackage()
+        @param product      the name of the product installed by the package.
+        @param version      the name of the product version.
+        @param checksum     the checksum that the package should have, if known
+        """
+        pass
+
+    def packageFile(self, serverDir, location):
+        """return the name of the file holding the package with a given
+        location in a local server directory, or None if the package isn't
+        a single file.  The files' checksums are written to manifests, and
+        checked when the packages are installed.
+
+        This implementation returns None.
+
+        @param serverDir      a local directory representing the root of the
+                                  package distribution tree
+        @param location       the location of the package on the server, as
+                                  returned by parseDistID()
+        """
+        return None
+
     def cleanPackage(self, product, version, productRoot, location):
         """remove any distribution-specific remnants of a package installation.
         Some distrib mechanisms (namely, Pacman) maintain some of their own
@@ -821,6 +857,15 @@ class DefaultDistrib(Distrib):
                     print("Tablefile %s doesn't exist; omitting" % (fulltablename), file=sys.stderr)
 
         #
+        # Record the checksums of the packages that we've created, so that they can be verified
+        # when they're downloaded
+        #
+        for dep in productDeps:
+            location = self.parseDistID(dep.distId)
+            pkgFile = location and self.packageFile(serverDir, location)
+            if pkgFile and os.path.isfile(pkgFile):
+                dep.checksum = server.fileChecksum(pkgFile)
+        #
         # Finally write the manifest file itself
         #
         man.write(out, flavor=flavor, noOptional=False)
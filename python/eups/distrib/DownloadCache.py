@@ -0,0 +1,276 @@
+"""
+the DownloadCache class -- keeps copies of the files that have been
+retrieved from distribution servers in the user's data directory, so that
+later installs (into any stack) needn't retrieve them again.
+"""
+from __future__ import absolute_import, print_function
+import hashlib
+import os
+import shutil
+import tempfile
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import eups.hooks as hooks
+import eups.utils as utils
+
+class DownloadCache(object):
+    """
+    a size-limited cache of downloaded files, kept in the user's data
+    directory and shared by all stacks and eups processes.
+
+    Files are stored by the sha256 checksum of their contents (so a file
+    that's available from several URLs is only stored once), and looked up
+    by the URL that they were retrieved from together with a "validator"
+    supplied by the server, such as an HTTP ETag or Last-Modified time;  if
+    the server's validator changes, the cached copy isn't used.  A file may
+    also be looked up directly by its checksum.
+
+    When the files take up more than maxSize bytes, the least recently used
+    are removed.  Files are added by renaming them into place, so several
+    processes may use the cache at once.
+    """
+
+    cacheDirName = "_downloads_"
+    entryFileExt = "pickleDownload"
+
+    def __init__(self, maxSize, userDataDir=None, verbose=0, log=utils.stdinfo):
+        """
+        @param maxSize       the maximum number of bytes of files to keep
+        @param userDataDir   the user's data directory (default: utils.defaultUserDataDir())
+        @param verbose       chattiness
+        @param log           where to write messages
+        """
+        if not userDataDir:
+            userDataDir = utils.defaultUserDataDir()
+
+        self.maxSize = maxSize
+        self.cacheDir = os.path.join(userDataDir, "_caches_", self.cacheDirName)
+        self.objectDir = os.path.join(self.cacheDir, "objects")
+        self.entryDir = os.path.join(self.cacheDir, "entries")
+        self.verbose = verbose
+        self.log = log
+
+    @staticmethod
+    def fromConfig(verbose=0, log=utils.stdinfo):
+        """
+        return the DownloadCache configured by hooks.config.Eups.distribCacheSize
+        (in megabytes), or None if it's 0 or there's no user data directory
+        """
+        maxSize = hooks.config.Eups.distribCacheSize
+        if not maxSize:
+            return None
+
+        try:
+            return DownloadCache(int(maxSize*1024*1024), verbose=verbose, log=log)
+        except RuntimeError:            # no user data directory
+            return None
+
+    def _objectFile(self, checksum):
+        return os.path.join(self.objectDir, checksum)
+
+    def _entryFile(self, url):
+        return os.path.join(self.entryDir, "%s.%s" % (hashlib.sha1(url.encode("utf-8")).hexdigest(),
+                                                      self.entryFileExt))
+
+    def getEntry(self, url):
+        """
+        return (validator, filename) for the copy of url in the cache, or
+        None if there isn't one
+        """
+        try:
+            fd = open(self._entryFile(url), "rb")
+            try:
+                savedUrl, validator, checksum = pickle.load(fd)
+            finally:
+                fd.close()
+        except Exception:               # missing, unreadable, or from another version of eups
+            return None
+
+        objectFile = self._objectFile(checksum)
+        if savedUrl != url or not os.path.exists(objectFile):
+            return None
+
+        return validator, objectFile
+
+    def lookup(self, url, validator=None, checksum=None):
+        """
+        return the name of a cached copy of url, or None if there isn't one
+
+        @param url        the URL that the file would be retrieved from
+        @param validator  the server's current validator for url;  the
+                            cached copy is only returned if it had the same
+                            validator when it was retrieved
+        @param checksum   the sha256 checksum of the file, if known;  if it's
+                            provided, validator is ignored
+        """
+        if checksum:
+            objectFile = self._objectFile(checksum)
+            if not os.path.exists(objectFile):
+                return None
+        else:
+            entry = self.getEntry(url)
+            if not entry or not validator or entry[0] != validator:
+                return None
+            objectFile = entry[1]
+
+        if self.verbose > 1:
+            print("Using cached copy of %s" % url, file=self.log)
+
+        try:
+            os.utime(objectFile, None)  # so that it's kept by _prune()
+        except OSError:
+            pass
+
+        return objectFile
+
+    def store(self, url, validator, filename):
+        """
+        save a copy of filename, just retrieved from url, and return the name
+        of the copy (or None if it couldn't be saved)
+
+        @param validator  the server's validator for url when filename was
+                            retrieved (may be None, in which case the copy can
+                            only be looked up by checksum)
+        """
+        try:
+            for d in (self.objectDir, self.entryDir):
+                if not os.path.isdir(d):
+                    try:
+                        os.makedirs(d)
+                    except OSError:
+                        if not os.path.isdir(d): # another process may have just made it
+                            raise
+            #
+            # Copy the file into the cache, calculating its checksum as we go
+            #
+            fd, tmpFile = tempfile.mkstemp(suffix=".tmp", dir=self.objectDir)
+            try:
+                checksum = hashlib.sha256()
+                out = os.fdopen(fd, "wb")
+                try:
+                    ifd = open(filename, "rb")
+                    try:
+                        while True:
+                            data = ifd.read(1 << 20)
+                            if not data:
+                                break
+                            checksum.update(data)
+                            out.write(data)
+                    finally:
+                        ifd.close()
+                finally:
+                    out.close()
+
+                checksum = checksum.hexdigest()
+                objectFile = self._objectFile(checksum)
+                os.rename(tmpFile, objectFile)
+            except:
+                os.remove(tmpFile)
+                raise
+
+            fd = utils.AtomicFile(self._entryFile(url), "wb")
+            pickle.dump((url, validator, checksum), fd, protocol=2)
+            fd.close()
+
+            if self.verbose > 2:
+                print("Saved %s in the download cache" % url, file=self.log)
+
+            self._prune(self.maxSize)
+        except (IOError, OSError) as e:
+            if self.verbose > 0:
+                print("Unable to save %s in the download cache: %s" % (url, e), file=utils.stdwarn)
+            return None
+
+        return objectFile
+
+    def remove(self, url, objectFile=None):
+        """
+        forget the cached copy of url (e.g. because it's been found to be
+        corrupt), removing objectFile (as returned by lookup()) as well if
+        it's provided
+        """
+        for f in (self._entryFile(url), objectFile):
+            if f:
+                try:
+                    os.remove(f)
+                except OSError:
+                    pass
+
+    def size(self):
+        """return the number of files in the cache, and their total size"""
+        objects = self._objects()
+        return len(objects), sum([s[1] for s, f in objects])
+
+    def _objects(self):
+        # the files in the cache, as ((mtime, size), filename), least recently used first
+        if not os.path.isdir(self.objectDir):
+            return []
+
+        objects = []
+        for f in os.listdir(self.objectDir):
+            if f.endswith(".tmp"):
+                continue
+            f = os.path.join(self.objectDir, f)
+            st = utils.fileStat(f)
+            if st:
+                objects.append((st, f))
+
+        return sorted(objects)
+
+    def _prune(self, maxSize):
+        # remove the least recently used files until there are no more than maxSize bytes;
+        # return the number of files and bytes removed
+        objects = self._objects()
+        total = sum([s[1] for s, f in objects])
+
+        nfile, nbyte = 0, 0
+        for (mtime, size), f in objects:
+            if total <= maxSize:
+                break
+            try:
+                os.remove(f)
+            except OSError:
+                continue
+            total -= size
+            nfile += 1
+            nbyte += size
+
+        return nfile, nbyte
+
+    def clean(self, maxSize=0):
+        """
+        remove the least recently used files until there are no more than
+        maxSize bytes (default: remove them all), and the entries for any
+        files that are no longer in the cache.  Return the number of files
+        and bytes that were removed
+        """
+        nfile, nbyte = self._prune(maxSize)
+
+        if os.path.isdir(self.entryDir):
+            for f in os.listdir(self.entryDir):
+                f = os.path.join(self.entryDir, f)
+                try:
+                    fd = open(f, "rb")
+                    try:
+                        url, validator, checksum = pickle.load(fd)
+                    finally:
+                        fd.close()
+                    keep = os.path.exists(self._objectFile(checksum))
+                except Exception:
+                    keep = False
+
+                if not keep:
+                    if self.verbose > 1:
+                        print("removing", f, file=utils.stdinfo)
+                    try:
+                        os.remove(f)
+                    except OSError:
+                        pass
+
+        if maxSize == 0 and os.path.isdir(self.cacheDir):
+            shutil.rmtree(self.cacheDir, ignore_errors=True)
+
+        return nfile, nbyte
@@ -6,7 +6,12 @@ from __future__ import absolute_import, print_function
 import sys
 import os
 import re
+import threading
 import traceback
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 import eups.utils as utils
 from . import server
@@ -17,6 +22,7 @@ from eups.utils     import Flavor
 from .Distrib        import findInstallableRoot
 from .DistribFactory import DistribFactory
 from .server         import Manifest, ServerError, RemoteFileInvalid
+from eups.table     import Table
 import eups.hooks as hooks
 
 class Repositories(object):
@@ -135,6 +141,10 @@ class Repositories(object):
         # used by install() to control repeated error messages
         self._msgs = {}
 
+        # used by install() to prefetch the packages that it's about to install
+        self._toPrefetch = []           # (pkgroot, product, needManifest, opts, flavor, tag) to prefetch
+        self._prefetchedAhead = []      # (product, version) prefetched but not yet being installed
+
     def listPackages(self, productName=None, versionName=None, flavor=None, tag=None):
         """Return a list of tuples (pkgroot, package-list)"""
 
@@ -274,7 +284,7 @@ class Repositories(object):
 
     def install(self, product, version=None, updateTags=None, alsoTag=None,
                 depends=DEPS_ALL, noclean=False, noeups=False, options=None,
-                manifest=None, searchDep=None):
+                manifest=None, searchDep=None, jobs=1):
         """
         Install a product and all its dependencies.
         @param product     the name of the product to install
@@ -325,6 +335,10 @@ class Repositories(object):
                             the choice to recurse is left up to the server
                             where the manifest comes from (which usually
                             defaults to False).
+        @param jobs        the maximum number of products to build at once.
+                            Products are only built in parallel if the
+                            manifest lists all the dependencies (i.e. no
+                            recursive search for them is needed)
         """
         if alsoTag is not None:
             if utils.is_string(alsoTag):
@@ -357,10 +371,88 @@ class Repositories(object):
             raise EupsException("You asked to install %s %s but it is not in the manifest\nCheck manifest.remap (see \"eups startup\") and/or increase the verbosity" % (product, version))
 
         self._msgs = {}
+        if not self.eups.noaction:
+            self._prefetch(man, product, version, flavor, pkgroot, options, depends, noeups)
+
+        if jobs > 1 and \
+           self._parallelInstall(man, product, version, flavor, pkgroot, productRoot, updateTags,
+                                 alsoTag, options, depends, noclean, noeups, jobs=jobs):
+            return
+
         self._recursiveInstall(0, man, product, version, flavor, pkgroot,
                                productRoot, updateTags, alsoTag, options,
                                depends, noclean, noeups)
 
+    def _prefetch(self, manifest, product, version, flavor, pkgroot, opts, depends, noeups, tag=None):
+        """
+        Start retrieving, in the background, the manifests and packages of the
+        products in manifest that we're going to install, in the order that
+        they'll be needed (see DistribServer.prefetchFileForProduct).  Only the
+        first few are retrieved now;  _prefetchNext() retrieves more as each
+        product's installed.  As we don't search for the packages here, the
+        server's just a guess;  if it's wrong, the files will be retrieved
+        again when they're needed
+        """
+        self._toPrefetch = []
+        self._prefetchedAhead = []
+        if not hooks.config.Eups.distribPrefetchThreads:
+            return
+
+        instflavor = flavor
+        if instflavor == "generic":
+            instflavor = self.eups.flavor
+
+        for prod in manifest.getProducts():
+            is_product = (prod.product == product and prod.version == version)
+            if depends == self.DEPS_NONE and not is_product:
+                continue
+            elif depends == self.DEPS_ONLY and is_product:
+                continue
+
+            if not prod.distId:
+                continue
+            if not noeups and not self.eups.force and \
+                   self.eups.findProduct(prod.product, prod.version, flavor=instflavor):
+                continue
+
+            needManifest = not is_product # we already have the top-level manifest
+            self._toPrefetch.append((pkgroot, prod, needManifest, opts, instflavor, tag))
+
+        self._prefetchNext()
+
+    def _prefetchNext(self, prod=None):
+        """
+        Note that we're starting to install prod (if not None), and start
+        retrieving the files for the products that we'll install after it, so
+        that no more than 2*hooks.config.Eups.distribPrefetchThreads products
+        are retrieved ahead of the one being installed
+
+        @param prod    the product (a eups.distrib.server.Dependency) that's about to be installed
+        """
+        if prod is not None:
+            key = (prod.product, prod.version)
+            if key in self._prefetchedAhead:
+                self._prefetchedAhead.remove(key)
+            else:                       # no point in prefetching it now
+                self._toPrefetch = [p for p in self._toPrefetch
+                                    if (p[1].product, p[1].version) != key]
+
+        nahead = 2*hooks.config.Eups.distribPrefetchThreads
+        while self._toPrefetch and len(self._prefetchedAhead) < nahead:
+            pkgroot, prod, needManifest, opts, instflavor, tag = self._toPrefetch.pop(0)
+            self._prefetchedAhead.append((prod.product, prod.version))
+
+            repos = self.repos[pkgroot]
+            if needManifest:
+                repos.distServer.prefetchFileForProduct("", prod.product, prod.version, prod.flavor,
+                                                        "manifest")
+            try:
+                distrib = repos.getDistribFor(prod.distId, opts, instflavor, tag)
+            except Exception:
+                continue
+            distrib.prefetchPackage(distrib.parseDistID(prod.distId), prod.product, prod.version,
+                                    checksum=prod.checksum)
+
     def _recursiveInstall(self, recursionLevel, manifest, product, version,
                           flavor, pkgroot, productRoot, updateTags=None,
                           alsoTag=None, opts=None, depends=DEPS_ALL,
@@ -562,29 +654,246 @@ class Repositories(object):
             setups.append("setup --just --type=build %s %s" % (prod.product, prod.version))
 
             # ...update the tags
-            self._updateServerTags(prod, productRoot, instflavor, installCurrent=opts["installCurrent"],
-                                   desiredTag=updateTags)
-            if alsoTag:
+            self._tagInstalled(prod, productRoot, instflavor, opts, updateTags, alsoTag)
+
+            # ...note that this package is now installed
+            installed.append(pver)
+
+        return True
+
+    def _parallelInstall(self, manifest, product, version, flavor, pkgroot,
+                         productRoot, updateTags, alsoTag, opts, depends,
+                         noclean, noeups, searchDep=None, jobs=1, tag=None):
+        """
+        Install the products listed in a manifest, building up to jobs of
+        them at once.  A product is built as soon as the products that its
+        table file requires (and that are listed earlier in the manifest) have
+        been installed;  products are declared and tagged by this thread, in
+        the order that their builds finish, and a summary is printed in the
+        order of the manifest.
+
+        Return False, having installed nothing, if this isn't possible
+        because the manifest's dependencies must be searched for
+        recursively;  in this case, use _recursiveInstall() instead.  The
+        parameters are as for _recursiveInstall()
+        """
+        if self.eups.noaction:
+            return False
+
+        instflavor = flavor
+        if instflavor == "generic":
+            instflavor = self.eups.flavor
+
+        if alsoTag is None:
+            alsoTag = []
+
+        if searchDep is None:
+            prod = manifest.getDependency(product, version, flavor)
+            if prod and self.repos[pkgroot].getDistribFor(prod.distId, opts, flavor, tag).PRUNE:
+                searchDep = False
+        if searchDep:
+            return False
+        #
+        # Decide what needs to be installed, just as _recursiveInstall would
+        #
+        defaultProduct = hooks.config.Eups.defaultProduct["name"]
+        products = manifest.getProducts()
+
+        todo = []                       # [at, prod, productRoot, pkgroot, msg], for products to process
+        seen = set()
+        for at, prod in enumerate(products):
+            if (prod.product, prod.version) in seen:
+                continue
+            seen.add((prod.product, prod.version))
+
+            is_product = (prod.product == product and prod.version == version)
+            if depends == self.DEPS_NONE and not is_product:
+                continue
+            elif depends == self.DEPS_ONLY and is_product:
+                continue
+
+            thisinstalled = None
+            if not noeups:
+                thisinstalled = self.eups.findProduct(prod.product, prod.version, flavor=instflavor)
+
+            prodRoot = productRoot
+            if thisinstalled:
+                if prod.product == defaultProduct or prod.version == "dummy":
+                    continue
+                if manifest.mapping and manifest.mapping.noReinstall(prod.product, prod.version, flavor):
+                    continue
+
+                prodRoot = thisinstalled.stackRoot() # (re)install it where it's installed already
+                if not self.eups.force:
+                    todo.append([at, prod, prodRoot, None, "(already installed)"])
+                    continue
+
+            recurse = searchDep
+            if recurse is None:
+                recurse = not prod.distId or prod.shouldRecurse
+            if recurse and (prod.distId is None or not is_product):
+                return False
+
+            pkg = self.findPackage(prod.product, prod.version, prod.flavor)
+            if not pkg:
+                msg = "Can't find a package for %s %s" % (prod.product, prod.version)
+                if prod.flavor:
+                    msg += " (%s)" % prod.flavor
+                raise ServerError(msg)
+
+            dman = self.repos[pkg[3]].getManifest(pkg[0], pkg[1], pkg[2])
+            nprod = dman.getDependency(prod.product)
+            if nprod:
+                prod = nprod
+
+            todo.append([at, prod, prodRoot, pkg[3], None])
+        #
+        # Find which of the products to be built depend on which others;  if we can't read a
+        # table file, assume that its product depends on everything before it in the manifest
+        #
+        building = [t for t in todo if t[3] is not None]
+        requires = {}                   # the indices in todo of the products needed to build todo[i]
+        for i, (at, prod, prodRoot, pkgroot, msg) in enumerate(todo):
+            if pkgroot is None:
+                continue
+
+            try:
+                tablefile = self.repos[pkgroot].distServer.getTableFile(prod.product, prod.version,
+                                                                        prod.flavor)
+                names = Table(tablefile, addDefaultProduct=False).dependencyNames()
+            except Exception as e:
                 if self.verbose > 1:
-                    print("Assigning Tags to %s %s: %s" % \
-                          (prod.product, prod.version, ", ".join([str(t) for t in alsoTag])), file=self.log)
-                for tag in alsoTag:
+                    print("Unable to read the table file for %s %s: %s" % (prod.product, prod.version, e),
+                          file=self.log)
+                names = None
+
+            requires[i] = set()
+            for j in range(i):
+                if todo[j][3] is not None and (names is None or todo[j][1].product in names):
+                    requires[i].add(j)
+                    requires[i] |= requires[j]
+        #
+        # Products that are already installed only need tagging
+        #
+        nprods = "/%-2s" % len(products)
+        for at, prod, prodRoot, pkgroot, msg in todo:
+            if pkgroot is None:
+                self._tagInstalled(prod, prodRoot, instflavor, opts, updateTags, alsoTag)
+
+        if self.verbose >= 0 and building:
+            print("Installing %d products, %d at a time" % (len(building), jobs), file=self.log)
+        #
+        # Run the builds
+        #
+        results = queue.Queue()         # (index in todo, exception or None) as each build finishes
+
+        def build(i, distrib, setups, builddir):
+            try:
+                self._buildPackage(distrib, todo[i][1], todo[i][2], setups, builddir)
+                results.put((i, None))
+            except Exception as e:
+                results.put((i, e))
+
+        waiting = [i for i, t in enumerate(todo) if t[3] is not None]
+        running = {}                    # index in todo: (distrib, setups)
+        done = set()
+        failed = {}                     # index in todo: exception
+        while waiting or running:
+            if not failed:              # start all the builds that we can (in manifest order)
+                for i in list(waiting):
+                    if len(running) >= jobs:
+                        break
+                    if not requires[i] <= done:
+                        continue
+
+                    at, prod, prodRoot, pkgroot, msg = todo[i]
+                    # setup the products that are already installed, and those that this one needs
+                    setups = ["setup --just --type=build %s %s" % (t[1].product, t[1].version)
+                              for j, t in enumerate(todo[:i]) if t[3] is None or j in requires[i]]
                     try:
-                        self.eups.assignTag(tag, prod.product, prod.version, productRoot)
+                        distrib, builddir = self._prepareInstall(pkgroot, prod, prodRoot, instflavor,
+                                                                 opts, tag)
                     except Exception as e:
-                        msg = str(e)
-                        if msg not in self._msgs:
-                            print(msg, file=self.log)
-                        self._msgs[msg] = 1
+                        failed[i] = e
+                        break
 
-            # ...note that this package is now installed
-            installed.append(pver)
+                    if self.verbose > 0:
+                        print("Starting to build %s %s" % (prod.product, prod.version), file=self.log)
+                    waiting.remove(i)
+                    running[i] = (distrib, setups)
+                    thread = threading.Thread(target=build, args=(i, distrib, setups, builddir),
+                                              name="eupsInstall-%s" % prod.product)
+                    thread.daemon = True
+                    thread.start()
+
+            if not running:
+                break
+
+            i, e = results.get()
+            distrib, setups = running.pop(i)
+            at, prod, prodRoot, pkgroot, msg = todo[i]
+            if e is not None:
+                failed[i] = e
+                continue
+
+            if self.verbose > 0:
+                print("Finished building %s %s" % (prod.product, prod.version), file=self.log)
+
+            self._finishInstall(pkgroot, prod, prodRoot, instflavor, opts, noclean, setups, tag, distrib)
+            self._tagInstalled(prod, prodRoot, instflavor, opts, updateTags, alsoTag)
+            done.add(i)
+        #
+        # Summarise what happened, in the order of the manifest
+        #
+        if self.verbose >= 0:
+            for i, (at, prod, prodRoot, pkgroot, msg) in enumerate(todo):
+                if pkgroot is None:
+                    status = msg
+                elif i in done:
+                    status = "done."
+                elif i in failed:
+                    status = "FAILED: %s" % failed[i]
+                else:
+                    status = "not attempted"
+                print("  [ %2d%s ]  %s %s %s" % (at+1, nprods, prod.product, prod.version, status),
+                      file=self.log)
+
+        if failed:
+            raise failed[min(failed.keys())]
 
         return True
 
+    def _tagInstalled(self, prod, productRoot, instflavor, opts, updateTags, alsoTag):
+        """assign the server tags and alsoTag to an installed product"""
+        self._updateServerTags(prod, productRoot, instflavor, installCurrent=opts["installCurrent"],
+                               desiredTag=updateTags)
+        if alsoTag:
+            if self.verbose > 1:
+                print("Assigning Tags to %s %s: %s" % \
+                      (prod.product, prod.version, ", ".join([str(t) for t in alsoTag])), file=self.log)
+            for tag in alsoTag:
+                try:
+                    self.eups.assignTag(tag, prod.product, prod.version, productRoot)
+                except Exception as e:
+                    msg = str(e)
+                    if msg not in self._msgs:
+                        print(msg, file=self.log)
+                    self._msgs[msg] = 1
+
     def _doInstall(self, pkgroot, prod, productRoot, instflavor, opts,
                    noclean, setups, tag):
 
+        distrib, builddir = self._prepareInstall(pkgroot, prod, productRoot, instflavor, opts, tag)
+        self._buildPackage(distrib, prod, productRoot, setups, builddir)
+        self._finishInstall(pkgroot, prod, productRoot, instflavor, opts, noclean, setups, tag, distrib)
+
+    def _prepareInstall(self, pkgroot, prod, productRoot, instflavor, opts, tag):
+        """
+        create the build directory for a product, returning the Distrib that
+        will install it and the build directory
+        """
+        self._prefetchNext(prod)
+
         if prod.instDir:
             installdir = prod.instDir
             if not os.path.isabs(installdir):
@@ -611,12 +920,23 @@ class Repositories(object):
         if self.verbose > 1 and hasattr(distrib, 'NAME'):
             print("Using Distrib type:", distrib.NAME, file=self.log)
 
+        return distrib, builddir
+
+    def _buildPackage(self, distrib, prod, productRoot, setups, builddir):
+        """
+        download and build (or unpack) a product.  This may be run in a
+        thread of its own, so must not declare anything
+        """
+        location = distrib.parseDistID(prod.distId)
+        if prod.checksum:
+            distrib.checksums[location] = prod.checksum
+
         try:
-            distrib.installPackage(distrib.parseDistID(prod.distId),
+            distrib.installPackage(location,
                                    prod.product, prod.version,
                                    productRoot, prod.instDir, setups,
                                    builddir)
-        except server.RemoteFileNotFound as e:
+        except (server.RemoteFileNotFound, server.RemoteFileInvalid) as e:
             if self.verbose >= 0:
                 print("Failed to install %s %s: %s" % \
                     (prod.product, prod.version, str(e)), file=self.log)
@@ -624,6 +944,9 @@ class Repositories(object):
         except RuntimeError as e:
             raise e
 
+    def _finishInstall(self, pkgroot, prod, productRoot, instflavor, opts, noclean, setups, tag, distrib):
+        """declare a newly built product, run the post-install hook, and clean up after it"""
+
         # declare the newly installed package, if necessary
         if not instflavor:
             instflavor = opts["flavor"]
@@ -775,7 +1098,7 @@ class Repositories(object):
                     fd.close()
             except:
                 if self.verbose >= 0:
-                    print("Warning: Failed to write distID to %s: %s" (file, traceback.format_exc(0)), file=self.log)
+                    print("Warning: Failed to write distID to %s: %s" % (file, traceback.format_exc(0)), file=self.log)
 
     def _readDistIDFile(self, file):
         distId = None
@@ -6,8 +6,9 @@ from __future__ import absolute_import, print_function
 import sys
 import eups
 from eups.tags      import Tag, TagNotRecognized
-from eups.utils     import Flavor, isDbWritable, cmp_or_key, xrange, is_string
+from eups.utils     import Flavor, isDbWritable, xrange, is_string
 from eups.exceptions import EupsException, ProductNotFound
+from eups.VersionCompare import sortArgs as versionSortArgs
 from .server         import ServerConf, Manifest, Mapping, TaggedProductList
 from .server         import LocalTransporter
 from .DistribFactory import DistribFactory
@@ -156,7 +157,7 @@ class Repository(object):
             lookup[prod]["_sortOrder"] = keys
 
             for flav in lookup[prod]["_sortOrder"]:
-                lookup[prod][flav].sort(**cmp_or_key(self.eups.version_cmp))
+                lookup[prod][flav].sort(**versionSortArgs(self.eups.version_cmp))
 
         return lookup
 
@@ -349,7 +350,7 @@ class Repository(object):
         for name in names:
             for flav in flavors:
                 latest = [p for p in prods if p[0] == name and p[2] == flav]
-                latest.sort(**cmp_or_key(lambda a,b: self.eups.version_cmp(a[1],b[1])))
+                latest.sort(**versionSortArgs(self.eups.version_cmp, lambda p: p[1]))
                 out.extend(latest)
 
         return out
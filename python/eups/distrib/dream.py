@@ -29,7 +29,7 @@ class DreamServer(DistribServer):
         self.base = self.base[len("dream:"):]
 
     def getFileForProduct(self, path, product, version, flavor,
-                          ftype=None, filename=None, noaction=False):
+                          ftype=None, filename=None, noaction=False, checksum=None):
         if ftype is not None and ftype.lower() == "manifest":
             return self.getManifest(product, version, flavor, noaction=noaction)
 
@@ -51,7 +51,8 @@ class DreamServer(DistribServer):
             outBuild.close()
             return filename
 
-        return self.getFile(path, flavor, ftype=ftype, filename=filename, noaction=noaction)
+        return self.getFile(path, flavor, ftype=ftype, filename=filename, noaction=noaction,
+                            checksum=checksum)
 
     def getManifest(self, product, version, flavor, noaction=False):
         if noaction:
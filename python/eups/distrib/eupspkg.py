@@ -888,7 +888,17 @@ TAGLIST_DIR = tags
                                 is of interest, if supported.
         """
         location = self.parseDistID(self.getDistIdForPackage(product, version, flavor))
-        return os.path.exists(os.path.join(serverDir, "products", location))
+        return os.path.exists(self.packageFile(serverDir, location))
+
+    def packageFile(self, serverDir, location):
+        """return the name of the eupspkg archive with a given location in a local server directory"""
+        return os.path.join(serverDir, "products", location)
+
+    def prefetchPackage(self, location, product, version, checksum=None):
+        """start retrieving the eupspkg archive that installPackage() will build"""
+        if not self.Eups.noaction:
+            self.distServer.prefetchFileForProduct(location, product, version, self.Eups.flavor,
+                                                   ftype="eupspkg", checksum=checksum)
 
     def installPackage(self, location, product, version, productRoot,
                        installDir, setups=None, buildDir=None):
@@ -914,7 +924,8 @@ TAGLIST_DIR = tags
         tfname = self.distServer.getFileForProduct(pkg, product, version,
                                                    self.Eups.flavor,
                                                    ftype="eupspkg",
-                                                   noaction=self.Eups.noaction)
+                                                   noaction=self.Eups.noaction,
+                                                   checksum=self.checksums.get(location))
 
         logfile = os.path.join(buildDir, "build.log") # we'll log the build to this file
         uimsgfile = os.path.join(buildDir, "build.msg") # messages to be shown on the console go to this file
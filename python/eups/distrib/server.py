@@ -8,19 +8,34 @@ import sys
 import os
 import re
 import atexit
+import copy
 import fnmatch
+import hashlib
 import shutil
+import socket
 import tempfile
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 try:
     from urllib2 import urlopen, HTTPError, URLError
+    from urllib import getproxies, proxy_bypass
+    from urlparse import urlsplit, urljoin
+    import httplib
 except ImportError:
-    from urllib.request import urlopen
+    from urllib.request import urlopen, getproxies, proxy_bypass
     from urllib.error import HTTPError, URLError
+    from urllib.parse import urlsplit, urljoin
+    import http.client as httplib
 import eups
 import eups.hooks as hooks
 import eups.utils as utils
 
 from eups.exceptions import EupsException
+from .DownloadCache import DownloadCache
 
 serverConfigFilename = "config.txt"
 BASH = "/bin/bash"    # see end of this module where we look for bash
@@ -47,6 +62,8 @@ class DistribServer(object):
     from a server with no special support for flavors or tags.
     """
     _fileCache = {}
+    _fetching = {}                      # sources being retrieved: threading.Events that are set when done
+    _fileCacheLock = threading.Lock()
     NOCACHE = False
 
     def __init__(self, packageBase, config=None, verbosity=0, log=sys.stderr):
@@ -286,7 +303,7 @@ class DistribServer(object):
         return out
 
     def getFile(self, path, flavor=None, tag=None, ftype=None,
-                filename=None, noaction=False):
+                filename=None, noaction=False, checksum=None):
         """return a copy of a file with a given path on the server.  The
         actual path used to retrieve the file may be different depending on
         the values of the other inputs.
@@ -305,6 +322,9 @@ class DistribServer(object):
                              copy is already cached).  If None, a name will
                              be generated.
         @param noaction    if True, simulate the retrieval
+        @param checksum    if provided, the checksum ("sha256:...") that the
+                             file must have;  RemoteFileInvalid is raised if
+                             it doesn't
         """
         if ftype == "list" and path=="":
             src = "%s/%s.list" % (self.base, tag)
@@ -312,10 +332,10 @@ class DistribServer(object):
             src = "%s/%s" % (self.base, path)
 
         if filename is None:  filename = self.makeTempFile("path_")
-        return self.cacheFile(filename, src, noaction);
+        return self.cacheFile(filename, src, noaction, checksum=checksum);
 
     def getFileForProduct(self, path, product, version, flavor,
-                          ftype=None, filename=None, noaction=False):
+                          ftype=None, filename=None, noaction=False, checksum=None):
         """return a copy of a file with a given path on the server associated
         with a given product.
 
@@ -333,8 +353,12 @@ class DistribServer(object):
                              copy is already cached).  If None, a name will
                              be generated.
         @param noaction    if True, simulate the retrieval
+        @param checksum    if provided, the checksum ("sha256:...") that the
+                             file must have;  RemoteFileInvalid is raised if
+                             it doesn't
         """
-        return self.getFile(path, flavor, ftype=ftype, filename=filename, noaction=noaction)
+        return self.getFile(path, flavor, ftype=ftype, filename=filename, noaction=noaction,
+                            checksum=checksum)
 #        src = "%s/%s/%s" % (self.base, product, version)
 #        if flavor is not None and flavor != "generic":
 #            src = "%s/%s" % (src, flavor)
@@ -362,37 +386,158 @@ class DistribServer(object):
     def makeTempFile(self, prefix):
         return makeTempFile(prefix)
 
-    def cacheFile(self, filename, source, noaction=False):
+    def cacheFile(self, filename, source, noaction=False, checksum=None):
         """cache a copy of a file to a file with the given name
         @param filename    the name of the file to write to
         @param source      the name of the remote file to obtain a copy of
         @param noaction    if True, simulate the retrieval
+        @param checksum    if provided, the checksum ("sha256:...") that the
+                             file must have;  if it doesn't, the file is
+                             removed and RemoteFileInvalid is raised
         """
-        if not self.NOCACHE and source in self._fileCache:
-            if self.verbose > 1:
-                msg = "%s has already been retrieved" % source
-                if self.verbose > 2:
-                    msg += " into %s" % filename
+        if checksum:
+            checksum = checksum.lower()
+
+        if not self.NOCACHE:
+            #
+            # If another thread (e.g. a DownloadPrefetcher) is already retrieving source, wait for it
+            #
+            while True:
+                with self._fileCacheLock:
+                    cached = self._fileCache.get(source)
+                    if cached and not os.path.exists(cached):
+                        del self._fileCache[source] # e.g. it was in a build directory that's been cleaned
+                        cached = None
+
+                    if not cached:
+                        fetching = self._fetching.get(source)
+                        if fetching is None:
+                            fetching = self._fetching[source] = threading.Event()
+                            break
+
+                if cached:
+                    if not checksum or noaction or fileChecksum(cached) == checksum:
+                        break
+                    #
+                    # The copy we have is corrupt (or the file's changed); forget it, and retrieve it again
+                    #
+                    if self.verbose > 0:
+                        print("%s (retrieved as %s) doesn't have checksum %s; retrieving it again" %
+                              (source, cached, checksum), file=self.log)
+                    with self._fileCacheLock:
+                        if self._fileCache.get(source) == cached:
+                            del self._fileCache[source]
+                    continue
 
-                print(msg, file=utils.stdinfo)
+                fetching.wait()         # if it failed, we'll try ourselves
 
-            shutil.copy(self._fileCache[source], filename)
+            if cached:
+                if self.verbose > 1:
+                    msg = "%s has already been retrieved" % source
+                    if self.verbose > 2:
+                        msg += " into %s" % filename
 
-            return filename
+                    print(msg, file=utils.stdinfo)
 
-        trx = makeTransporter(source, self.verbose-1, self.log)
+                shutil.copy(cached, filename)
 
-        # make sure we can write to destination
-        parent = os.path.dirname(filename)
-        if parent and not os.path.isdir(parent):
-            os.makedirs(parent)
+                return filename
 
-        trx.cacheToFile(filename, noaction=noaction) # this is not a cache! It's "copy to local file"
+        try:
+            trx = makeTransporter(source, self.verbose-1, self.log)
 
-        self._fileCache[source] = filename
+            # make sure we can write to destination
+            parent = os.path.dirname(filename)
+            if parent and not os.path.isdir(parent):
+                try:
+                    os.makedirs(parent)
+                except OSError:
+                    if not os.path.isdir(parent): # another thread may have just made it
+                        raise
+            #
+            # Use the copy in the user's download cache, if it's up to date
+            #
+            downloadCache = None
+            if not noaction and not self.NOCACHE:
+                downloadCache = DownloadCache.fromConfig(self.verbose, self.log)
+
+            #
+            # If we know what the file's checksum should be, we needn't even ask the server
+            #
+            cachedFile = None           # the copy in downloadCache that we used, if any
+            if downloadCache and checksum:
+                cachedFile = downloadCache.lookup(source, checksum=checksum.split(":", 1)[1])
+                if cachedFile:
+                    try:
+                        shutil.copyfile(cachedFile, filename)
+                    except (IOError, OSError): # e.g. it's just been removed from the cache
+                        cachedFile = None
+
+            retrieved = False
+            if not cachedFile:
+                entry = downloadCache and downloadCache.getEntry(source)
+                if entry:
+                    retrieved = trx.cacheToFileIfModified(filename, entry[0], entry[1], noaction=noaction)
+                    if not retrieved:
+                        cachedFile = entry[1]
+                        downloadCache.lookup(source, entry[0]) # mark it as recently used
+                else:
+                    trx.cacheToFile(filename, noaction=noaction) # this is not a cache! It's "copy to local file"
+                    retrieved = True
+
+            if checksum and not noaction:
+                actual = (retrieved and trx.checksum) or fileChecksum(filename)
+                if actual != checksum and cachedFile:
+                    #
+                    # The cached copy is corrupt;  forget it, and retrieve the file again
+                    #
+                    if self.verbose > 0:
+                        print("Cached copy of %s has checksum %s, not %s; retrieving it again" %
+                              (source, actual, checksum), file=self.log)
+                    downloadCache.remove(source, cachedFile)
+                    trx.cacheToFile(filename, noaction=noaction)
+                    retrieved = True
+                    actual = trx.checksum or fileChecksum(filename)
+
+                if actual != checksum:
+                    os.remove(filename)
+                    raise RemoteFileInvalid("%s has checksum %s, not %s as expected" %
+                                            (source, actual, checksum))
+
+            if downloadCache and retrieved:
+                validator = trx.validator()
+                if validator or checksum:
+                    downloadCache.store(source, validator, filename)
+
+            with self._fileCacheLock:
+                self._fileCache[source] = filename
+        finally:
+            if not self.NOCACHE:
+                with self._fileCacheLock:
+                    self._fetching.pop(source).set()
 
         return filename
 
+    def prefetchFileForProduct(self, path, product, version, flavor, ftype=None, checksum=None):
+        """start retrieving, in the background, a file that getFileForProduct()
+        will be asked for;  when it is, the file will be copied from (or wait
+        for) the prefetched copy.  Nothing is done if
+        hooks.config.Eups.distribPrefetchThreads is 0 or files aren't cached.
+        Problems are ignored here, and reported when the file's actually needed.
+
+        @param path        the path on the remote server to the desired file
+        @param product     the desired product name
+        @param version     the desired version of the product
+        @param flavor      the flavor of the target platform
+        @param ftype       a type of file to assume, as for getFileForProduct()
+        @param checksum    the checksum that the file should have, as for getFileForProduct()
+        """
+        nthread = hooks.config.Eups.distribPrefetchThreads
+        if not nthread or self.NOCACHE:
+            return
+
+        DownloadPrefetcher.get(nthread).prefetch(self, path, product, version, flavor, ftype, checksum)
+
     def getConfigFile(self, filename=None, noaction=False):
         """return a file that is a copy of the Distrib configuration retrieved
         from the server.
@@ -539,7 +684,7 @@ class ConfigurableDistribServer(DistribServer):
             self.setConfigProperty('PREFER_GENERIC', False)
 
     def getFile(self, path, flavor=None, tag=None, ftype=None,
-                filename=None, noaction=False):
+                filename=None, noaction=False, checksum=None):
         """return a copy of a file with a given path on the server.
         @param path        the path on the remote server to the desired file
         @param flavor      the flavor of the target platform
@@ -552,6 +697,9 @@ class ConfigurableDistribServer(DistribServer):
                              copy is already cached).  If None, a name will
                              be generated.
         @param noaction    if True, simulate the retrieval
+        @param checksum    if provided, the checksum ("sha256:...") that the
+                             file must have;  RemoteFileInvalid is raised if
+                             it doesn't
         """
         values = { "path": path,
                    "flavor": flavor,
@@ -567,21 +715,21 @@ class ConfigurableDistribServer(DistribServer):
             if ftype.startswith("."):  ftype = ftype[1:]
 
         try:
-            if self._fileViaTmpl8s(ftype, values, filename, noaction):
+            if self._fileViaTmpl8s(ftype, values, filename, noaction, checksum=checksum):
                 return filename
         except KeyError:
             pass
 
         if ftype != "FILE":
-            return self.getFile(path, flavor, tag, "FILE", filename, noaction)
+            return self.getFile(path, flavor, tag, "FILE", filename, noaction, checksum)
 
         # get the path exactly as asked for (in path)
         return DistribServer.getFile(self, path, flavor, tag, None,
-                                     filename, noaction)
+                                     filename, noaction, checksum)
 
 
     def getFileForProduct(self, path, product, version, flavor,
-                          ftype=None, filename=None, noaction=False):
+                          ftype=None, filename=None, noaction=False, checksum=None):
         """return a copy of a file with a given path on the server associated
         with a given product.
 
@@ -596,6 +744,9 @@ class ConfigurableDistribServer(DistribServer):
                              copy is already cached).  If None, a name will
                              be generated.
         @param noaction    if True, simulate the retrieval
+        @param checksum    if provided, the checksum ("sha256:...") that the
+                             file must have;  RemoteFileInvalid is raised if
+                             it doesn't
         """
         values = { "path": path,
                    "product": product,
@@ -611,12 +762,12 @@ class ConfigurableDistribServer(DistribServer):
             ftype = os.path.splitext(path)[1]
             if ftype.startswith("."):  ftype = ftype[1:]
 
-        if self._fileViaTmpl8s(ftype, values, filename, noaction):
+        if self._fileViaTmpl8s(ftype, values, filename, noaction, checksum=checksum):
             return filename
 
         if not oftype and ftype != 'PRODUCT_FILE':
             return self.getFileForProduct(path, product, version, flavor,
-                                          'PRODUCT_FILE', filename, noaction)
+                                          'PRODUCT_FILE', filename, noaction, checksum)
 
         # The comment at the line is, "this shouldn't happen"
         # and I (RHL) think it's due to the file being unavailable.
@@ -631,10 +782,10 @@ class ConfigurableDistribServer(DistribServer):
               (ftype, product, version, flavor), file=self.log)
         return DistribServer.getFileForProduct(self, path, product, version,
                                                flavor, None, filename,
-                                               noaction)
+                                               noaction, checksum)
 
     def _fileViaTmpl8s(self, ftype, data, filename, noaction=False,
-                       ignoreMissingData=True):
+                       ignoreMissingData=True, checksum=None):
         ftype = ftype.upper()
         if len(ftype) == 0 or not self.getConfigProperty("%s_URL" % ftype):
             return False
@@ -683,7 +834,7 @@ class ConfigurableDistribServer(DistribServer):
                 print("Looking on server for %s %s" % (ftype if ftype else "directory listing", src),
                       file=self.log)
             try:
-                return self.cacheFile(filename, src, noaction)
+                return self.cacheFile(filename, src, noaction, checksum=checksum)
             except RemoteFileNotFound as e:
                 if self.verbose > 1:
                     print("Not found; checking next alternative", file=self.log)
@@ -698,7 +849,7 @@ class ConfigurableDistribServer(DistribServer):
             src = self.getConfigProperty("%s_URL" % ftype) % data
             if self.verbose > 1:
                 print("Failed to find %s in %s; looking on server" % (src, locations), file=self.log)
-            return self.cacheFile(filename, src, noaction)
+            return self.cacheFile(filename, src, noaction, checksum=checksum)
         except RemoteFileNotFound as e:
             if self.verbose > 1:
                 print("no appropriate template found for %s, checking path directly" % ftype, file=self.log)
@@ -893,6 +1044,76 @@ class ConfigurableDistribServer(DistribServer):
                                                    noaction)
 
 
+class DownloadPrefetcher(object):
+    """
+    a pool of threads that retrieve files from distribution servers before
+    they are needed, so that "eups distrib install" can download the next
+    packages while it builds this one.  Files are retrieved with
+    DistribServer.getFileForProduct() into temporary files, and recorded in
+    the DistribServer's file cache from which later requests for them are
+    satisfied.
+
+    There is normally a single pool, as returned by DownloadPrefetcher.get()
+    """
+
+    _instance = None
+    _instanceLock = threading.Lock()
+
+    def __init__(self, nthread):
+        """
+        @param nthread   the number of files to retrieve at once
+        """
+        self.queue = queue.Queue()
+        self.filesFetched = 0           # the number of files retrieved (approximately; it isn't locked)
+
+        self.threads = []
+        for i in range(nthread):
+            thread = threading.Thread(target=self._run, name="eupsDownload%d" % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    @classmethod
+    def get(cls, nthread):
+        """
+        return the shared DownloadPrefetcher, creating it (with nthread
+        threads) if it doesn't yet exist
+        """
+        with cls._instanceLock:
+            if cls._instance is None:
+                cls._instance = cls(nthread)
+
+        return cls._instance
+
+    def prefetch(self, distServer, path, product, version, flavor, ftype=None, checksum=None):
+        """
+        retrieve a file, as distServer.getFileForProduct(path, product,
+        version, flavor, ftype, checksum=checksum) would
+        """
+        self.queue.put((distServer, path, product, version, flavor, ftype, checksum))
+
+    def join(self):
+        """wait until all the files that we've been asked to retrieve have been retrieved (or failed)"""
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            distServer, path, product, version, flavor, ftype, checksum = self.queue.get()
+            #
+            # Don't clutter the log with messages from downloads that may not be needed;
+            # any problems will be reported when the file is asked for
+            #
+            quiet = copy.copy(distServer)
+            quiet.verbose = -1
+            quiet.log = utils.StringIO.StringIO()
+            try:
+                quiet.getFileForProduct(path, product, version, flavor, ftype=ftype,
+                                        filename=makeTempFile("%s_" % product), checksum=checksum)
+                self.filesFetched += 1
+            except Exception:
+                pass
+            self.queue.task_done()
+
 
 class ServerError(EupsException):
     """an exception representing a problem communicating with a server"""
@@ -973,6 +1194,7 @@ class Transporter(object):
         self.loc = source
         self.verbose = verbosity
         self.log = log
+        self.checksum = None            # the checksum ("sha256:...") of the file, if calculated while retrieving it
 
     def cacheToFile(self, filename, noaction=False):
         """cache the source to a local file
@@ -981,6 +1203,38 @@ class Transporter(object):
         """
         self.unimplemented("cacheToFile");
 
+    def validator(self):
+        """return a string that changes whenever the source does (e.g. an HTTP
+        ETag), or None if there's no cheap way to tell.  Files with validators
+        may be kept in the user's DownloadCache.
+
+        This implementation returns None.
+        """
+        return None
+
+    def cacheToFileIfModified(self, filename, validator, cachedFile, noaction=False):
+        """cache the source to a local file, unless it hasn't changed since
+        it had the given validator, in which case copy cachedFile (a copy
+        of the source as it was then).  Return True if the source was
+        retrieved, or False if cachedFile was used.
+
+        This implementation compares validator with the source's current
+        validator().
+        @param filename      the name of the file to cache to
+        @param validator     the validator() of the source when cachedFile was retrieved
+        @param cachedFile    the previously retrieved copy of the source
+        @param noaction      if True, simulate the result (default: False)
+        """
+        if not noaction and validator and self.validator() == validator:
+            try:
+                copyfile(cachedFile, filename)
+                return False
+            except (IOError, OSError):  # e.g. it's just been removed from the cache
+                pass
+
+        self.cacheToFile(filename, noaction)
+        return True
+
     def listDir(self, noaction=False):
         """interpret the source as a directory and return a list of files
         it contains
@@ -992,7 +1246,30 @@ class Transporter(object):
         raise Exception("%s: unimplemented (abstract) method" % name)
 
 class WebTransporter(Transporter):
-    """a class that can return files via an HTTP or FTP URL"""
+    """a class that can return files via an HTTP or FTP URL
+
+    HTTP(S) files are streamed to disk, reusing (keep-alive) connections to
+    each server;  requests that fail transiently (e.g. the connection's
+    dropped, or the server replies 503) are retried maxRetries times,
+    waiting retryDelay seconds before the first retry and twice as long
+    before each subsequent one.  FTP URLs, and URLs that must be retrieved
+    via a proxy, are retrieved with urlopen.
+
+    Files are written to filename.partial and renamed when complete, and
+    their checksums are calculated as they arrive.  If the connection's
+    dropped part way through a file that has a validator (ETag or
+    Last-Modified), the retry asks for just the rest of it (with Range and
+    If-Range headers).
+    """
+
+    maxRetries = 4                      # the number of times to retry a request that fails transiently
+    retryDelay = 1.0                    # seconds to wait before the first retry
+    timeout = 60                        # seconds to wait for the server to respond
+    chunkSize = 1 << 20                 # the number of bytes to read at a time
+    maxRedirects = 10
+
+    # the request headers to use to ask if a file with a given validator has changed
+    conditionalHeaders = {"ETag" : "If-None-Match", "Last-Modified" : "If-Modified-Since"}
 
     # @staticmethod   # requires python 2.4
     def canHandle(source):
@@ -1004,6 +1281,11 @@ class WebTransporter(Transporter):
 
     canHandle = staticmethod(canHandle)  # should work as of python 2.2
 
+    def __init__(self, source, verbosity=0, log=sys.stderr):
+        Transporter.__init__(self, source, verbosity, log)
+        self.headers = None             # the headers of the last response from the server
+        self._partial = None            # (nbyte, hasher, If-Range value) for a partly retrieved file
+
     def cacheToFile(self, filename, noaction=False):
         """cache the source to a local file
         @param filename      the name of the file to cache to
@@ -1016,23 +1298,219 @@ class WebTransporter(Transporter):
             if self.verbose > 0:
                 system("touch " + filename)
                 print("Simulated web retrieval from", self.loc, file=self.log)
+        elif not self._useConnectionPool():
+            self._urlopenToFile(filename)
         else:
-            url = None
-            out = None
+            self._retrieveToFile(filename, {})
+
+    def cacheToFileIfModified(self, filename, validator, cachedFile, noaction=False):
+        """cache the source to a local file, unless it hasn't changed since
+        it had the given validator, in which case copy cachedFile.  Return True
+        if the source was retrieved, or False if cachedFile was used.
+
+        This implementation makes a conditional request (If-None-Match or
+        If-Modified-Since) of the server.
+        @param filename      the name of the file to cache to
+        @param validator     the validator() of the source when cachedFile was retrieved
+        @param cachedFile    the previously retrieved copy of the source
+        @param noaction      if True, simulate the result (default: False)
+        """
+        if noaction or not self._useConnectionPool():
+            return Transporter.cacheToFileIfModified(self, filename, validator, cachedFile, noaction)
+
+        headers = {}
+        mat = re.search(r"^(ETag|Last-Modified): (.*)", validator or "")
+        if mat:
+            headers[self.conditionalHeaders[mat.group(1)]] = mat.group(2)
+
+        if self._retrieveToFile(filename, headers):
+            return True
+
+        if self.verbose > 0:
+            print("%s hasn't changed; using cached copy" % self.loc, file=self.log)
+        try:
+            copyfile(cachedFile, filename)
+        except (IOError, OSError):      # e.g. it's just been removed from the cache
+            self.cacheToFile(filename)
+            return True
+
+        return False
+
+    def validator(self):
+        """return the ETag (or failing that, the Last-Modified time) that the
+        server sent with the file, asking for it if we haven't yet retrieved
+        the file;  return None if the server doesn't provide one"""
+        if self.headers is None:
+            if not self._useConnectionPool():
+                return None
+
             try:
-                try:                               # for python 2.4 compat
-                    url = urlopen(self.loc)
-                    out = open(filename, 'wb')
-                    out.write(url.read())
-                except HTTPError as e:
-                    raise RemoteFileNotFound("Failed to open URL %s (%s)" % (self.loc, e.reason))
-                except URLError as e:
-                    raise ServerNotResponding("Failed to contact URL %s (%s)" % (self.loc, e.reason))
-                except KeyboardInterrupt:
-                    raise EupsException("^C")
-            finally:
-                if url is not None: url.close()
-                if out is not None: out.close()
+                self._retry(self._retrieve, None, {})
+            except Exception:           # we'll find out about any problems when we retrieve the file
+                return None
+
+        for header in ("ETag", "Last-Modified"):
+            value = self.headers.get(header)
+            if value:
+                return "%s: %s" % (header, value)
+
+        return None
+
+    def _useConnectionPool(self):
+        # should we use our own keep-alive connections (rather than urlopen)?
+        if not re.search(r'^https?://', self.loc):
+            return False
+
+        parts = urlsplit(self.loc)
+        return parts.scheme not in getproxies() or proxy_bypass(parts.hostname)
+
+    def _urlopenToFile(self, filename):
+        # retrieve the source with urlopen (which knows about ftp and proxies)
+        url = None
+        out = None
+        try:
+            try:                               # for python 2.4 compat
+                url = urlopen(self.loc)
+                self.headers = url.info()
+                out = open(filename, 'wb')
+                while True:
+                    data = url.read(self.chunkSize)
+                    if not data:
+                        break
+                    out.write(data)
+            except HTTPError as e:
+                raise RemoteFileNotFound("Failed to open URL %s (%s)" % (self.loc, e.reason))
+            except URLError as e:
+                raise ServerNotResponding("Failed to contact URL %s (%s)" % (self.loc, e.reason))
+            except KeyboardInterrupt:
+                raise EupsException("^C")
+        finally:
+            if url is not None: url.close()
+            if out is not None: out.close()
+
+    def _retrieveToFile(self, filename, headers):
+        # retrieve the source to filename, retrying (and resuming) as needed; return as for _retrieve
+        self._partial = None
+        try:
+            return self._retry(self._retrieve, filename, headers)
+        finally:
+            self._partial = None
+            if os.path.exists(filename + ".partial"):
+                os.remove(filename + ".partial")
+
+    def _retry(self, func, *args):
+        # call func(*args), retrying if it raises _TransientError
+        delay = self.retryDelay
+        for attempt in range(self.maxRetries + 1):
+            try:
+                return func(*args)
+            except _TransientError as e:
+                if attempt == self.maxRetries:
+                    raise e.exc
+
+                if self.verbose >= 0:
+                    print("Warning: %s; retrying in %gs" % (e.exc, delay), file=self.log)
+                time.sleep(delay)
+                delay *= 2
+
+    def _retrieve(self, filename, headers):
+        """
+        Retrieve the source to filename (or just its headers if filename is
+        None), following redirects;  return True, or False if the server
+        replied that it's not modified.  Raise _TransientError if it's worth
+        trying again
+        """
+        partial = self._partial
+        if partial and filename is not None:
+            headers = dict(headers, Range="bytes=%d-" % partial[0])
+            headers["If-Range"] = partial[2]
+
+        loc = self.loc
+        for i in range(self.maxRedirects + 1):
+            conn, response = _connectionPool.request(loc, "HEAD" if filename is None else "GET",
+                                                     headers, self.timeout)
+            status = response.status
+            location = response.getheader("Location")
+            if status in (301, 302, 303, 307, 308) and location:
+                _connectionPool.release(conn, response)
+                loc = urljoin(loc, location)
+                if self.verbose > 1:
+                    print("Redirected to %s" % loc, file=self.log)
+                continue
+
+            if status == 206 and partial:
+                mat = re.search(r"^bytes\s+(\d+)-", response.getheader("Content-Range", ""))
+                if not mat or int(mat.group(1)) != partial[0]:
+                    conn.close()
+                    self._partial = None
+                    raise _TransientError(ServerNotResponding("Failed to resume URL %s (bad Content-Range)" %
+                                                              self.loc))
+
+                if self.verbose > 0:
+                    print("Resuming %s at byte %d" % (self.loc, partial[0]), file=self.log)
+            elif status != 200:
+                _connectionPool.release(conn, response)
+                if status == 304 and headers:
+                    self.headers = response.msg
+                    return False
+
+                exc = RemoteFileNotFound("Failed to open URL %s (%s)" % (self.loc, response.reason))
+                if status in (408, 429) or status >= 500:
+                    raise _TransientError(exc)
+                raise exc
+
+            self.headers = response.msg
+            if filename is None:
+                _connectionPool.release(conn, response)
+                return True
+
+            if status == 206:
+                nbyte, hasher = partial[0], partial[1]
+                mode = "ab"
+            else:                       # the server sent the whole file
+                nbyte, hasher = 0, hashlib.sha256()
+                mode = "wb"
+
+            length = response.getheader("Content-Length")
+            try:
+                out = open(filename + ".partial", mode)
+                start = nbyte
+                try:
+                    while True:
+                        data = response.read(self.chunkSize)
+                        if not data:
+                            break
+                        out.write(data)
+                        hasher.update(data)
+                        nbyte += len(data)
+                finally:
+                    out.close()
+
+                if length and nbyte - start < int(length): # python 3 doesn't complain if the connection's dropped
+                    raise httplib.IncompleteRead(b"", int(length) - (nbyte - start))
+            except (httplib.HTTPException, socket.error) as e:
+                conn.close()
+                #
+                # Remember how far we got, so we can ask for the rest;  we can only do so safely if
+                # the server told us how to check that the file hasn't changed in the meantime
+                #
+                ifRange = self.headers.get("ETag") or self.headers.get("Last-Modified")
+                if nbyte > 0 and ifRange and not ifRange.startswith("W/"):
+                    self._partial = (nbyte, hasher, ifRange)
+                else:
+                    self._partial = None
+                raise _TransientError(ServerNotResponding("Failed to read URL %s (%s)" % (self.loc, e)))
+            except KeyboardInterrupt:
+                conn.close()
+                raise EupsException("^C")
+
+            _connectionPool.release(conn, response)
+
+            os.rename(filename + ".partial", filename)
+            self.checksum = "sha256:%s" % hasher.hexdigest()
+            return True
+
+        raise RemoteFileNotFound("Failed to open URL %s (too many redirects)" % self.loc)
 
     def listDir(self, noaction=False):
         """interpret the source as a directory and return a list of files
@@ -1119,6 +1597,96 @@ class WebTransporter(Transporter):
 
 
 
+class _TransientError(Exception):
+    """a failure to retrieve a file that may succeed if we try again"""
+    def __init__(self, exc):
+        Exception.__init__(self, str(exc))
+        self.exc = exc                  # the exception to raise if we give up
+
+class _ConnectionPool(object):
+    """
+    idle (keep-alive) connections to HTTP(S) servers, by scheme, host and port
+    """
+    maxIdle = 4                         # the maximum number of idle connections to keep to each server
+
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def request(self, url, method, headers, timeout):
+        """
+        send a request to a server, and return the connection and the
+        response (whose headers have been read, but not its body).  Pass the
+        connection to release() once the body has been read.  Raise
+        ServerNotResponding if the server can't be reached (e.g. its name's
+        unknown, or it refuses the connection), or _TransientError if it
+        times out or drops the connection
+        """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        headers = dict(headers, **{"User-Agent" : "eups"})
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                conn = idle.pop() if idle else None
+
+            reused = conn is not None
+            if not reused:
+                connClass = httplib.HTTPSConnection if parts.scheme == "https" else httplib.HTTPConnection
+                conn = connClass(parts.netloc, timeout=timeout)
+                conn._eupsKey = key
+                try:
+                    conn.connect()
+                except socket.timeout as e:
+                    conn.close()
+                    raise _TransientError(ServerNotResponding("Failed to contact URL %s (%s)" % (url, e)))
+                except (httplib.HTTPException, socket.error) as e: # not worth retrying
+                    conn.close()
+                    raise ServerNotResponding("Failed to contact URL %s (%s)" % (url, e))
+
+            try:
+                conn.request(method, path, headers=headers)
+                return conn, conn.getresponse()
+            except (httplib.HTTPException, socket.error) as e:
+                conn.close()
+                if reused:              # the server probably closed it;  try a new connection
+                    continue
+                raise _TransientError(ServerNotResponding("Failed to contact URL %s (%s)" % (url, e)))
+
+    def release(self, conn, response):
+        """finish with a request, keeping its connection for reuse if possible"""
+        try:
+            response.read()             # we have to read the whole response before reusing the connection
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+            return
+
+        if response.will_close:
+            conn.close()
+            return
+
+        with self._lock:
+            idle = self._idle.setdefault(conn._eupsKey, [])
+            if len(idle) < self.maxIdle:
+                idle.append(conn)
+                return
+
+        conn.close()
+
+    def clear(self):
+        """close all the idle connections"""
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle = {}
+
+_connectionPool = _ConnectionPool()
+
 class SshTransporter(Transporter):
 
     def __init__(self, source, verbosity=0, log=sys.stderr):
@@ -1517,7 +2085,7 @@ class Dependency(object):
     """
 
     def __init__(self, product, version, flavor, tablefile, instDir, distId,
-                 isOptional=False, shouldRecurse=False, extra=None):
+                 isOptional=False, shouldRecurse=False, extra=None, checksum=None):
         self.product = product
         if not utils.is_string(version):
             if isinstance(version, type):
@@ -1535,11 +2103,12 @@ class Dependency(object):
         self.shouldRecurse = shouldRecurse
         self.extra = extra
         if self.extra is None:  self.extra = []
+        self.checksum = checksum        # the checksum ("sha256:...") of the product's package, if known
 
     def copy(self):
         return Dependency(self.product, self.version, self.flavor,
                           self.tablefile, self.instDir, self.distId, self.isOpt,
-                          self.shouldRecurse, self.extra[:])
+                          self.shouldRecurse, self.extra[:], self.checksum)
 
     def __repr__(self):
         out = [self.product, self.version, self.flavor,
@@ -1714,9 +2283,9 @@ class Manifest(object):
 
     def addDependency(self, product, version, flavor, tablefile,
                       instDir, distId, isOptional=False, shouldRecurse=False,
-                      extra=None):
+                      extra=None, checksum=None):
         self.addDepInst(Dependency(product, version, flavor, tablefile, instDir,
-                                   distId, isOptional, shouldRecurse, extra))
+                                   distId, isOptional, shouldRecurse, extra, checksum))
 
     def addDepInst(self, dep):
         """add a dependency in the form of a dependency object"""
@@ -1786,6 +2355,14 @@ class Manifest(object):
                 # make sure we have at least 5 elements
                 info[4]
 
+                # the package's checksum (if any) follows the distrib ID
+                checksum = None
+                for i, word in enumerate(info[6:]):
+                    if checksumRe.search(word):
+                        checksum = word.lower()
+                        del info[6 + i]
+                        break
+
                 # set a default for the distrib ID
                 if len(info) < 6:
                     info.append(None)
@@ -1810,7 +2387,7 @@ class Manifest(object):
                     info[7] = shouldRecurse
 
                 self.addDependency(info[0], info[2], info[1], info[3],
-                                   info[4], info[5], info[6], info[7], info[8:])
+                                   info[4], info[5], info[6], info[7], info[8:], checksum)
             except Exception as e:
                 fd.close()
                 raise RuntimeError("Failed to parse line: (%s): %s" %
@@ -1844,7 +2421,7 @@ EUPS distribution manifest for %s (%s). Version %s
 # Time:         %s
 # Eups version: %s
 #
-# pkg           flavor       version    tablefile                 installation_directory         installID
+# pkg           flavor       version    tablefile                 installation_directory         installID [checksum]
 #---------------------------------------------------------------------------------------------------------""" % \
                     (product, version, self.fmtversion, self.eups.who,
                      utils.ctimeTZ(), utils.version()), file=ofd)
@@ -1864,9 +2441,12 @@ EUPS distribution manifest for %s (%s). Version %s
                     p.tablefile = "none"
 
                 if not noaction:
-                    print("%-15s %-12s %-10s %-25s %-30s %s" % \
+                    line = "%-15s %-12s %-10s %-25s %-30s %s" % \
                         (p.product, p.flavor, p.version, p.tablefile,
-                         p.instDir, p.distId), file=ofd)
+                         p.instDir, p.distId)
+                    if p.checksum:
+                        line += " %s" % p.checksum
+                    print(line, file=ofd)
         finally:
             if not noaction:
                 ofd.close()
@@ -2323,12 +2903,34 @@ class ServerConf(object):
 
     makeServer = staticmethod(makeServer)  # should work as of python 2.2
 
+checksumRe = re.compile(r"^sha256:[0-9a-fA-F]{64}$") # the checksums that can appear in manifests
+
+def fileChecksum(filename):
+    """return the checksum of a file's contents, as "sha256:<hexdigest>" """
+    hasher = hashlib.sha256()
+    fd = open(filename, "rb")
+    try:
+        while True:
+            data = fd.read(1 << 20)
+            if not data:
+                break
+            hasher.update(data)
+    finally:
+        fd.close()
+
+    return "sha256:%s" % hasher.hexdigest()
+
 def makeTempFile(prefix):
     (fd, filename) = tempfile.mkstemp("", prefix, utils.createTempDir("distrib"))
     os.close(fd);
-    atexit.register(os.unlink, filename)
+    atexit.register(_removeTempFile, filename)
     return filename
 
+def _removeTempFile(filename):
+    # remove a file made by makeTempFile(), unless it's already gone (e.g. it failed its checksum)
+    if os.path.exists(filename):
+        os.unlink(filename)
+
 def importClass(classname):
     """import and return the constructor for the given class name.
     @param classname    the full module classname to import
@@ -168,7 +168,11 @@ DIST_URL = %s
                                 is of interest, if supported.
         """
         location = self.parseDistID(self.getDistIdForPackage(product, version, flavor))
-        return os.path.exists(os.path.join(serverDir, location))
+        return os.path.exists(self.packageFile(serverDir, location))
+
+    def packageFile(self, serverDir, location):
+        """return the name of the tarball with a given location in a local server directory"""
+        return os.path.join(serverDir, location)
 
     def installPackage(self, location, product, version, productRoot,
                        installDir=None, setups=None, buildDir=None):
@@ -205,7 +209,8 @@ DIST_URL = %s
             tfile = self.distServer.getFileForProduct(location, product,
                                                       version, self.Eups.flavor,
                                                       ftype="dist",
-                                                      filename=tfile)
+                                                      filename=tfile,
+                                                      checksum=self.checksums.get(location))
             if not os.access(tfile, os.R_OK):
                 raise RuntimeError("Unable to read %s" % (tfile))
 
@@ -256,6 +261,12 @@ DIST_URL = %s
                     print("Installing binary product %s %s into %s (was built for %s)" % (
                         product, version, installDir, originalDir), file=self.log)
 
+    def prefetchPackage(self, location, product, version, checksum=None):
+        """start retrieving the tarball that installPackage() will unpack"""
+        if location and not self.Eups.noaction:
+            self.distServer.prefetchFileForProduct(location, product, version, self.Eups.flavor,
+                                                   ftype="dist", checksum=checksum)
+
     def getDistIdForPackage(self, product, version, flavor=None):
         """return the distribution ID that for a package distribution created
         by this Distrib class (via createPackage())
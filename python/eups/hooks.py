@@ -2,11 +2,18 @@
 Module that enables user configuration and hooks.
 """
 from __future__ import absolute_import, print_function
+import hashlib
+import marshal
 import os
 import re
+import sys
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 from . import utils
+from . import timing
 import eups
-import eups.exceptions
 from .VersionCompare import VersionCompare
 
 # the function to use to compare two version.  The user may reset this
@@ -34,8 +41,10 @@ def defineProperties(names, parentName=None):
 
 # various configuration properties settable by the user
 config = defineProperties("Eups distrib site user")
-config.Eups = defineProperties("userTags preferredTags globalTags reservedTags defaultTags verbose asAdmin setupTypes setupCmdName VRO fallbackFlavors defaultProduct startupFileName repoVersioner versionIncrementer colorize", "Eups")
+config.Eups = defineProperties("userTags preferredTags globalTags reservedTags defaultTags verbose asAdmin setupTypes setupCmdName VRO fallbackFlavors defaultProduct startupFileName repoVersioner versionIncrementer colorize setupPlanCache setupPrefetchThreads distribPrefetchThreads distribCacheSize", "Eups")
 config.Eups.setType("verbose", int)
+config.Eups.setType("setupPrefetchThreads", int)
+config.Eups.setType("distribPrefetchThreads", int)
 
 config.Eups.userTags = []
 config.Eups.defaultTags = dict(pre=[], post=[])
@@ -71,6 +80,26 @@ config.Eups.defaultProduct = {"name" : "implicitProducts", "version" : None, "ta
 
 config.Eups.colorize = False
 #
+# Reuse the commands generated by an earlier, identical, setup command if nothing it depended on has changed
+#
+config.Eups.setupPlanCache = True
+#
+# The number of threads to use to read the table files of a product's dependencies while setting it up.
+# Setting this to a few may help if your stack's on a slow (e.g. network) filesystem;  0 disables prefetching
+#
+config.Eups.setupPrefetchThreads = 0
+#
+# The number of files that "eups distrib install" downloads at once, in background threads, while it's
+# building the products it's already retrieved;  0 disables prefetching
+#
+config.Eups.distribPrefetchThreads = 4
+#
+# The maximum size, in megabytes, of the cache of files downloaded by "eups distrib install" that's kept
+# in your user data directory (and shared between all your stacks);  0 disables the cache.  The least
+# recently used files are removed first;  "eups distrib clean --cache" empties it
+#
+config.Eups.distribCacheSize = 2048
+#
 # Configure things that apply to the entire site
 #
 config.site = defineProperties("lockDirectoryBase", "site")
@@ -146,6 +175,7 @@ except NameError:
     customisationFilename = None
     customisationFiles = None
 
+@timing.timed("loadCustomization")
 def loadCustomization(verbose=0, log=utils.stdinfo, execute=True, quiet=True, path=[], reset=False,
                       filename=None, includeAllFiles=False):
     """
@@ -203,12 +233,18 @@ def loadCustomization(verbose=0, log=utils.stdinfo, execute=True, quiet=True, pa
     # load the configuration by directories; later ones override prior ones
     customisationFiles = []             # files that we'd load
 
+    startupFiles = []                   # files to execute, and whether to proceed if they fail
+
     for dir in customisationDirs:
-        cfiles = loadCustomizationFromDir(dir, verbose, log, execute=execute, filename=filename,
+        cfiles = loadCustomizationFromDir(dir, verbose, log, execute=False, filename=filename,
                                           includeAllFiles=includeAllFiles)
         if cfiles:
             customisationFiles += cfiles
 
+        startup = os.path.join(dir, filename)
+        if startup in customisationFiles:
+            startupFiles.append((startup, False))
+
     # load any custom startup scripts via EUPS_STARTUP; this overrides
     # everything
     if "EUPS_STARTUP" in os.environ:
@@ -217,21 +253,84 @@ def loadCustomization(verbose=0, log=utils.stdinfo, execute=True, quiet=True, pa
                 if not quiet:
                     print("Startup file %s doesn't exist" % (startupFile))
             else:
-                try:
-                    if execute:
-                        execute_file(startupFile)
-
-                    customisationFiles.append(startupFile)
-                except Exception as e:
-                    msg = "Processing %s: %s" % (startupFile, e)
-                    if False:           # we have no recourse if we break this file; so proceed
-                        raise eups.exceptions.CustomizationError(msg)
-                    else:
-                        print(msg, file=log)
+                customisationFiles.append(startupFile)
+                startupFiles.append((startupFile, True)) # we have no recourse if we break this file; so proceed
+
+    if execute:
+        loaded = executeStartupFiles(startupFiles, verbose, log)
+        for startupFile, proceed in startupFiles:
+            if proceed and startupFile not in loaded:
+                customisationFiles.remove(startupFile)
 
     return customisationFiles
 
-def execute_file(startupFile):
+def executeStartupFiles(startupFiles, verbose=0, log=utils.stdinfo):
+    """
+    execute startup files in order, returning the names of those that were
+    successfully executed.
+
+    Startup files that do nothing but set hooks.config properties to
+    literal values (e.g. "hooks.config.Eups.userTags += ["rhl"]") don't
+    need to be executed each time eups runs:  the properties that they set
+    are cached in the user's data directory, keyed by the modification
+    times of the files and the properties' values beforehand.  If all the
+    files are of this sort, and nothing has changed, the properties are
+    simply restored from the cache.  The compiled code of all startup files
+    is cached too.  A startup file containing the line "# eups: nocache" is
+    always executed.
+
+    @param startupFiles   a list of (filename, proceed); if proceed is
+                            True, an error in the file is reported rather
+                            than raised
+    @param verbose        the verbosity level
+    @param log            where to write log messages
+    """
+    if not startupFiles:
+        return []
+
+    cache = _StartupCache(utils.defaultUserDataDir(), verbose, log)
+
+    before = _configSnapshot()
+    key = cache.key(startupFiles, before)
+    changes = cache.lookupConfig(key)
+    if changes is not None:
+        _restoreConfig(changes)
+        return [startupFile for startupFile, proceed in startupFiles]
+
+    loaded = []
+    cacheable = True
+    try:
+        for startupFile, proceed in startupFiles:
+            if verbose > 2:
+                print("sourcing", startupFile, file=log)
+            try:
+                code, onlySetsConfig = cache.compile(startupFile)
+                cacheable = cacheable and onlySetsConfig
+
+                execute_file(startupFile, code)
+                loaded.append(startupFile)
+            except Exception as e:
+                cacheable = False
+                if not proceed:
+                    raise
+
+                print("Processing %s: %s" % (startupFile, e), file=log)
+
+        if cacheable:
+            changes = _configChanges(before, _configSnapshot())
+            if changes is not None:
+                cache.saveConfig(key, changes)
+    finally:
+        cache.save()
+
+    return loaded
+
+def execute_file(startupFile, code=None):
+    """
+    execute a startup file
+
+    @param code   the file's compiled code, if available
+    """
     import eups
     from eups import hooks
     from .VersionCompare import VersionCompare
@@ -250,8 +349,10 @@ def execute_file(startupFile):
               ]:
         checkDictKeys[dname] = (d, d.keys())
 
-    with open(startupFile) as fd:
-        exec(compile(fd.read(), startupFile, 'exec'), _globals, locals())
+    if code is None:
+        with open(startupFile) as fd:
+            code = compile(fd.read(), startupFile, 'exec')
+    exec(code, _globals, locals())
 
     for dname, v  in checkDictKeys.items():
         d, keys0 = v
@@ -259,6 +360,226 @@ def execute_file(startupFile):
             if k not in keys0:
                 print("Found unknown key %s in dictionary %s in %s" % (k, dname, startupFile), file=utils.stdwarn)
 
+#
+# Support for caching the results of startup files;  see executeStartupFiles()
+#
+startupCacheFileName = "startup.pickleConfig"
+startupCacheSize = 10                   # the number of sets of startup files whose results are cached
+
+_noCacheRe = re.compile(r"^\s*#\s*eups:\s*nocache\b", re.MULTILINE)
+
+class _StartupCache(object):
+    """
+    the compiled code of startup files, and the properties set by sets of
+    startup files that do nothing else, as saved in the user's data directory
+    """
+    def __init__(self, userDataDir, verbose=0, log=utils.stdinfo):
+        self.userDataDir = userDataDir
+        self.fileName = os.path.join(userDataDir, "_caches_", startupCacheFileName)
+        self.verbose = verbose
+        self.log = log
+        self.modified = False
+
+        try:
+            fd = open(self.fileName, "rb")
+            try:
+                self.data = pickle.load(fd)
+            finally:
+                fd.close()
+        except Exception:               # missing, unreadable, or from another version of eups
+            self.data = None
+
+        # compiled code can only be used by the version of python that wrote it
+        if not isinstance(self.data, dict) or self.data.get("python") != sys.version:
+            self.data = dict(python=sys.version, code={}, configs=[])
+
+    def key(self, startupFiles, before):
+        """
+        return the key for the properties set by executing startupFiles when
+        the properties were initially before (as returned by _configSnapshot)
+        """
+        key = repr((utils.fileStat(os.path.join(os.path.dirname(__file__), "hooks.py")),
+                    [(f, proceed, utils.fileStat(f)) for f, proceed in startupFiles], sorted(before.items())))
+
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def lookupConfig(self, key):
+        """return the properties saved for key, or None"""
+        for k, changes in self.data["configs"]:
+            if k == key:
+                if self.verbose > 2:
+                    print("Using cached results of startup files", file=self.log)
+                return changes
+
+        return None
+
+    def saveConfig(self, key, changes):
+        """remember the properties (as returned by _configChanges) set by the startup files described by key"""
+        self.data["configs"] = [(key, changes)] + \
+            [kc for kc in self.data["configs"] if kc[0] != key][:startupCacheSize - 1]
+        self.modified = True
+
+    def compile(self, startupFile):
+        """
+        return the compiled code of startupFile, and whether it's a file whose
+        results may be cached
+        """
+        stat = utils.fileStat(startupFile)
+        if startupFile in self.data["code"]:
+            savedStat, code, onlySetsConfig = self.data["code"][startupFile]
+            if savedStat == stat:
+                return marshal.loads(code), onlySetsConfig
+
+        with open(startupFile) as fd:
+            source = fd.read()
+        code = compile(source, startupFile, 'exec')
+        onlySetsConfig = not _noCacheRe.search(source) and _onlySetsConfig(source)
+
+        self.data["code"][startupFile] = (stat, marshal.dumps(code), onlySetsConfig)
+        self.modified = True
+
+        return code, onlySetsConfig
+
+    def save(self):
+        """write the cache back to the user's data directory, if it's changed"""
+        if not self.modified or not os.path.isdir(self.userDataDir):
+            return
+
+        for f in list(self.data["code"].keys()):
+            if not os.path.exists(f):
+                del self.data["code"][f]
+
+        try:
+            if not os.path.isdir(os.path.dirname(self.fileName)):
+                os.makedirs(os.path.dirname(self.fileName))
+
+            fd = utils.AtomicFile(self.fileName, "wb")
+            pickle.dump(self.data, fd, protocol=2)
+            fd.close()
+        except (IOError, OSError) as e:
+            if self.verbose > 0:
+                print("Unable to cache startup files: %s" % e, file=utils.stdwarn)
+
+        self.modified = False
+
+def _configSnapshot(prop=None, prefix=""):
+    """
+    return a dict mapping the full name of each hooks.config property to its
+    pickled value (or None if it can't be pickled)
+    """
+    if prop is None:
+        prop = config
+
+    snapshot = {}
+    for name in [n for n in prop.__dict__.keys() if not n.startswith("_")]:
+        value = getattr(prop, name)
+        if isinstance(value, config.__class__): # not utils.ConfigProperty, in case utils has been reloaded
+            snapshot.update(_configSnapshot(value, prefix + name + "."))
+        else:
+            try:
+                snapshot[prefix + name] = pickle.dumps(value, protocol=2)
+            except Exception:
+                snapshot[prefix + name] = None
+
+    return snapshot
+
+def _configChanges(before, after):
+    """
+    return the properties that differ between two snapshots, or None if
+    any of them can't be pickled
+    """
+    changes = {}
+    for name, value in after.items():
+        if value != before.get(name):
+            if value is None:
+                return None
+            changes[name] = value
+
+    return changes
+
+def _restoreConfig(changes):
+    """set the properties saved by _configChanges"""
+    for name, value in changes.items():
+        parts = name.split(".")
+        prop = config
+        for p in parts[:-1]:
+            prop = getattr(prop, p)
+        setattr(prop, parts[-1], pickle.loads(value))
+
+def _onlySetsConfig(source):
+    """
+    return True if the python source does nothing but import eups modules and
+    set or update hooks.config properties with literal values
+    """
+    import ast
+
+    def isLiteral(node):
+        try:
+            ast.literal_eval(node)
+        except Exception:
+            return False
+        return True
+
+    def isConfig(node):
+        # is node a property of hooks.config (or eups.hooks.config)?
+        if not isinstance(node, (ast.Attribute, ast.Subscript)):
+            return False
+        while isinstance(node, (ast.Attribute, ast.Subscript)):
+            if isinstance(node, ast.Subscript):
+                index = node.slice
+                if index.__class__.__name__ == "Index": # python < 3.9
+                    index = index.value
+                if not isLiteral(index):
+                    return False
+            node = node.value
+
+            if isinstance(node, ast.Attribute) and node.attr == "config":
+                hooks = node.value
+                if isinstance(hooks, ast.Name) and hooks.id == "hooks":
+                    return True
+                if isinstance(hooks, ast.Attribute) and hooks.attr == "hooks" and \
+                   isinstance(hooks.value, ast.Name) and hooks.value.id == "eups":
+                    return True
+
+        return False
+
+    def isEupsModule(name):
+        return name == "eups" or (name or "").startswith("eups.")
+
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return False
+
+    for stmt in tree.body:
+        if isinstance(stmt, ast.Pass):
+            ok = True
+        elif isinstance(stmt, ast.Import):
+            ok = all(isEupsModule(a.name) for a in stmt.names)
+        elif isinstance(stmt, ast.ImportFrom):
+            ok = stmt.level == 0 and isEupsModule(stmt.module)
+        elif isinstance(stmt, ast.Assign):
+            ok = all(isConfig(t) for t in stmt.targets) and isLiteral(stmt.value)
+        elif isinstance(stmt, ast.AugAssign):
+            ok = isConfig(stmt.target) and isLiteral(stmt.value)
+        elif isinstance(stmt, ast.Expr):
+            call = stmt.value
+            if isLiteral(call):         # e.g. a docstring
+                ok = True
+            else:
+                ok = isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute) and \
+                     call.func.attr in ("append", "extend", "insert", "remove", "update") and \
+                     isConfig(call.func.value) and all(isLiteral(a) for a in call.args) and \
+                     not call.keywords and not getattr(call, "starargs", None) and \
+                     not getattr(call, "kwargs", None)
+        else:
+            ok = False
+
+        if not ok:
+            return False
+
+    return True
+
 commre = re.compile(r'\s*#.*$')
 namevalre = re.compile(r'\s*([:=]|\+=)\s*')
 def loadConfigProperties(configFile, verbose=0, log=utils.stdinfo):
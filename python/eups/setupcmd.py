@@ -16,12 +16,14 @@ The output of run() is a status code appropriate for passing to sys.exit().
 from __future__ import absolute_import, print_function
 import os
 import sys
-from .cmd import EupsOptionParser
+from .cmdbase import EupsOptionParser
 from .exceptions import EupsException
 import eups
 from . import lock
 from . import hooks
 from . import utils
+from . import timing
+from .SetupPlan import SetupPlanCache
 
 def append_current(option, opt_str, value, parser):
     """Add "current" to values.tag;  would use append_const but that's not in python 2.4"""
@@ -36,7 +38,7 @@ class EupsSetup(object):
 
     """
 
-    usage = "%prog [-h|--help|-V|--version] [options] [product [version]]"
+    usage = "%prog [-h|--help|-V|--version] [options] [product [version] | --batch FILE]"
 
     # set this to True if the description is preformatted.  If false, it
     # will be automatically reformatted to fit the screen
@@ -88,6 +90,8 @@ product and all its dependencies into the environment so that it can be used.
 
     def addOptions(self):
 
+        self.clo.add_option("-b", "--batch", dest="batch", action="store", metavar="FILE", default=None,
+                            help='(Un)Setup each product listed in FILE ("-" for stdin), one "product [version]" per line')
         self.clo.add_option("-c", "--current", dest="tag", action="callback", callback=append_current,
                             help="Use the current tag (equivalent to --postTag current)")
         self.clo.add_option("--noCallbacks", dest="noCallbacks", action="store_true",
@@ -96,7 +100,7 @@ product and all its dependencies into the environment so that it can be used.
                             help="The colon-separated list of product stacks (databases) to use. " +
                             "Default: $EUPS_PATH")
         self.clo.add_option("--debug", dest="debug", action="store", default="",
-                            help="turn on specified debugging behaviors (allowed: debug, profile, raise)")
+                            help="turn on specified debugging behaviors (allowed: debug, profile, raise, timing)")
         self.clo.add_option("-e", "--exact", dest="exact_version", action="store_true", default=False,
                             help="Don't use exact matching even though an explicit version is specified")
         self.clo.add_option("-f", "--flavor", dest="flavor", action="store",
@@ -146,6 +150,7 @@ product and all its dependencies into the environment so that it can be used.
                             help="Set the Version Resolution Order")
 
 
+    @timing.timed("setupcmd")
     def execute(self):
         productName = versionName = None
         if len(self.args) > 0:
@@ -173,7 +178,29 @@ product and all its dependencies into the environment so that it can be used.
             self.opts.exact_version = False
             self.opts.inexact_version = False
 
-        if self.opts.tablefile:         # we're setting up a product based only on a tablefile
+        products = None
+        if self.opts.batch:
+            if self.args or self.opts.productDir or self.opts.tablefile:
+                self.err("You may not specify a product, -r, or --table with --batch")
+                print(self.clo.get_usage(), file=utils.stderr)
+                return 3
+
+            try:
+                products = self.readBatch(self.opts.batch)
+            except (IOError, EupsException) as e:
+                self.err(str(e))
+                return 3
+
+            if not products:
+                self.err("No products are listed in %s" % self.opts.batch)
+                return 3
+            #
+            # Use the version (if any) of the first product to choose the VRO
+            #
+            versions = [v for n, v in products if v]
+            if versions:
+                versionName = versions[0]
+        elif self.opts.tablefile:       # we're setting up a product based only on a tablefile
             if self.opts.unsetup:
                 self.err("Ignoring --table as I'm unsetting up a product")
                 self.opts.tablefile = None
@@ -189,7 +216,9 @@ product and all its dependencies into the environment so that it can be used.
                     self.opts.productDir = os.path.dirname(self.opts.tablefile)
                     productName = os.path.splitext(os.path.basename(self.opts.tablefile))[0]
 
-        if not self.opts.productDir and not productName:
+        if products:
+            pass
+        elif not self.opts.productDir and not productName:
             self.err("please specify at least a product name or use -r")
             print(self.clo.get_usage(), file=utils.stderr)
             return 3
@@ -209,7 +238,7 @@ product and all its dependencies into the environment so that it can be used.
                     e.status = 4
                     raise
 
-        if not productName:
+        if not productName and not products:
             self.err("Please specify a product")
             print(self.clo.get_usage(), file=utils.stderr)
             return 3
@@ -224,67 +253,93 @@ product and all its dependencies into the environment so that it can be used.
         locks = lock.takeLocks("setup", path, lock.LOCK_SH,
                                nolocks=self.opts.nolocks, verbose=self.opts.verbose - self.opts.quiet)
         #
+        # Maybe we've already done exactly this setup, in which case we can reuse the commands
+        #
+        planCache = planKey = None
+        if self.usePlanCache():
+            try:
+                planCache = SetupPlanCache(path, verbose=self.opts.verbose)
+                planKey = planCache.key((self.prog, sorted(vars(self.opts).items()), self.args, products))
+                plan = planCache.lookup(planKey)
+            except Exception as e:
+                self.err("Unable to read the setup plan cache: %s" % e)
+                planCache = plan = None
+
+            if plan is not None:
+                lock.giveLocks(locks, self.opts.verbose)
+                cmds, messages = plan
+                sys.stderr.write(messages)
+                print(";\n".join(cmds))
+                return 0
+        #
         # Do the work
         #
         status = 0
         try:
-            try:
-                Eups = eups.Eups(flavor=self.opts.flavor, path=self.opts.path,
-                                 dbz=self.opts.dbz, # root=self.opts.productDir,
-                                 readCache=False, force=self.opts.force,
-                                 quiet=self.opts.quiet, verbose=self.opts.verbose,
-                                 noaction=self.opts.noaction, keep=self.opts.keep,
-                                 ignore_versions=self.opts.ignoreVer, setupType=self.opts.setupType,
-                                 max_depth=self.opts.max_depth, vro=self.opts.vro,
-                                 exact_version=self.opts.exact_version, cmdName="setup")
-
-                Eups._processDefaultTags(self.opts)
-
-                if not self.opts.noCallbacks:
-                    try:
-                        eups.commandCallbacks.apply(Eups, cmdName, self.opts, self.args)
-                    except eups.OperationForbidden as e:
-                        e.status = 255
-                        raise
-                    except Exception as e:
-                        e.status = 9
-                        raise
-
-                Eups.selectVRO(self.opts.tag, self.opts.productDir, versionName, self.opts.dbz,
-                               inexact_version=self.opts.inexact_version, postTag=self.opts.postTag)
-
-                if self.opts.tag:
-                    for t in self.opts.tag:
-                        if Eups.isUserTag(t):
-                            break
-
-                Eups.includeUserDataDirInPath()
-                for user in Eups.tags.owners.values():
-                    Eups.includeUserDataDirInPath(eups.utils.defaultUserDataDir(user))
-                #
-                # If they specify a productDir in addition to a complete product + version specification
-                # Use that product + version's expanded table file, but this directory
-                #
-                if self.opts.productDir and not self.opts.tablefile and productName and versionName:
-                    prod = Eups.findProduct(productName, versionName)
-                    if not prod:
-                        self.err("Unable to find %s %s" % (productName, versionName))
-                        return 3
-
-                    tablefile = prod.tablefile
-                else:
-                    tablefile=self.opts.tablefile
-
-                cmds = eups.setup(productName, versionName, self.opts.tag, self.opts.productDir,
-                                  Eups, fwd=not self.opts.unsetup, tablefile=tablefile,
-                                  postTags=self.opts.postTag)
-
-            except EupsException as e:
-                e.status = 1
-                raise
-            except Exception as e:
-                e.status = -1
-                raise
+            with utils.StderrRecorder() as recorder: # the messages to save with the plan
+                try:
+                    Eups = eups.Eups(flavor=self.opts.flavor, path=self.opts.path,
+                                     dbz=self.opts.dbz, # root=self.opts.productDir,
+                                     readCache=False, force=self.opts.force,
+                                     quiet=self.opts.quiet, verbose=self.opts.verbose,
+                                     noaction=self.opts.noaction, keep=self.opts.keep,
+                                     ignore_versions=self.opts.ignoreVer, setupType=self.opts.setupType,
+                                     max_depth=self.opts.max_depth, vro=self.opts.vro,
+                                     exact_version=self.opts.exact_version, cmdName="setup")
+
+                    Eups._processDefaultTags(self.opts)
+
+                    if not self.opts.noCallbacks:
+                        try:
+                            eups.commandCallbacks.apply(Eups, cmdName, self.opts, self.args)
+                        except eups.OperationForbidden as e:
+                            e.status = 255
+                            raise
+                        except Exception as e:
+                            e.status = 9
+                            raise
+
+                    Eups.selectVRO(self.opts.tag, self.opts.productDir, versionName, self.opts.dbz,
+                                   inexact_version=self.opts.inexact_version, postTag=self.opts.postTag)
+
+                    if self.opts.tag:
+                        for t in self.opts.tag:
+                            if Eups.isUserTag(t):
+                                break
+
+                    Eups.includeUserDataDirInPath()
+                    for user in Eups.tags.owners.values():
+                        Eups.includeUserDataDirInPath(eups.utils.defaultUserDataDir(user))
+                    if products:
+                        cmds = eups.setupMany(products, self.opts.tag, Eups, fwd=not self.opts.unsetup,
+                                              postTags=self.opts.postTag)
+                    else:
+                        #
+                        # If they specify a productDir in addition to a complete product + version
+                        # specification use that product + version's expanded table file, but this directory
+                        #
+                        if self.opts.productDir and not self.opts.tablefile and productName and versionName:
+                            prod = Eups.findProduct(productName, versionName)
+                            if not prod:
+                                self.err("Unable to find %s %s" % (productName, versionName))
+                                return 3
+
+                            tablefile = prod.tablefile
+                        else:
+                            tablefile=self.opts.tablefile
+
+                        cmds = eups.setup(productName, versionName, self.opts.tag, self.opts.productDir,
+                                          Eups, fwd=not self.opts.unsetup, tablefile=tablefile,
+                                          postTags=self.opts.postTag)
+
+                except EupsException as e:
+                    e.status = 1
+                    raise
+                except Exception as e:
+                    e.status = -1
+                    raise
+            if planCache and "false" not in cmds:
+                planCache.save(planKey, cmds, Eups, recorder.getvalue())
         finally:
             lock.giveLocks(locks, self.opts.verbose)
 
@@ -295,6 +350,51 @@ product and all its dependencies into the environment so that it can be used.
 
         return status
 
+    def usePlanCache(self):
+        """
+        Return True if we may use (and update) the cache of setup plans.  We
+        don't if it's been disabled (via hooks.config.Eups.setupPlanCache),
+        if there are callbacks (which we can't promise not to change the
+        result), or if we're setting up a product from a directory or table
+        file, or being asked to describe what we're doing
+        """
+        if not hooks.config.Eups.setupPlanCache or eups.commandCallbacks.callbacks:
+            return False
+
+        if self.opts.productDir or self.opts.tablefile or self.opts.noaction or self.opts.verbose > 0:
+            return False
+
+        return True
+
+    def readBatch(self, fileName):
+        """
+        Return the (productName, versionName) pairs listed in fileName, one
+        "product [version]" per line; blank lines and comments (starting with
+        "#") are ignored.  If fileName is "-", read standard input.
+        """
+        if fileName == "-":
+            fd = sys.stdin
+        else:
+            fd = open(fileName)
+
+        products = []
+        try:
+            for lineno, line in enumerate(fd):
+                line = line.split("#", 1)[0].split()
+                if not line:
+                    continue
+                if len(line) > 2:
+                    raise EupsException("%s:%d: expected \"product [version]\"; saw \"%s\"" %
+                                        (fileName, lineno + 1, " ".join(line)))
+                if len(line) == 1:
+                    line.append(None)
+                products.append(tuple(line))
+        finally:
+            if fd is not sys.stdin:
+                fd.close()
+
+        return products
+
     def err(self, msg, volume=0):
         """
         print an error message to standard error.  The message will only
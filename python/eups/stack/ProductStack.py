@@ -1,13 +1,19 @@
 from __future__ import absolute_import, print_function
-import re, os, sys
+import re, os, sys, time, mmap, struct, hashlib
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
 from eups import utils
 from eups import Product
+from eups import hooks
+from eups import table as mod_table
 from .ProductFamily import ProductFamily
-from eups.exceptions import EupsException,ProductNotFound, UnderSpecifiedProduct
+from eups.exceptions import EupsException,ProductNotFound, UnderSpecifiedProduct, TableError
 from eups.db import Database
 from ..utils import xrange
 
@@ -16,7 +22,14 @@ from ..utils import xrange
 
 # the version name for the persistence format used by this implementation.
 # It is intended to match the version of EUPS when this format was introduced
-persistVersionName = "1.3.0"
+persistVersionName = "2.2.0"
+
+# the bytes that start a cache file in the current format.  They are followed
+# by the length of the pickled header (as an 8-byte big-endian integer), the
+# header itself, and then one pickled ProductFamily record per product; the
+# header holds an index giving the offset and length of each record.
+persistMagic = ("EUPS product cache %s\n" % persistVersionName).encode("ascii")
+_headerLen = struct.Struct(">Q")
 
 # the prefix to a tag name that labels it as a user tag.  Anything left over is
 # considered a global tag.
@@ -59,6 +72,18 @@ class ProductStack(object):
     # static variable: name of file extension to use to persist data
     userTagFileExt = "pickleTag%s" % dotre.sub('_', persistVersionName)
 
+    # static variable: name of the directory (within the persist directory)
+    # holding parsed table files.  It is hidden so that it is never mistaken
+    # for a product directory when the cache is kept in the database itself.
+    tableCacheDirName = ".tables"
+
+    # static variable: name of file extension to use to persist parsed tables
+    tableFileExt = "pickleTable%s" % dotre.sub('_', persistVersionName)
+
+    # static variable: name of file extension to use to persist the
+    # dependency index
+    usesFileExt = "pickleUses%s" % dotre.sub('_', persistVersionName)
+
     def __init__(self, dbpath, persistDir=None, autosave=True):
         """
         create the stack with a given database
@@ -119,6 +144,29 @@ class ProductStack(object):
         # True if python is new enough to pickle the cache data
         self.canCache = utils.canPickle()
 
+        # a record of the modification times of the database files (as
+        # returned by _snapshotDatabase()) that the data for each flavor
+        # reflects, keyed by flavor.  This is persisted along with the
+        # product data so that a stale cache can be updated product by
+        # product rather than being regenerated.
+        self.dbstate = {}
+
+        # the database record applying to all flavors read in by the last
+        # call to refreshFromDatabase()
+        self._dbSnapshot = None
+
+        # an index of the names of the products that each product's table
+        # file may setup, used to find which products use which.  It is
+        # keyed by flavor, then by (product name, version); each value is
+        # a tuple of (stamp, names) where the stamp records the state of the
+        # table file when the names were read from it.  It is loaded from
+        # disk (and persisted) separately from the product data, and only
+        # when needed.
+        self._usesIndex = {}
+
+        # the flavors whose dependency index has changed since it was loaded
+        self._usesIndexUpdated = []
+
 
     def getDbPath(self):
         """
@@ -298,8 +346,30 @@ class ProductStack(object):
             self.lookup[flavor] = {}
         flavorData = self.lookup[flavor]
 
+        # each family is stored as a separate record so that it can be decoded
+        # on its own; those never decoded since being read are copied as is
+        records = []
+        index = {}
+        offset = 0
+        for name in flavorData.keys():
+            if isinstance(flavorData, _FamilyLookup):
+                rec = flavorData.getRecord(name)
+            else:
+                rec = pickle.dumps(flavorData[name], protocol=2)
+            index[name] = (offset, len(rec))
+            offset += len(rec)
+            records.append(rec)
+
+        header = pickle.dumps({ "index": index,
+                                "dbstate": self.dbstate.get(flavor) or self._dbSnapshot },
+                              protocol=2)
+
         fd = utils.AtomicFile(file, "wb")
-        pickle.dump(flavorData, fd, protocol=2)
+        fd.write(persistMagic)
+        fd.write(_headerLen.pack(len(header)))
+        fd.write(header)
+        for rec in records:
+            fd.write(rec)
         fd.close()
         self.modtimes[file] = os.stat(file).st_mtime
 
@@ -383,6 +453,7 @@ class ProductStack(object):
                                                      prod.dir,
                                                      prod.tablefile,
                                                      prod._table)
+        self._forgetDependencies(flavor, prod.name, prod.version)
         for tag in prod.tags:
             self.lookup[flavor][prod.name].assignTag(tag, prod.version)
 
@@ -459,6 +530,7 @@ class ProductStack(object):
         try:
             updated = self.lookup[flavor][name].removeVersion(version)
             if updated:
+                self._forgetDependencies(flavor, name, version)
                 if len(self.lookup[flavor][name].getVersions()) == 0:
                     del self.lookup[flavor][name]
                 self._flavorsUpdated(flavor)
@@ -660,6 +732,209 @@ class ProductStack(object):
                     print("Deleting %s" % (fileName), file=sys.stderr)
                 os.remove(fileName)
 
+            fileName = self._usesPath(flavor, cachedir)
+            if os.path.exists(fileName):
+                if verbose > 0:
+                    print("Deleting %s" % (fileName), file=sys.stderr)
+                os.remove(fileName)
+            if flavor in self._usesIndex:
+                del self._usesIndex[flavor]
+
+        self.clearTableCache(cachedir, verbose)
+
+    def _usesPath(self, flavor, dir=None):
+        return os.path.join(self._persistDir(dir),
+                            "%s.%s" % (flavor, self.usesFileExt))
+
+    def _getUsesIndex(self, flavor):
+        # return the dependency index for a flavor, loading it if necessary
+        if flavor not in self._usesIndex:
+            index = {}
+            fileName = self._usesPath(flavor)
+            if os.path.exists(fileName):
+                try:
+                    fd = open(fileName, "rb")
+                    try:
+                        index = pickle.load(fd)
+                    finally:
+                        fd.close()
+                except Exception:
+                    # an unreadable index is simply rebuilt
+                    index = {}
+            self._usesIndex[flavor] = index
+
+        return self._usesIndex[flavor]
+
+    def _forgetDependencies(self, flavor, name, version):
+        # remove a product from the dependency index, if it is loaded, so
+        # that its table will be read again when next needed
+        index = self._usesIndex.get(flavor)
+        if index and (name, version) in index:
+            del index[(name, version)]
+            if flavor not in self._usesIndexUpdated:
+                self._usesIndexUpdated.append(flavor)
+
+    def dependencyNames(self, product):
+        """
+        return the names of the products that a product's table file may
+        setup (see Table.dependencyNames()).  These are taken from the
+        stack's dependency index unless the table file has changed since it
+        was indexed, in which case the table is read and the index updated.
+        None is returned if the names can't be known in advance.
+
+        @param product   the Product of interest, as returned by getProduct()
+        """
+        tablefile = product.tableFileName()
+        try:
+            mtime = tablefile and os.stat(tablefile).st_mtime
+        except OSError:
+            mtime = None
+        stamp = (tablefile, mtime, hooks.config.Eups.defaultProduct["name"])
+
+        index = self._getUsesIndex(product.flavor)
+        key = (product.name, product.version)
+        if key in index and index[key][0] == stamp:
+            return index[key][1]
+
+        if mtime is None:
+            names = set()               # there's no table (or it can't be found)
+        else:
+            try:
+                table = product.getTable(quiet=True)
+                if table:
+                    names = table.dependencyNames()
+                else:
+                    names = set()
+            except TableError:
+                names = None
+
+        index[key] = (stamp, names)
+        if product.flavor not in self._usesIndexUpdated:
+            self._usesIndexUpdated.append(product.flavor)
+
+        return names
+
+    def saveDependencyIndex(self):
+        """
+        persist the dependency index for any flavors for which it has been
+        updated.  Products no longer in the stack are dropped from the index.
+        An index that can't be written is silently left unsaved.
+        """
+        for flavor in self._usesIndexUpdated:
+            index = self._usesIndex[flavor]
+            products = self.lookup.get(flavor, {})
+            for key in list(index.keys()):
+                if key[0] not in products or \
+                   not products[key[0]].hasVersion(key[1]):
+                    del index[key]
+
+            try:
+                fd = utils.AtomicFile(self._usesPath(flavor), "wb")
+                pickle.dump(index, fd, protocol=2)
+                fd.close()
+            except (IOError, OSError):
+                pass
+
+        self._usesIndexUpdated = []
+
+    def _tableCachePath(self, tablefile, product, addDefaultProduct, dir=None):
+        """
+        return the path to the file caching the parsed contents of a table
+        file along with the key recorded in it.  The key changes whenever the
+        table file, the table parser, or anything else the parse depends on
+        does;  the file's name doesn't, so an out of date entry is replaced.
+        """
+        tablefile = os.path.abspath(tablefile)
+        st = os.stat(tablefile)
+        parser = os.stat(mod_table.__file__)
+        defaultProduct = None
+        if addDefaultProduct is not False:
+            defaultProduct = sorted(hooks.config.Eups.defaultProduct.items())
+
+        key = repr((self.persistVersion, parser.st_size, parser.st_mtime,
+                    tablefile, st.st_size, st.st_mtime, product.name,
+                    defaultProduct))
+        name = repr((tablefile, product.name, defaultProduct))
+        fileName = "%s.%s" % (hashlib.sha1(name.encode("utf-8")).hexdigest(),
+                              self.tableFileExt)
+
+        return os.path.join(self._persistDir(dir), self.tableCacheDirName,
+                            fileName), key
+
+    def readTable(self, tablefile, product, addDefaultProduct=None, verbose=0):
+        """
+        return the Table for a product's table file, parsed but with its
+        EUPS variables not yet expanded.  A copy parsed earlier is taken from
+        the table cache kept in the persist directory as long as the table
+        file has not changed; otherwise the file is parsed and the result
+        added to the cache.
+        @param tablefile          the path to the table file
+        @param product            the Product that owns the table
+        @param addDefaultProduct  passed on to the Table constructor
+        @param verbose            chattiness
+        """
+        try:
+            cacheFile, key = self._tableCachePath(tablefile, product,
+                                                  addDefaultProduct)
+        except OSError:
+            cacheFile = None
+
+        if cacheFile and os.path.exists(cacheFile):
+            try:
+                fd = open(cacheFile, "rb")
+                try:
+                    cachedKey, table = pickle.load(fd)
+                finally:
+                    fd.close()
+                if cachedKey == key:
+                    table.setTopProduct(product)
+                    return table
+            except Exception:
+                # an unreadable entry is simply replaced
+                pass
+
+        table = mod_table.Table(tablefile, product,
+                                addDefaultProduct=addDefaultProduct,
+                                verbose=verbose)
+
+        if cacheFile:
+            try:
+                cacheDir = os.path.dirname(cacheFile)
+                if not os.path.isdir(cacheDir):
+                    os.makedirs(cacheDir)
+                fd = utils.AtomicFile(cacheFile, "wb")
+                pickle.dump((key, table), fd, protocol=2)
+                fd.close()
+            except (IOError, OSError) as e:
+                if verbose > 1:
+                    print("Unable to cache table %s: %s" % (tablefile, e),
+                          file=sys.stderr)
+
+        return table
+
+    def clearTableCache(self, cachedir=None, verbose=0):
+        """
+        remove the cached parsed table files.
+        @param cachedir   the directory where to find the cache.  If not
+                            provided, it will default to the current persist
+                            directory or, if that is not set, to the database
+                            directory.
+        """
+        tableDir = os.path.join(self._persistDir(cachedir),
+                                self.tableCacheDirName)
+        if not os.path.isdir(tableDir):
+            return
+
+        for file in os.listdir(tableDir):
+            if file.endswith(self.tableFileExt):
+                fileName = os.path.join(tableDir, file)
+                if verbose > 1:
+                    print("Deleting %s" % (fileName), file=sys.stderr)
+                os.remove(fileName)
+
+        if not os.listdir(tableDir):
+            os.rmdir(tableDir)
+
     def reload(self, flavors=None, persistDir=None, verbose=0):
         """
         throw away all information on products and replace it with the data
@@ -688,11 +963,7 @@ class ProductStack(object):
         for flavor in flavors:
             fileName = self._persistPath(flavor,persistDir)
             self.modtimes[fileName] = os.stat(fileName).st_mtime
-            fd = open(fileName, "rb")
-            lookup = pickle.load(fd)
-            fd.close()
-
-            self.lookup[flavor] = lookup
+            self.lookup[flavor], self.dbstate[flavor] = _readCacheFile(fileName)
 
     @staticmethod
     def findCachedFlavors(dir):
@@ -718,11 +989,114 @@ class ProductStack(object):
 
         # forget!
         self.lookup = {}
+        self.dbstate = {}
+
+        # note the state of the database before reading it so that any
+        # change made while we read is caught next time
+        self._dbSnapshot = self._snapshotDatabase(self._persistDir())
 
         for prodname in db.findProductNames():
             for product in db.findProducts(prodname):
                 self.addProduct(product)
 
+    def refreshProducts(self, productNames, flavors=None, userTagDir=None):
+        """
+        reload the information for the given products directly from the
+        database files on disk, leaving that of all other products untouched.
+        Products that are no longer declared are removed.
+
+        @param productNames  the names of the products to refresh.  This can
+                                be a list or a space-delimited string.
+        @param flavors       the flavors to refresh the products for.  This
+                                can be a single string or a list.  If None,
+                                all flavors currently loaded are refreshed.
+        @param userTagDir    if provided, user tag assignments will be loaded
+                                along with the products.
+        """
+        if utils.is_string(productNames):
+            productNames = productNames.split()
+        if flavors is None:
+            flavors = self.getFlavors()
+        elif not isinstance(flavors, list):
+            flavors = [flavors]
+
+        db = Database(self.dbpath, userTagDir)
+
+        autosave, self.autosave = self.autosave, False
+        try:
+            for flavor in flavors:
+                self.addFlavor(flavor)
+                for name in productNames:
+                    if name in self.lookup[flavor]:
+                        del self.lookup[flavor][name]
+            self._flavorsUpdated(flavors)
+
+            for name in productNames:
+                for product in db.findProducts(name, flavors=flavors):
+                    self.addProduct(product)
+        finally:
+            self.autosave = autosave
+
+        if self.autosave: self.save(flavors)
+
+    def _snapshotDatabase(self, cacheDir=None, products=True):
+        # return the state of the database and, if it is a different
+        # directory, the user tag database kept in cacheDir.  The result is
+        # a dictionary keyed by directory whose values are dictionaries
+        # holding the "generation" of the database (see
+        # Database.getGeneration()) and, if products is True, the
+        # modification times of each product's files as returned by
+        # Database.getProductTimestamps().
+        dirs = [self.dbpath]
+        if cacheDir and cacheDir != self.dbpath and os.path.isdir(cacheDir):
+            dirs.append(cacheDir)
+
+        # the generations are read first so that a change made while we
+        # look at the files is caught next time
+        out = {}
+        for dir in dirs:
+            out[dir] = { "generation": Database(dir).getGeneration() }
+        if not products:
+            return out
+
+        # file timestamps may have a coarse resolution, so a file written
+        # just now could be updated again without its time changing.  Such
+        # times are recorded as None so that the product is always
+        # considered changed until its files have settled.
+        racy = time.time() - 1
+
+        for dir in dirs:
+            times = Database(dir).getProductTimestamps()
+            for files in times.values():
+                for file, mtime in files.items():
+                    if mtime >= racy:
+                        files[file] = None
+            out[dir]["products"] = times
+        return out
+
+    def _journaledChanges(self, before, after):
+        # return the names of the products changed between two records
+        # returned by _snapshotDatabase() according to the databases'
+        # journals, or None if the journals cannot tell
+        if sorted(before.keys()) != sorted(after.keys()):
+            return None
+
+        db = Database(self.dbpath)
+        out = set()
+        for dir in before.keys():
+            generation = before[dir].get("generation")
+            if generation == after[dir].get("generation"):
+                continue
+
+            changed = db.getChangedProducts(generation, dir)
+            if changed is None:
+                return None
+            out.update(changed)
+
+        out = list(out)
+        out.sort()
+        return out
+
     def _loadUserTags(self, userTagDir=None):
         if not userTagDir:
             userTagDir = self.persistDir
@@ -756,7 +1130,7 @@ class ProductStack(object):
 
     # @staticmethod   # requires python 2.4
     def fromCache(dbpath, flavors, persistDir=None, userTagDir=None,
-                  updateCache=True, autosave=True, verbose=0):
+                  updateCache=True, autosave=True, verify=False, verbose=0):
         """
         return a ProductStack that has all products loaded in from the
         available caches.  If they are out of date (or non-existent), this
@@ -783,6 +1157,11 @@ class ProductStack(object):
                                appear out of date
         @param autosave     if true (default), all updates will be
                                saved to disk.
+        @param verify       if true, compare the cache against every file
+                               in the database even if the database's
+                               generation shows it to be unchanged.  This
+                               catches updates made by tools (or versions
+                               of EUPS) that do not maintain the generation.
         """
         if not flavors:
             raise RuntimeError("ProductStack.fromCache(): at least one flavor needed as input" +
@@ -792,9 +1171,14 @@ class ProductStack(object):
 
         out = ProductStack(dbpath, persistDir, False)
 
-        cacheOkay = out._tryCache(dbpath, persistDir, flavors, verbose=verbose)
-        if not cacheOkay:
-            cacheOkay = out._tryCache(dbpath, dbpath, flavors)
+        cacheOkay = out._tryCache(dbpath, persistDir, flavors, userTagDir,
+                                  verify=verify, verbose=verbose)
+        if cacheOkay:
+            # save any products that needed to be updated
+            if updateCache and out.saveNeeded():  out.save()
+        else:
+            cacheOkay = out._tryCache(dbpath, dbpath, flavors, userTagDir,
+                                      verify=verify)
             if cacheOkay:
                 out._loadUserTags(userTagDir)
 
@@ -808,21 +1192,93 @@ class ProductStack(object):
 
     fromCache = staticmethod(fromCache)    # works since python2.2
 
-    def _tryCache(self, dbpath, cacheDir, flavors, verbose=0):
+    def _tryCache(self, dbpath, cacheDir, flavors, userTagDir=None, verify=False,
+                  verbose=0):
         if not cacheDir or not os.path.exists(cacheDir):
             return False
 
         cacheOkay = True
         for flav in flavors:
-            if not self.cacheIsUpToDate(flav, cacheDir):
+            if not os.path.exists(self._persistPath(flav, cacheDir)):
                 cacheOkay = False
                 if verbose > 1:
-                    print("Regenerating missing or out-of-date cache for %s in %s" % (flav, dbpath), file=sys.stderr)
+                    print("Regenerating missing cache for %s in %s" % (flav, dbpath), file=sys.stderr)
                 break
 
         if cacheOkay:
-            self.reload(flavors, cacheDir, verbose=verbose)
+            try:
+                self.reload(flavors, cacheDir, verbose=verbose)
+            except CacheFormatError as e:
+                cacheOkay = False
+                if verbose > 1:
+                    print("Regenerating unreadable cache for %s: %s" % (dbpath, e), file=sys.stderr)
+
+        # set to True if the database files had to be examined; if the
+        # generations of the databases show them unchanged (or their
+        # journals say what changed), we needn't look
+        scanned = False
+        if cacheOkay:
+            generations = None
+            current = None
+            for flav in flavors:
+                if self.dbstate.get(flav) is None:
+                    # no record of the database state; compare the
+                    # timestamps of the whole database with the cache file
+                    scanned = True
+                    if not self.cacheIsUpToDate(flav, cacheDir):
+                        cacheOkay = False
+                        if verbose > 1:
+                            print("Regenerating out-of-date cache for %s in %s" % (flav, dbpath), file=sys.stderr)
+                        break
+                    continue
+
+                if os.environ.get("_EUPS_ASSUME_CACHES_UP_TO_DATE", "0") == "1":
+                    scanned = True
+                    continue
+
+                if not verify:
+                    if generations is None:
+                        generations = self._snapshotDatabase(cacheDir, products=False)
+                    if _sameGeneration(self.dbstate[flav], generations):
+                        continue
+
+                    # see if the databases' journals can tell us what changed
+                    changed = self._journaledChanges(self.dbstate[flav], generations)
+                    if changed is not None:
+                        if changed:
+                            if verbose > 1:
+                                print("Updating %d journaled product(s) in cache for %s in %s" %
+                                      (len(changed), flav, dbpath), file=sys.stderr)
+                            self.refreshProducts(changed, flav, userTagDir)
+                        self.dbstate[flav] = _withGenerations(self.dbstate[flav], generations)
+                        self._flavorsUpdated(flav) # so that the new state is saved
+                        continue
+
+                scanned = True
+                if current is None:
+                    current = self._snapshotDatabase(cacheDir)
+                changed = _changedProducts(self.dbstate[flav], current)
+                if changed is None:
+                    cacheOkay = False
+                    if verbose > 1:
+                        print("Regenerating out-of-date cache for %s in %s" % (flav, dbpath), file=sys.stderr)
+                    break
+
+                if changed:
+                    if verbose > 1 or (verify and verbose > 0):
+                        print("Updating %d changed product(s) in cache for %s in %s" %
+                              (len(changed), flav, dbpath), file=sys.stderr)
+                    self.refreshProducts(changed, flav, userTagDir)
+                if self.dbstate[flav] != current:
+                    self.dbstate[flav] = current
+                    self._flavorsUpdated(flav) # so that the new state is saved, even if no product changed
+
+            if not cacheOkay:
+                self.lookup = {}   # forget loaded data
+                self.dbstate = {}
+                self.updated = []
 
+        if cacheOkay and scanned:
             # do a final consistency check; do we have the same products
             dbnames = Database(dbpath).findProductNames()
             dbnames.sort()
@@ -835,11 +1291,140 @@ class ProductStack(object):
             if dbnames != cachenames:
                 cacheOkay = False
                 self.lookup = {}   # forget loaded data
+                self.dbstate = {}
+                self.updated = []
                 if verbose:
                   print("Regenerating out-of-date cache for %s in %s" % (flav, dbpath), file=sys.stderr)
 
         return cacheOkay
 
+class _FamilyLookup(MutableMapping):
+    """
+    the ProductFamily instances for one flavor as read from a cache file,
+    keyed by product name.  A family is only decoded from the file when it is
+    first accessed, so the cost of reading a cache is proportional to the
+    number of products actually used rather than to the size of the stack.
+    """
+    def __init__(self, data, index, start):
+        """
+        @param data     the (typically memory-mapped) contents of the file
+        @param index    a dictionary giving the offset (relative to start)
+                           and length of the record for each product
+        @param start    the offset in data of the first record
+        """
+        self._data = data
+        self._index = index
+        self._start = start
+
+        # the families decoded (or added) so far
+        self._families = {}
+
+    def getRecord(self, name):
+        """
+        return the pickled form of the named family, taken directly from the
+        file if it has not been decoded.
+        """
+        if name in self._families:
+            return pickle.dumps(self._families[name], protocol=2)
+        offset, length = self._index[name]
+        offset += self._start
+        return self._data[offset:offset+length]
+
+    def __getitem__(self, name):
+        if name not in self._families:
+            self._families[name] = pickle.loads(self.getRecord(name))
+            del self._index[name]
+        return self._families[name]
+
+    def __setitem__(self, name, family):
+        self._index.pop(name, None)
+        self._families[name] = family
+
+    def __delitem__(self, name):
+        if name in self._families:
+            del self._families[name]
+        else:
+            del self._index[name]
+
+    def __contains__(self, name):
+        return name in self._families or name in self._index
+
+    def __iter__(self):
+        for name in list(self._families.keys()) + list(self._index.keys()):
+            yield name
+
+    def __len__(self):
+        return len(self._families) + len(self._index)
+
+    def keys(self):
+        return list(self)
+
+def _readCacheFile(fileName):
+    # return the product lookup and database state stored in a cache file
+    fd = open(fileName, "rb")
+    try:
+        try:
+            data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            data = fd.read()            # e.g. mmap is not supported here
+    finally:
+        fd.close()
+
+    start = len(persistMagic)
+    if data[:start] != persistMagic:
+        raise CacheFormatError(fileName)
+    try:
+        length = _headerLen.unpack(data[start:start+_headerLen.size])[0]
+        start += _headerLen.size
+        header = pickle.loads(data[start:start+length])
+    except Exception:
+        raise CacheFormatError(fileName)
+    start += length
+
+    return _FamilyLookup(data, header["index"], start), header["dbstate"]
+
+def _sameGeneration(before, after):
+    # return True if two records returned by ProductStack._snapshotDatabase()
+    # describe the same directories at the same generations.  A directory
+    # with no generation (e.g. a user data directory in which no tags have
+    # been assigned) hasn't been changed by this version of EUPS;  use
+    # verify=True to catch changes made by older ones
+    if sorted(before.keys()) != sorted(after.keys()):
+        return False
+
+    for dir in before.keys():
+        if before[dir].get("generation") != after[dir].get("generation"):
+            return False
+    return True
+
+def _withGenerations(state, generations):
+    # return a copy of a record returned by ProductStack._snapshotDatabase()
+    # updated to the generations given in another
+    out = {}
+    for dir in state.keys():
+        out[dir] = state[dir].copy()
+        out[dir]["generation"] = generations[dir]["generation"]
+    return out
+
+def _changedProducts(before, after):
+    # return the names of the products whose database files differ between
+    # two records returned by ProductStack._snapshotDatabase(), or None if
+    # the records do not describe the same directories
+    if sorted(before.keys()) != sorted(after.keys()):
+        return None
+
+    changed = set()
+    for dir in before.keys():
+        old, new = before[dir].get("products"), after[dir].get("products")
+        if old is None or new is None:
+            return None
+        for name in set(old.keys()) | set(new.keys()):
+            times = old.get(name)
+            if times != new.get(name) or (times and None in times.values()):
+                changed.add(name)
+
+    return sorted(changed)
+
 def _uniquify(lis):
     for i in xrange(len(lis)):
         item = lis.pop(0)
@@ -888,3 +1473,18 @@ class CacheOutOfSync(EupsException):
         self.flavors = flavors
         self.maxsave = maxsave
 
+class CacheFormatError(EupsException):
+    """
+    A cache file does not contain product data in the format used by this
+    version of EUPS.
+    """
+    def __init__(self, file, msg=None):
+        """
+        @param file     the unreadable cache file
+        """
+        message = msg
+        if message is None:
+            message = "%s: not a product cache in format %s" % \
+                      (file, persistVersionName)
+        EupsException.__init__(self, message)
+        self.file = file
@@ -15,6 +15,40 @@ from .VersionParser import VersionParser
 from . import utils
 from . import hooks
 
+#
+# Patterns used to parse table files; they are compiled once as every line of
+# every table file goes through them
+#
+_keywordRe = re.compile(r"^(\w+)\s*[=:]")
+_fileRe = re.compile(r"^File\s*=\s*(\w+)", re.IGNORECASE)
+_productRe = re.compile(r"^Product\s*=\s*(\w+)", re.IGNORECASE)
+_actionRe = re.compile(r"^Action\s*=\s*([\w+.]+)", re.IGNORECASE)
+_qualifiersRe = re.compile(r"^Qualifiers\s*=\s*\"([^\"]*)\"", re.IGNORECASE)
+_groupRe = re.compile(r"^Group:\s*$", re.IGNORECASE)
+_commonRe = re.compile(r"^Common:\s*$", re.IGNORECASE)
+_endRe = re.compile(r"^End:\s*$", re.IGNORECASE)
+_flavorRe = re.compile(r"^Flavor\s*=\s*([\w+.]+)", re.IGNORECASE)
+
+# Older synonyms for eups variables in table files
+_synonyms = {
+    "PROD_DIR" : "${PRODUCT_DIR}",
+    "UPS_PROD_DIR" : "${PRODUCT_DIR}",
+    "UPS_PROD_FLAVOR" : "${PRODUCT_FLAVOR}",
+    "UPS_PROD_NAME" : "${PRODUCT_NAME}",
+    "UPS_PROD_VERSION" : "${PRODUCT_VERSION}",
+    "UPS_DB" : "${PRODUCTS}",
+    "UPS_UPS_DIR" : "${UPS_DIR}",
+    }
+_synonymRe = re.compile(r"\${(%s)}" % "|".join(_synonyms.keys()))
+
+_logicalRe = re.compile(r"^(?:if\s*\((.*)\)\s*{\s*|}\s*(?:(else(?:\s*if\s*\((.*)\))?)\s*{)?)$",
+                        re.IGNORECASE)
+_cmdRe = re.compile(r'^(\w+)\s*\(([^)]*)\)')
+_quotedRe = re.compile(r'^"(.*)"$')
+_quotedSpaceRe = re.compile(r',\s*"(\s)"')
+_quotedStringRe = re.compile(r"(\"[^\"]+\")")
+_argSplitRe = re.compile("[, ]")
+
 class Table(object):
     """A class that represents a eups table file"""
 
@@ -56,88 +90,96 @@ but no other interpretation is applied
         for line in contents:
             lineNo += 1
 
-            line = re.sub(r"\n", "", line)
-            line = re.sub(r"^\s*", "", line)
-            line = re.sub(r"#.*$", "", line)
+            line = line.replace("\n", "").lstrip()
+            i = line.find("#")
+            if i >= 0:
+                line = line[:i]
 
             if not line:
                 continue
             #
+            # Only lines that start "keyword =" or "keyword:" can be any of the
+            # archaic or Group/Flavor forms handled below; everything else
+            # (i.e. the actions and logical blocks) takes a fast path
+            #
+            mat = _keywordRe.match(line)
+            keyword = mat.group(1).lower() if mat else None
+            #
             # Check for certain archaic forms:
             #
-            mat = re.search(r"^File\s*=\s*(\w+)", line, re.IGNORECASE)
-            if mat:
-                self.old = True
+            if keyword == "file":
+                mat = _fileRe.match(line)
+                if mat:
+                    self.old = True
 
-                if mat.group(1).lower() != "table":
-                    msg = "Expected \"File = Table\"; saw \"%s\" at %s:%d" % (line, self.versionFile, lineNo)
-                    raise BadTableContent(self.file, msg=msg)
-                continue
-            elif self.old:
-                if re.search(r"^Product\s*=\s*(\w+)", line, re.IGNORECASE):
+                    if mat.group(1).lower() != "table":
+                        msg = "Expected \"File = Table\"; saw \"%s\" at %s:%d" % (line, self.versionFile, lineNo)
+                        raise BadTableContent(self.file, msg=msg)
+                    continue
+            if self.old and keyword == "product":
+                if _productRe.match(line):
                     continue
             # Older synonyms for eups variables in table files
-            line = re.sub(r"\${PROD_DIR}", "${PRODUCT_DIR}", line)
-            line = re.sub(r"\${UPS_PROD_DIR}", "${PRODUCT_DIR}", line)
-            line = re.sub(r"\${UPS_PROD_FLAVOR}", "${PRODUCT_FLAVOR}", line)
-            line = re.sub(r"\${UPS_PROD_NAME}", "${PRODUCT_NAME}", line)
-            line = re.sub(r"\${UPS_PROD_VERSION}", "${PRODUCT_VERSION}", line)
-            line = re.sub(r"\${UPS_DB}", "${PRODUCTS}", line)
-            line = re.sub(r"\${UPS_UPS_DIR}", "${UPS_DIR}", line)
-            #
-            # Check for lines that we think are always the same (and can thus be ignored)
-            #
-            mat = re.search(r"^Action\s*=\s*([\w+.]+)", line, re.IGNORECASE)
-            if mat:
-                if not re.search(r"setup", mat.group(1), re.IGNORECASE):
-                    msg = "Unsupported action \"%s\" at %s:%d" % (mat.group(1), self.file, lineNo)
-                    raise BadTableContent(self.file, msg=msg)
-                continue
+            if "${" in line:
+                line = _synonymRe.sub(lambda mat: _synonyms[mat.group(1)], line)
 
-            mat = re.search(r"^Qualifiers\s*=\s*\"([^\"]*)\"", line, re.IGNORECASE)
-            if mat:
-                if mat.group(1):
-                    if False:
-                        msg = "Unsupported qualifiers \"%s\" at %s:%d" % (mat.group(1), self.file, lineNo)
-                        raise BadTableContent(self.file, msg=msg)
-                    else:
-                        print("Ignoring qualifiers \"%s\" at %s:%d" % (mat.group(1), self.file, lineNo), file=utils.stdwarn)
-                continue
-            #
-            # Parse Group...Common...End, replacing by a proper If statement
-            #
-            if re.search(r"^Group:\s*$", line, re.IGNORECASE):
-                inGroup = True
-                conditional = ""
-                continue
+            if keyword is not None:
+                #
+                # Check for lines that we think are always the same (and can thus be ignored)
+                #
+                if keyword == "action":
+                    mat = _actionRe.match(line)
+                    if mat:
+                        if not re.search(r"setup", mat.group(1), re.IGNORECASE):
+                            msg = "Unsupported action \"%s\" at %s:%d" % (mat.group(1), self.file, lineNo)
+                            raise BadTableContent(self.file, msg=msg)
+                        continue
 
-            if inGroup:
-                if re.search(r"^Common:\s*$", line, re.IGNORECASE):
-                    ncontents += [(lineNo, "if (" + conditional + ") {")]
+                if keyword == "qualifiers":
+                    mat = _qualifiersRe.match(line)
+                    if mat:
+                        if mat.group(1):
+                            if False:
+                                msg = "Unsupported qualifiers \"%s\" at %s:%d" % (mat.group(1), self.file, lineNo)
+                                raise BadTableContent(self.file, msg=msg)
+                            else:
+                                print("Ignoring qualifiers \"%s\" at %s:%d" % (mat.group(1), self.file, lineNo), file=utils.stdwarn)
+                        continue
+                #
+                # Parse Group...Common...End, replacing by a proper If statement
+                #
+                if keyword == "group" and _groupRe.match(line):
+                    inGroup = True
+                    conditional = ""
                     continue
 
-                if re.search(r"^End:\s*$", line, re.IGNORECASE):
-                    inGroup = False
-                    ncontents += [(lineNo, "}")]
-                    continue
+                if inGroup:
+                    if keyword == "common" and _commonRe.match(line):
+                        ncontents += [(lineNo, "if (" + conditional + ") {")]
+                        continue
 
-                mat = re.search(r"^Flavor\s*=\s*([\w+.]+)", line, re.IGNORECASE)
-                if mat:
-                    if conditional:
-                        conditional += " || "
+                    if keyword == "end" and _endRe.match(line):
+                        inGroup = False
+                        ncontents += [(lineNo, "}")]
+                        continue
 
-                    flavor = mat.group(1)
-                    if flavor.lower() == "any":
-                        conditional += "FLAVOR =~ .*"
-                    else:
-                        conditional += "FLAVOR == %s" % flavor
-                    continue
+                    mat = _flavorRe.match(line) if keyword == "flavor" else None
+                    if mat:
+                        if conditional:
+                            conditional += " || "
+
+                        flavor = mat.group(1)
+                        if flavor.lower() == "any":
+                            conditional += "FLAVOR =~ .*"
+                        else:
+                            conditional += "FLAVOR == %s" % flavor
+                        continue
             #
             # New style blocks (a bad design by RHL) begin with one or more Flavor=XXX
             # lines, and continue to the next Flavor=YYY line
             #
+            mat = _flavorRe.match(line) if keyword == "flavor" else None
             if inNewGroup == "inFlavors": # we're reading a set of FLAVOR=XXX lines
-                mat = re.search(r"^Flavor\s*=\s*([\w+.]+)", line, re.IGNORECASE)
                 if mat:                 # and we've found another
                     conditional += " || FLAVOR == %s" % mat.group(1)
                     continue
@@ -145,7 +187,6 @@ but no other interpretation is applied
                     ncontents += [(lineNo, "if (" + conditional + ") {")]
                     inNewGroup = True
             else:                       # Not reading FLAVOR=XXX, so a FLAVOR=XXX starts a new block
-                mat = re.search(r"^Flavor\s*=\s*([\w+.]+)", line, re.IGNORECASE)
                 if mat:
                     if inNewGroup:
                         ncontents += [(lineNo, "}")]
@@ -161,6 +202,20 @@ but no other interpretation is applied
 
         return ncontents
 
+    def setTopProduct(self, product):
+        """Make product the owner of this table and of the actions read from it, e.g.
+after reading the table back from a cache"""
+
+        self.topProduct = product
+        for actions in self._actions:
+            for logicalOrBlock in actions:
+                if not isinstance(logicalOrBlock, list): # a logical expression as a string
+                    continue
+
+                for a in logicalOrBlock:
+                    if a.topProduct is not None:
+                        a.topProduct = product
+
     def expandEupsVariables(self, product, quiet=False):
         """Expand eups-related variables such as $PRODUCT_DIR"""
 
@@ -282,8 +337,10 @@ but no other interpretation is applied
             #
             # Is this the start of a logical condition?
             #
-            mat = re.search(r"^(?:if\s*\((.*)\)\s*{\s*|}\s*(?:(else(?:\s*if\s*\((.*)\))?)\s*{)?)$", \
-                                line, re.IGNORECASE)
+            if line[0] == "}" or line[:2].lower() == "if":
+                mat = _logicalRe.match(line)
+            else:
+                mat = None
             if mat:
                 if block:
                     if mat.group(2) == "else": # i.e. we saw an } else {
@@ -322,56 +379,40 @@ but no other interpretation is applied
             #
             # Is line of the form action(...)?
             #
-            mat = re.search(r'^(\w+)\s*\(([^)]*)\)', line, re.IGNORECASE)
+            mat = _cmdRe.match(line)
             if mat:
                 cmd = mat.group(1).lower()
-                args = re.sub(r'^"(.*)"$', r'\1', mat.group(2))
-                #
-                # Protect \" by replacing it with "\002"
-                #
-                args = args.replace(r'\"', r'%c' % 2)
-                #
-                # Special case cmd(..., " ") by protecting " " as "\001"
-                #
-                args = re.sub(r',\s*"(\s)"', r'\1"%c"' % 1, args)
-                #
-                # Replace " " within quoted strings with \1 too
-                #
-                args = re.sub(r"(\"[^\"]+\")", lambda s: re.sub(" ", "\1", s.group(0)), args)
-                #
-                # Replace , within quoted strings with "\003"
-                #
-                args = re.sub(r"(\"[^\"]+\")", lambda s: re.sub(",", "%c" % 3, s.group(0)), args)
+                args = mat.group(2)
+                if '"' not in args:
+                    # the common case; there's no quoting to worry about
+                    args = [s for s in _argSplitRe.split(args) if s]
+                else:
+                    args = _quotedRe.sub(r'\1', args)
+                    #
+                    # Protect \" by replacing it with "\002"
+                    #
+                    args = args.replace(r'\"', r'%c' % 2)
+                    #
+                    # Special case cmd(..., " ") by protecting " " as "\001"
+                    #
+                    args = _quotedSpaceRe.sub(r'\1"%c"' % 1, args)
+                    #
+                    # Replace " " within quoted strings with \1 too
+                    #
+                    args = _quotedStringRe.sub(lambda s: s.group(0).replace(" ", "\1"), args)
+                    #
+                    # Replace , within quoted strings with "\003"
+                    #
+                    args = _quotedStringRe.sub(lambda s: s.group(0).replace(",", "%c" % 3), args)
 
-                args = [s for s in re.split("[, ]", args) if s]
-                args = [re.sub(r'^"(.*)"$', r'\1', s) for s in args] # remove quotes
-                args = [re.sub(r'%c' % 1, r' ', s) for s in args] # reinstate \001 as a space
-                args = [re.sub(r'%c' % 2, r'"', s) for s in args] # reinstate \002 as "
-                args = [re.sub(r'%c' % 3, r',', s) for s in args] # reinstate \003 as ,
+                    args = [s for s in _argSplitRe.split(args) if s]
+                    args = [_quotedRe.sub(r'\1', s) for s in args] # remove quotes
+                    args = [s.replace('%c' % 1, ' ') for s in args] # reinstate \001 as a space
+                    args = [s.replace('%c' % 2, '"') for s in args] # reinstate \002 as "
+                    args = [s.replace('%c' % 3, ',') for s in args] # reinstate \003 as ,
 
                 try:
-                    cmd = {
-                        "addalias" : Action.addAlias,
-                        "declareoptions" : Action.declareOptions,
-                        "envappend" : Action.envAppend,
-                        "envprepend" : Action.envPrepend,
-                        "envset" : Action.envSet,
-                        "envunset" : Action.envUnset,
-                        "pathappend" : Action.envAppend,
-                        "pathprepend" : Action.envPrepend,
-                        "pathremove" : Action.envUnset,
-                        "pathset" : Action.envSet,
-                        "print" : Action.doPrint,
-                        "proddir" : Action.prodDir,
-                        "setupenv" : Action.setupEnv,
-                        "setenv" : Action.envSet,
-                        "unsetenv" : Action.envUnset,
-                        "setuprequired" : Action.setupRequired,
-                        "setupoptional" : Action.setupOptional,
-                        "sourcerequired" : Action.sourceRequired,
-                        "unsetuprequired" : Action.unsetupRequired,
-                        "unsetupoptional" : Action.unsetupOptional,
-                        }[cmd]
+                    cmd = _commands[cmd]
                 except KeyError:
                     print("Unexpected line in %s:%d: %s" % (tableFile, lineNo, line), file=utils.stderr)
                     continue
@@ -570,16 +611,11 @@ but no other interpretation is applied
             addDefaultProduct = False
 
         deps = []
-        for a in self.actions(Eups.flavor, setupType=setupType):
+        for a, requestedVRO, productName, productDir, vers, versExpr, extraArgs in \
+                Eups.resolver.requirements(self, setupType, listExternalDependencies):
             if a.cmd == Action.unsetupRequired:
                 if True:
                     optional = a.extra["optional"]
-
-                    requestedVRO, productName, productDir, vers, versExpr, extraArgs = a.processArgs(Eups)
-                    if extraArgs["noAction"]:
-                        continue
-                    if extraArgs["isExternal"] != listExternalDependencies:
-                        continue
                     #
                     # Remove all mention of the unsetup product
                     #
@@ -602,12 +638,6 @@ but no other interpretation is applied
             elif a.cmd == Action.setupRequired:
                 optional = a.extra["optional"]
 
-                requestedVRO, productName, productDir, vers, versExpr, extraArgs = a.processArgs(Eups)
-                if extraArgs["noAction"]:
-                    continue
-                if extraArgs["isExternal"] != listExternalDependencies:
-                    continue
-
                 Eups.pushStack("vro", requestedVRO)
 
                 q = None
@@ -615,12 +645,8 @@ but no other interpretation is applied
                     q = utils.Quiet(Eups)
 
                 try:
-                    if requiredVersions and productName in requiredVersions:
-                        product = Eups.findProduct(productName, requiredVersions[productName])
-                    else:
-                        product, vroReason = Eups.findProductFromVRO(productName, vers, versExpr)
-                    if not product:
-                        raise ProductNotFound(productName)
+                    product = Eups.resolver.findProduct(productName, vers, versExpr,
+                                                        requiredVersions.get(productName))
 
                     val = [product]
                     val.append(a.extra["optional"])
@@ -656,6 +682,37 @@ but no other interpretation is applied
 
         return deps
 
+    def dependencyNames(self):
+        """Return the set of names of the products that this table may setup or unsetup, whatever the
+flavor or setup type; None is returned if this can't be known without setting the products up (i.e. if a
+product is specified by its directory)
+
+N.b. the names are read from the table alone, so (unlike dependencies()) no products are looked up"""
+
+        names = set()
+        for LBB in self._actions:       # LBB: Logical Block Block[s]
+            for logicalOrBlock in LBB:
+                if not isinstance(logicalOrBlock, list): # a logical expression as a string
+                    continue
+
+                for a in logicalOrBlock:
+                    if a.cmd not in (Action.setupRequired, Action.unsetupRequired):
+                        continue
+
+                    i = 0
+                    while i < len(a.args):
+                        arg = a.args[i]
+                        if arg == "-r":
+                            return None
+                        elif arg in Action._valuedOptions:
+                            i += 1      # skip the option's value
+                        elif not arg.startswith("-"):
+                            names.add(arg)
+                            break
+                        i += 1
+
+        return names
+
     def getDeclareOptions(self, flavor, setupType):
         """Return a dictionary of any declareOptions commands in the table file
 
@@ -726,6 +783,9 @@ class Action(object):
     unsetupRequired = "unsetupRequired" # extra: "optional"
     sourceRequired = "sourceRequired"   # not supported
 
+    # options to (un)setupRequired that take a value; see processArgs()
+    _valuedOptions = ("-f", "--flavor", "-r", "-T", "-t", "--tag", "--vro")
+
     def __init__(self, tableFile, cmd, args, extra, topProduct=None):
         """
         Create the Action.
@@ -761,6 +821,10 @@ class Action(object):
                 implicitProduct=False):
         """Execute an action"""
 
+        for arg in self.args:           # make sure that the values of any variables we refer to are up to date
+            if "{" in arg:
+                Eups.flushEnv(re.findall(r"\$\??{([^-}]*)", arg))
+
         if self.cmd == Action.setupRequired:
             if noRecursion or recursionDepth == Eups.max_depth + 1:
                 return
@@ -1102,8 +1166,6 @@ class Action(object):
         else:
             delim = ":"
 
-        opath = os.environ.get(envVar, "") # old value of envVar, generally a path of some sort hence the name
-
         # should we prepend an extra :?
         pat = "^" + delim
         prepend_delim = re.search(pat, value)
@@ -1113,8 +1175,6 @@ class Action(object):
         append_delim = re.search(pat, value)
         value = re.sub(pat, "", value)
 
-        opath = [el for el in opath.split(delim) if el] # strip extra : at start or end
-
         if fwd:
             value = self.expandEnvironmentalVariable(value, Eups.verbose)
             if value is None:
@@ -1123,6 +1183,36 @@ class Action(object):
         if delim in value:
             if Eups.verbose > 1:
                 print("In %s value \"%s\" contains a delimiter '%s'" % (self.tableFile, value, delim), file=utils.stdwarn)
+        #
+        # Modify the path in place, unless it contains ${...} for setEnv() to expand
+        #
+        path = None
+        if "${" not in value:
+            path = Eups.getEnvPath(envVar, delim)
+
+        if path is not None:
+            path.remove("")             # strip extra : at start or end
+            for value in value.split(delim):
+                if fwd:
+                    if append:
+                        path.append(value)
+                    else:
+                        path.prepend(value)
+                else:
+                    path.remove(value)
+
+            path.leadingDelim = bool(prepend_delim)
+            path.trailingDelim = bool(append_delim)
+
+            if Eups.force and envVar in Eups.oldEnviron:
+                del Eups.oldEnviron[envVar]
+
+            Eups.updateEnvPath(envVar)
+            return
+
+        Eups.flushEnv([envVar])
+        opath = os.environ.get(envVar, "") # old value of envVar, generally a path of some sort hence the name
+        opath = [el for el in opath.split(delim) if el] # strip extra : at start or end
 
         npath = opath
         for value in value.split(delim):
@@ -1189,9 +1279,11 @@ class Action(object):
         """Remove repeated copies of an element in a delim-delimited path; e.g. aa:bb:aa:cc -> aa:bb:cc"""
 
         pp = []
+        seen = set()
         for d in path:
-            if d not in pp:
-                pp += [d]
+            if d not in seen:
+                seen.add(d)
+                pp.append(d)
 
         return pp
 
@@ -1228,10 +1320,31 @@ class Action(object):
 
         key = self.args[0]
 
-        try:
-            del os.environ[key]
-        except KeyError:
-            pass
+        Eups.unsetEnv(key)
+
+# the Action corresponding to each (lower-cased) command in a table file
+_commands = {
+    "addalias" : Action.addAlias,
+    "declareoptions" : Action.declareOptions,
+    "envappend" : Action.envAppend,
+    "envprepend" : Action.envPrepend,
+    "envset" : Action.envSet,
+    "envunset" : Action.envUnset,
+    "pathappend" : Action.envAppend,
+    "pathprepend" : Action.envPrepend,
+    "pathremove" : Action.envUnset,
+    "pathset" : Action.envSet,
+    "print" : Action.doPrint,
+    "proddir" : Action.prodDir,
+    "setupenv" : Action.setupEnv,
+    "setenv" : Action.envSet,
+    "unsetenv" : Action.envUnset,
+    "setuprequired" : Action.setupRequired,
+    "setupoptional" : Action.setupOptional,
+    "sourcerequired" : Action.sourceRequired,
+    "unsetuprequired" : Action.unsetupRequired,
+    "unsetupoptional" : Action.unsetupOptional,
+    }
 
 #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
 #
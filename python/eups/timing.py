@@ -0,0 +1,134 @@
+"""
+Lightweight timing of the phases of eups commands (loading caches and
+customizations, resolving versions, parsing table files, ...), written as a
+trace in Chrome's trace event format;  load it into chrome://tracing or
+https://ui.perfetto.dev to see which product or phase made a command slow.
+
+Timing is turned on by --debug=timing[filename] or by setting $EUPS_TIMING
+to the name of the file to write;  the trace is written when python exits.
+When timing is off, span() and timed() cost little more than a function
+call.
+"""
+from __future__ import absolute_import, print_function
+import atexit
+import functools
+import os
+import threading
+import time
+
+defaultTraceFile = "eups-timing.json"
+
+_events = None                          # the recorded events, or None if we're not timing
+_traceFile = None                       # where to write them
+_atexit = False                         # have we arranged to write them at exit?
+
+def enable(fileName=None):
+    """
+    Start recording the time taken by each phase
+
+    @param fileName   the file to write the trace to (default: defaultTraceFile)
+    """
+    global _events, _traceFile, _atexit
+
+    if _events is None:
+        _events = []
+    if not _atexit:
+        atexit.register(write)
+        _atexit = True
+
+    _traceFile = fileName or defaultTraceFile
+
+def disable():
+    """Stop recording timings, discarding any that haven't been written"""
+    global _events
+
+    _events = None
+
+def isEnabled():
+    """Return True if we're recording timings"""
+    return _events is not None
+
+class _Span(object):
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.time()
+        event = dict(name=self.name, cat="eups", ph="X", pid=os.getpid(),
+                     tid=threading.current_thread().ident,
+                     ts=int(1e6*self.start), dur=int(1e6*(end - self.start)))
+        if self.args:
+            event["args"] = self.args
+
+        if _events is not None:         # we may have been disabled
+            _events.append(event)
+        return False
+
+class _NoSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_noSpan = _NoSpan()
+
+def span(name, **args):
+    """
+    Return a context manager that records the time spent in its body as an
+    event called name, e.g.
+        with timing.span("table", product=productName):
+            ...
+    The keyword arguments are saved with the event
+    """
+    if _events is None:
+        return _noSpan
+
+    return _Span(name, args)
+
+def timed(name, getArgs=None):
+    """
+    A decorator that records the time spent in the decorated function as an
+    event called name.  If provided, getArgs is called with the function's
+    arguments and should return a dict to save with the event
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _events is None:
+                return func(*args, **kwargs)
+
+            with _Span(name, getArgs(*args, **kwargs) if getArgs else None):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+def write(fileName=None):
+    """
+    Write the events recorded so far as a Chrome trace (if we're recording)
+
+    @param fileName   the file to write (default: the one passed to enable())
+    """
+    import json
+    from . import utils
+
+    if not _events:
+        return
+
+    fileName = fileName or _traceFile
+    try:
+        fd = utils.AtomicFile(os.path.abspath(fileName), "w")
+        json.dump(dict(traceEvents=sorted(_events, key=lambda e: e["ts"]), displayTimeUnit="ms"), fd)
+        fd.close()
+    except (IOError, OSError) as e:
+        print("Unable to write timings to %s: %s" % (fileName, e), file=utils.stdwarn)
+
+if os.environ.get("EUPS_TIMING"):
+    enable(os.environ["EUPS_TIMING"])
@@ -292,6 +292,18 @@ def ctimeTZ(t=None):
 
     return time.strftime("%Y/%m/%d %H:%M:%S %Z", t)
 
+def fileStat(filename):
+    """
+    Return the modification time and size of filename, or None if it doesn't
+    exist (or filename is None); used to tell if a file's changed
+    """
+    try:
+        st = os.stat(filename)
+    except (OSError, TypeError):
+        return None
+
+    return (st.st_mtime, st.st_size)
+
 def isRealFilename(filename):
     """
     Return True iff "filename" is a real filename, not a placeholder.
@@ -727,6 +739,52 @@ stdinfo = coloredFile(sys.stderr, "INFO")
 stdwarn = coloredFile(sys.stderr, "WARN")
 stdok =   coloredFile(sys.stderr, "OK")
 
+class StderrRecorder(object):
+    """
+    Keep a copy of everything that's written to standard error (directly, or
+    via stderr, stdinfo, stdwarn, and stdok) within a with statement; the
+    text is written as usual too.  E.g.
+        with StderrRecorder() as recorder:
+            ...
+        messages = recorder.getvalue()
+    """
+
+    class _Tee(object):
+        """Write to a file object, and append what's written to a list"""
+
+        def __init__(self, fileObj, text):
+            self._fileObj = fileObj
+            self._text = text
+
+        def write(self, text):
+            self._text.append(text)
+            self._fileObj.write(text)
+
+        def __getattr__(self, name):
+            return getattr(self._fileObj, name)
+
+    def __init__(self):
+        self._text = []
+
+    def __enter__(self):
+        self._stderr = sys.stderr
+        sys.stderr = self._Tee(sys.stderr, self._text)
+
+        self._coloredFiles = [(f, f._fileObj) for f in (stderr, stdinfo, stdwarn, stdok)]
+        for f, fileObj in self._coloredFiles:
+            f._fileObj = self._Tee(fileObj, self._text)
+
+        return self
+
+    def __exit__(self, *args):
+        sys.stderr = self._stderr
+        for f, fileObj in self._coloredFiles:
+            f._fileObj = fileObj
+
+    def getvalue(self):
+        """Return the text that's been written"""
+        return "".join(self._text)
+
 #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
 """
    Tarjan's algorithm and topological sorting implementation in Python
@@ -963,6 +1021,69 @@ class AtomicFile(object):
         self._fp.close()
         os.rename(self._tmpfn, self._fn)
 
+class OrderedPath(object):
+    """
+    A delimiter-separated path (e.g. the value of PATH) held as an ordered
+    set of its elements, so that elements may be prepended, appended, or
+    removed in constant time.  As in table files' envPrepend/envAppend, an
+    element that is already present moves to the front when prepended but
+    keeps its place when appended.  Empty elements are dropped when the path
+    is parsed.
+
+    If leadingDelim (trailingDelim) is set, str() will start (end) with the
+    delimiter.
+    """
+    def __init__(self, value="", delim=":"):
+        self.delim = delim
+        self.leadingDelim = False
+        self.trailingDelim = False
+
+        self._pos = {}                  # the position of each element; smaller is to the left
+        self._first = 0                 # the position of the leftmost element
+        self._last = -1                 # the position of the rightmost element
+
+        for el in value.split(delim):
+            if el:
+                self.append(el)
+
+    def prepend(self, el):
+        """Move el to the front of the path"""
+        self._first -= 1
+        self._pos[el] = self._first
+
+    def append(self, el):
+        """Add el to the end of the path, unless it's already present"""
+        if el not in self._pos:
+            self._last += 1
+            self._pos[el] = self._last
+
+    def remove(self, el):
+        """Remove el from the path, if it's present"""
+        self._pos.pop(el, None)
+
+    def copy(self):
+        """Return a copy of the path"""
+        path = OrderedPath(delim=self.delim)
+        path.leadingDelim, path.trailingDelim = self.leadingDelim, self.trailingDelim
+        path._pos = self._pos.copy()
+        path._first, path._last = self._first, self._last
+
+        return path
+
+    def elements(self):
+        """Return the path's elements, in order"""
+        return sorted(self._pos, key=self._pos.get)
+
+    def __str__(self):
+        value = self.delim.join(self.elements())
+
+        if self.leadingDelim and not re.search(r"^%s" % self.delim, value):
+            value = self.delim + value
+        if self.trailingDelim and not re.search(r"%s$" % self.delim, value):
+            value += self.delim
+
+        return value
+
 def isSubpath(path, root):
     """!Return True if path is root or in root
 
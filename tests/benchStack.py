@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+"""
+Time core eups operations on a synthetic stack: constructing an Eups,
+loading the product cache (cold and warm), setting up a deep tree of
+products, "eups list", "eups uses", declaring products, and "eups distrib
+install" from a local server.
+
+The stack is generated in a temporary directory:  products p0000, p0001, ...
+each with the requested number of versions, declared for each flavor, with
+tags assigned and table files in which each product requires the next fanout
+products down to the requested depth (so p0000 is the root of the deepest
+tree).  The timings are written as JSON.
+
+Usage:  python benchStack.py [options]
+"""
+
+from __future__ import print_function
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+import testCommon
+
+import eups
+import eups.cmd
+from eups import utils
+from eups.stack import ProductStack
+from eups.distrib.server import DistribServer
+
+def productName(i):
+    return "p%04d" % i
+
+def versionName(i):
+    return "1.%d" % i
+
+def makeStack(root, nproduct=200, nversion=3, flavors=("Linux",), ntag=2, depth=6, fanout=2):
+    """
+    write a synthetic stack under root, and return the names of its products
+
+    Product i requires products fanout*i + 1, ..., fanout*(i + 1) as long as
+    it is less than depth levels below p0000.  Versions are declared
+    for each flavor.  The latest version of each product is current, and tag
+    tagN (if ntag > N) is assigned to version N % nversion.
+    """
+    dbpath = os.path.join(root, "ups_db")
+    os.makedirs(dbpath)
+
+    tags = ["current"] + ["tag%d" % t for t in range(1, ntag)]
+    fd = open(os.path.join(dbpath, "global.tags"), "w")
+    print(" ".join(tags), file=fd)
+    fd.close()
+
+    level = [0]*nproduct
+    names = [productName(i) for i in range(nproduct)]
+    for i, name in enumerate(names):
+        children = []
+        if level[i] < depth:
+            children = list(range(fanout*i + 1, min(fanout*(i + 1) + 1, nproduct)))
+        for c in children:
+            level[c] = level[i] + 1
+
+        proddb = os.path.join(dbpath, name)
+        os.mkdir(proddb)
+        for v in range(nversion):
+            fd = open(os.path.join(proddb, "%s.version" % versionName(v)), "w")
+            print("FILE = version\nPRODUCT = %s\nVERSION = %s\n" % (name, versionName(v)), file=fd)
+            for flavor in flavors:
+                prodDir = os.path.join(flavor, name, versionName(v))
+                os.makedirs(os.path.join(root, prodDir, "ups"))
+                writeTable(os.path.join(root, prodDir, "ups", "%s.table" % name), name,
+                           [names[c] for c in children])
+
+                print("Group:\n   FLAVOR = %s\n   QUALIFIERS = \"\"\n   PROD_DIR = %s\n"
+                      "   UPS_DIR = ups\n   TABLE_FILE = %s.table\nEnd:\n" % (flavor, prodDir, name), file=fd)
+            fd.close()
+
+        for t, tag in enumerate(tags):
+            v = nversion - 1 if tag == "current" else t % nversion
+            fd = open(os.path.join(proddb, "%s.chain" % tag), "w")
+            print("FILE = version\nPRODUCT = %s\nCHAIN = %s\n" % (name, tag), file=fd)
+            for flavor in flavors:
+                print("#Group:\n   FLAVOR = %s\n   VERSION = %s\n   QUALIFIERS = \"\"\n#End:\n" %
+                      (flavor, versionName(v)), file=fd)
+            fd.close()
+
+    return names
+
+def writeTable(fileName, name, requires):
+    """write a table file for product name, which requires the products in requires"""
+    fd = open(fileName, "w")
+    for r in requires:
+        print("setupRequired(%s)" % r, file=fd)
+    print("envPrepend(PATH, ${PRODUCT_DIR}/bin)", file=fd)
+    print("envPrepend(LD_LIBRARY_PATH, ${PRODUCT_DIR}/lib)", file=fd)
+    print("envPrepend(PYTHONPATH, ${PRODUCT_DIR}/python)", file=fd)
+    print("envSet(%s_HOME, ${PRODUCT_DIR})" % name.upper(), file=fd)
+    fd.close()
+
+def clearCaches(stack):
+    """remove the product and table caches (in the stack and in the user's data directory)"""
+    for cacheDir in (os.path.join(stack, "ups_db"), utils.userStackCacheFor(stack)):
+        if not os.path.isdir(cacheDir):
+            continue
+        for f in os.listdir(cacheDir):
+            if f.endswith(ProductStack.persistFileExt):
+                os.remove(os.path.join(cacheDir, f))
+            elif f == ProductStack.tableCacheDirName:
+                shutil.rmtree(os.path.join(cacheDir, f))
+
+class Quiet(object):
+    """a context manager that discards what's written to stdout"""
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+
+    def __exit__(self, *exc):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+        return False
+
+def runCmd(args):
+    """run an eups command, discarding its output; return its status"""
+    argv = sys.argv
+    sys.argv = ["eups"] + args          # the subcommands parse sys.argv
+    try:
+        with Quiet():
+            return eups.cmd.EupsCmd(args=args, toolname="eups").run()
+    finally:
+        sys.argv = argv
+
+def timeit(func, repeat, before=None):
+    """
+    return the best and mean times, over repeat trials, to call func().  If
+    provided, before() is called (untimed) before each trial
+    """
+    times = []
+    for i in range(repeat):
+        if before:
+            before()
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+
+    return dict(best=min(times), mean=sum(times)/len(times), repeat=repeat)
+
+def restoreEnviron(environ):
+    os.environ.clear()
+    os.environ.update(environ)
+
+def benchDistribInstall(stack, names, repeat):
+    """
+    time installing the deepest tree (p0000 and its dependencies) into an
+    empty stack from a local server created from stack;  return None if the
+    server can't be created
+    """
+    tmp = tempfile.mkdtemp(prefix="eupsBenchDistrib")
+    try:
+        serverDir = os.path.join(tmp, "server")
+        os.mkdir(serverDir)
+        try:
+            if runCmd(["distrib", "create", "--server-dir", serverDir, "-d", "tarball", "-f", "generic",
+                       names[0], versionName(0)]) != 0:
+                return None
+        except Exception as e:
+            print("Unable to create a distribution server: %s" % e, file=sys.stderr)
+            return None
+
+        installStacks = []              # a new stack for each trial, as servers are cached in the stack
+
+        def before():
+            DistribServer._fileCache.clear()    # as if each install were a new process
+            installStacks.append(os.path.join(tmp, "install%d" % len(installStacks)))
+            os.makedirs(os.path.join(installStacks[-1], "ups_db"))
+
+        def install():
+            os.environ["EUPS_PATH"] = installStacks[-1]
+            try:
+                if runCmd(["distrib", "install", "--nolocks", "--repository", serverDir,
+                           names[0], versionName(0)]) != 0:
+                    raise RuntimeError("Unable to install %s %s" % (names[0], versionName(0)))
+            finally:
+                os.environ["EUPS_PATH"] = stack
+
+        return timeit(install, repeat, before)
+    finally:
+        shutil.rmtree(tmp)
+
+def main(argv=sys.argv[1:]):
+    parser = OptionParser(usage=__doc__)
+    parser.add_option("-p", "--products", type="int", default=200,
+                      help="number of products")
+    parser.add_option("-v", "--versions", type="int", default=3,
+                      help="number of versions of each product")
+    parser.add_option("-f", "--flavors", default="Linux",
+                      help="comma-separated list of flavors; the first is used")
+    parser.add_option("-t", "--tags", type="int", default=2,
+                      help="number of tags (including current)")
+    parser.add_option("-d", "--depth", type="int", default=6,
+                      help="depth of the tree of dependencies")
+    parser.add_option("-F", "--fanout", type="int", default=2,
+                      help="number of products that each product in the tree requires")
+    parser.add_option("-D", "--declare", type="int", default=20,
+                      help="number of products to declare")
+    parser.add_option("-n", "--repeat", type="int", default=3,
+                      help="number of trials; the best and mean are reported")
+    parser.add_option("-o", "--output", default=None,
+                      help="file to write the results to (default: stdout)")
+    parser.add_option("--noDistrib", action="store_true", default=False,
+                      help="don't time eups distrib install")
+    (opts, args) = parser.parse_args(argv)
+
+    flavors = opts.flavors.split(",")
+    flavor = flavors[0]
+
+    environ0 = os.environ.copy()
+    tmp = tempfile.mkdtemp(prefix="eupsBench")
+    try:
+        stack = os.path.join(tmp, "stack")
+        os.environ["EUPS_PATH"] = stack
+        os.environ["EUPS_FLAVOR"] = flavor
+        os.environ["EUPS_USERDATA"] = os.path.join(tmp, "userdata")
+        if "EUPS_DIR" not in os.environ:
+            os.environ["EUPS_DIR"] = os.path.dirname(testCommon.testEupsStack)
+        for k in list(os.environ.keys()):
+            if k.startswith("SETUP_"):
+                del os.environ[k]
+        environ = os.environ.copy()
+
+        t0 = time.time()
+        names = makeStack(stack, opts.products, opts.versions, flavors, opts.tags,
+                          opts.depth, opts.fanout)
+        results = dict(parameters=dict(products=opts.products, versions=opts.versions,
+                                       flavors=flavors, tags=opts.tags, depth=opts.depth,
+                                       fanout=opts.fanout, declare=opts.declare),
+                       makeStack=time.time() - t0)
+
+        clear = lambda: clearCaches(stack)
+        results["Eups()"] = dict(cold=timeit(lambda: eups.Eups(flavor=flavor), opts.repeat, clear),
+                                 warm=timeit(lambda: eups.Eups(flavor=flavor), opts.repeat))
+
+        dbpath = os.path.join(stack, "ups_db")
+        persistDir = os.path.join(tmp, "cache")
+        def clearPersist():
+            if os.path.exists(persistDir):
+                shutil.rmtree(persistDir)
+            os.mkdir(persistDir)
+        fromCache = lambda: ProductStack.fromCache(dbpath, [flavor], persistDir, updateCache=True)
+        results["ProductStack.fromCache"] = dict(cold=timeit(fromCache, opts.repeat, clearPersist),
+                                                 warm=timeit(fromCache, opts.repeat))
+
+        def setup():
+            Eups = eups.Eups(flavor=flavor)
+            ok, version, reason = Eups.setup(names[0])
+            if not ok:
+                raise RuntimeError("Unable to setup %s: %s" % (names[0], reason))
+        results["setup"] = timeit(setup, opts.repeat, lambda: restoreEnviron(environ))
+        results["setup"]["products"] = len([k for k in os.environ if k.startswith("SETUP_")])
+        restoreEnviron(environ)
+
+        results["eups list"] = timeit(lambda: runCmd(["list"]), opts.repeat)
+        results["eups uses"] = timeit(lambda: runCmd(["uses", names[-1]]), opts.repeat)
+
+        def declare():
+            Eups = eups.Eups(flavor=flavor)
+            for i in range(opts.declare):
+                Eups.declare("new%04d" % i, versionName(0),
+                             productDir=os.path.join(stack, flavor, names[0], versionName(0)),
+                             tablefile=os.path.join(stack, flavor, names[0], versionName(0),
+                                                    "ups", "%s.table" % names[0]))
+        def undeclare():
+            for i in range(opts.declare):
+                proddb = os.path.join(dbpath, "new%04d" % i)
+                if os.path.exists(proddb):
+                    shutil.rmtree(proddb)
+            clearCaches(stack)
+        results["declare"] = timeit(declare, opts.repeat, undeclare)
+        undeclare()
+
+        if not opts.noDistrib:
+            results["eups distrib install"] = benchDistribInstall(stack, names, opts.repeat)
+    finally:
+        restoreEnviron(environ0)
+        shutil.rmtree(tmp)
+
+    if opts.output:
+        fd = open(opts.output, "w")
+    else:
+        fd = sys.stdout
+    json.dump(results, fd, indent=2, sort_keys=True)
+    print(file=fd)
+    if opts.output:
+        fd.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Time the parsing of table files: every table file found under tests/, and a
+synthetic table of (by default) 10000 lines.
+
+Usage:  python benchTable.py [-n repeat] [-l lines]
+"""
+
+from __future__ import print_function
+import os
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+import testCommon
+
+from eups.table import Table
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+
+def findTables(dir=testDir):
+    """return the paths of the table files found under dir"""
+    out = []
+    for root, dirs, files in os.walk(dir):
+        out += [os.path.join(root, f) for f in files if f.endswith(".table")]
+    return sorted(out)
+
+def writeSyntheticTable(fileName, nlines):
+    """write a table of roughly nlines lines in the style of real table files"""
+    fd = open(fileName, "w")
+    i = 0
+    while i < nlines:
+        n = i//20
+        fd.write("# dependencies of block %d\n" % n)
+        fd.write("setupRequired(prod%d)\n" % n)
+        fd.write("setupRequired(prod%d_a -j 1.%d)\n" % (n, n))
+        fd.write("setupOptional(prod%d_b [>= 2.%d])\n" % (n, n))
+        fd.write("setupOptional(\"prod%d_c\")\n" % n)
+        fd.write("envPrepend(PATH, ${PRODUCT_DIR}/bin)\n")
+        fd.write("envPrepend(PYTHONPATH, ${PRODUCT_DIR}/python)\n")
+        fd.write("envAppend(LD_LIBRARY_PATH, ${UPS_PROD_DIR}/lib)\n")
+        fd.write("pathPrepend(MANPATH, ${PRODUCT_DIR}/man)\n")
+        fd.write("envSet(PROD%d_HOME, ${PRODUCT_DIR})\n" % n)
+        fd.write("envSet(PROD%d_FLAGS, \"-O2 -g, -Wall\")\n" % n)
+        fd.write("\n")
+        fd.write("if (FLAVOR == Linux64) {\n")
+        fd.write("    envPrepend(LD_LIBRARY_PATH, ${PRODUCT_DIR}/lib64)\n")
+        fd.write("} else if (FLAVOR == DarwinX86) {\n")
+        fd.write("    envPrepend(DYLD_LIBRARY_PATH, ${PRODUCT_DIR}/lib)\n")
+        fd.write("} else {\n")
+        fd.write("    envPrepend(LD_LIBRARY_PATH, ${PRODUCT_DIR}/lib)\n")
+        fd.write("}\n")
+        fd.write("addAlias(prod%d, ${PRODUCT_DIR}/bin/prod%d --verbose)\n" % (n, n))
+        i += 20
+    fd.close()
+
+def timeParse(fileNames, repeat):
+    """return the best time, over repeat trials, to parse all of fileNames"""
+    best = None
+    for i in range(repeat):
+        t0 = time.time()
+        for f in fileNames:
+            Table(f, addDefaultProduct=False)
+        t = time.time() - t0
+        if best is None or t < best:
+            best = t
+    return best
+
+def main(argv=sys.argv[1:]):
+    parser = OptionParser(usage=__doc__)
+    parser.add_option("-n", "--repeat", type="int", default=5,
+                      help="number of trials; the best is reported")
+    parser.add_option("-l", "--lines", type="int", default=10000,
+                      help="length of the synthetic table")
+    (opts, args) = parser.parse_args(argv)
+
+    tables = findTables()
+    nlines = sum([len(open(f).readlines()) for f in tables])
+    t = timeParse(tables, opts.repeat)
+    print("%d test tables (%d lines): %.2f ms" % (len(tables), nlines, 1e3*t))
+
+    fd, synthetic = tempfile.mkstemp(suffix=".table")
+    os.close(fd)
+    try:
+        writeSyntheticTable(synthetic, opts.lines)
+        t = timeParse([synthetic], opts.repeat)
+        print("synthetic table (%d lines): %.2f ms (%.0f lines/s)" %
+              (opts.lines, 1e3*t, opts.lines/t))
+    finally:
+        os.remove(synthetic)
+
+if __name__ == "__main__":
+    main()
@@ -52,6 +52,26 @@ class AppTestCase(unittest.TestCase):
         version = eups.getSetupVersion("python")
         self.assertEqual(version, "2.5.2")
 
+    def testSetupMany(self):
+        for p in ("python", "cfitsio", "doxygen"):
+            if eups.Eups().isSetup(p):
+                eups.unsetup(p)
+
+        cmds = eups.setupMany([("python", "2.5.2"), "cfitsio", "doxygen 1.5.7.1"])
+        self.assertNotIn("false", cmds)
+        self.assertEqual(eups.getSetupVersion("python"), "2.5.2")
+        self.assertEqual(eups.getSetupVersion("doxygen"), "1.5.7.1")
+        self.assertTrue(eups.Eups().isSetup("cfitsio"))
+        self.assertEqual(len([c for c in cmds if "SETUP_PYTHON=" in c]), 1)
+
+        q = eups.Quiet(eups.Eups())
+        cmds = eups.setupMany(["goober", "tcltk"])
+        del q
+        self.assertEqual(cmds[-1], "false")
+        self.assertTrue(eups.Eups().isSetup("tcltk"))
+
+        self.assertRaises(eups.EupsException, eups.setupMany, ["python 2.5.2 extra"])
+
 class TagSetupTestCase(unittest.TestCase):
     """
     Tests use cases for selecting tagged versions via app.setup()
@@ -17,6 +17,7 @@ import eups.cmd
 import eups.hooks as hooks
 from eups import Tag, TagNotRecognized
 from eups.exceptions import ProductNotFound
+from eups.SetupPlan import SetupPlanCache
 
 prog = "eups"
 
@@ -48,6 +49,7 @@ class CmdTestCase(unittest.TestCase):
         del self.out
 
         os.environ = self.environ0
+        testCommon.removeJournal()
 
         newprod = os.path.join(self.dbpath,"newprod")
         if os.path.exists(newprod):
@@ -402,6 +404,100 @@ class SetupCmdTestCase(unittest.TestCase):
         cmd = eups.setupcmd.EupsSetup(args=cmdargs, toolname=prog)
         self.assertEqual(cmd.run(), 0)
 
+    def testSetupPlanCache(self):
+        os.environ["EUPS_FLAVOR"] = "Linux"
+        hooks.config.Eups.defaultTags = dict(pre=[], post=[])
+
+        planCache = SetupPlanCache(eups.Eups.setEupsPath())
+        planCache.clear()
+
+        Eups = eups.Eups
+        resolved = []
+        class countingEups(Eups):
+            def __init__(self, *args, **kwargs):
+                resolved.append(args)
+                eups.utils.stdwarn.write("Warning: resolving a setup plan\n")
+                Eups.__init__(self, *args, **kwargs)
+
+        def setup(cmdargs=["python", "2.5.2"]):
+            # setup in a fresh copy of the starting environment, as if from a new shell
+            os.environ.clear()
+            os.environ.update(environ)
+            return eups.setupcmd.EupsSetup(args=cmdargs, toolname=prog).run()
+
+        environ = os.environ.copy()
+        eups.Eups = countingEups
+        try:
+            self.assertEqual(setup(), 0)
+            cmds = self.out.getvalue()
+            self._resetOut()
+            self.assertEqual(len(resolved), 1)
+            self.assertEqual(len(os.listdir(planCache.plandir)), 1)
+            #
+            # An identical setup reuses the saved commands
+            #
+            stderr = sys.stderr
+            sys.stderr = StringIO.StringIO()
+            try:
+                self.assertEqual(setup(), 0)
+                messages = sys.stderr.getvalue()
+            finally:
+                sys.stderr = stderr
+            self.assertEqual(self.out.getvalue(), cmds)
+            self._resetOut()
+            self.assertEqual(len(resolved), 1)
+            self.assertIn("Warning: resolving a setup plan", messages) # the messages are repeated too
+            #
+            # even from a shell with a different session
+            #
+            environ["SSH_TTY"] = "/dev/pts/99"
+            self.assertEqual(setup(), 0)
+            self._resetOut()
+            self.assertEqual(len(resolved), 1)
+            #
+            # but not if a variable that the table files use has changed
+            #
+            environ["LD_LIBRARY_PATH"] = "/no/such/lib"
+            self.assertEqual(setup(), 0)
+            self.assertIn("/no/such/lib", self.out.getvalue())
+            self._resetOut()
+            self.assertEqual(len(resolved), 2)
+            del environ["LD_LIBRARY_PATH"]
+            #
+            # or once a table file that it read has changed
+            #
+            tablefile = os.path.join(testEupsStack, "Linux", "python", "2.5.2", "ups", "python.table")
+            st = os.stat(tablefile)
+            os.utime(tablefile, (st.st_atime, st.st_mtime + 10))
+            try:
+                self.assertEqual(setup(), 0)
+            finally:
+                os.utime(tablefile, (st.st_atime, st.st_mtime))
+            self.assertEqual(self.out.getvalue(), cmds)
+            self._resetOut()
+            self.assertEqual(len(resolved), 3)
+            #
+            # or once eups itself has changed
+            #
+            srcfile = os.path.join(os.path.dirname(eups.__file__), "VersionCompare.py")
+            st = os.stat(srcfile)
+            os.utime(srcfile, (st.st_atime, st.st_mtime + 10))
+            try:
+                self.assertEqual(setup(), 0)
+            finally:
+                os.utime(srcfile, (st.st_atime, st.st_mtime))
+            self._resetOut()
+            self.assertEqual(len(resolved), 4)
+            #
+            # and it can be turned off
+            #
+            hooks.config.Eups.setupPlanCache = False
+            self.assertEqual(setup(), 0)
+            self.assertEqual(len(resolved), 5)
+        finally:
+            eups.Eups = Eups
+            hooks.config.Eups.setupPlanCache = True
+            planCache.clear()
 
 class Stdout(object):
 
@@ -35,6 +35,14 @@ def setupEnvironment():
     # a previous run
     clenseEnvironment()
 
+def removeJournal(dbpath=os.path.join(testEupsStack, "ups_db")):
+    # remove the generation and journal written to a test database when products
+    # are declared or tagged, so that the tests leave the source tree as they found it
+    for f in ("_generation_", "_journal_"):
+        f = os.path.join(dbpath, f)
+        if os.path.exists(f):
+            os.remove(f)
+
 def clenseEnvironment():
     # clear out any products setup in the environment as these can interfere
     # with the tests
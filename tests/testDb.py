@@ -492,6 +492,8 @@ class DatabaseTestCase(unittest.TestCase):
 
             os.system("rm -rf " + self.userdb)
 
+        testCommon.removeJournal()
+
     def testFindProductNames(self):
         prods = self.db.findProductNames()
         self.assertEqual(len(prods), 6)
@@ -716,6 +718,45 @@ class DatabaseTestCase(unittest.TestCase):
 
         os.rename(self.pycur+".bak", self.pycur)
 
+    def testGeneration(self):
+        generation = self.db.getGeneration()
+        self.db.assignTag("beta", "python", "2.5.2")
+        try:
+            self.assertNotEqual(self.db.getGeneration(), generation)
+            generation = self.db.getGeneration()
+            self.assertEqual(self.db.getGeneration(), generation)
+        finally:
+            self.assert_(self.db.unassignTag("beta", "python"))
+        self.assertNotEqual(self.db.getGeneration(), generation)
+
+        generation = self.db.getGeneration()
+        self.assert_(not self.db.unassignTag("beta", "python"))
+        self.assertEqual(self.db.getGeneration(), generation)
+
+        # user tags are recorded in the user tag database
+        self.db.assignTag("user:my", "python", "2.5.2")
+        self.assertEqual(self.db.getGeneration(), generation)
+        self.assert_(self.db.getGeneration(self.userdb) is not None)
+
+    def testJournal(self):
+        generation = self.db.getGeneration()
+        self.db.assignTag("beta", "python", "2.5.2")
+        try:
+            self.assertEqual(self.db.getChangedProducts(self.db.getGeneration()),
+                             ["python"])
+            self.db.assignTag("beta", "doxygen", "1.5.9")
+            if generation is not None:
+                self.assertEqual(self.db.getChangedProducts(generation),
+                                 ["doxygen", "python"])
+        finally:
+            self.db.unassignTag("beta", ["python", "doxygen"])
+        self.assertEqual(self.db.getChangedProducts(self.db.getGeneration()),
+                         ["doxygen", "python"])
+        self.assertEqual(self.db.getChangedProducts("0 gurn"), None)
+        if generation is None:
+            # every change since the database had no generation is journaled
+            self.assertEqual(self.db.getChangedProducts(None), ["doxygen", "python"])
+
     def testDeclare(self):
         pdir = self.db._productDir("base")
         if os.path.isdir(pdir):
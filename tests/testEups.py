@@ -11,6 +11,7 @@ import testCommon
 import os
 import sys
 import shutil
+import subprocess
 import unittest
 import tempfile
 import time
@@ -21,6 +22,8 @@ from eups import TagNotRecognized, ProductNotFound, EupsException
 from eups.Eups import Eups
 from eups.stack import ProductStack
 from eups.utils import Quiet
+from eups.VersionParser import VersionExpression
+from eups.Prefetch import TablePrefetcher
 import eups.hooks
 
 class EupsTestCase(unittest.TestCase):
@@ -43,6 +46,7 @@ class EupsTestCase(unittest.TestCase):
             file = os.path.join(self.dbpath, ProductStack.persistFilename(flav))
             if os.path.exists(file):
                 os.remove(file)
+        testCommon.removeJournal()
 
         usercachedir = os.path.join(testEupsStack,"_userdata_","_caches_")
         if os.path.exists(usercachedir):
@@ -514,6 +518,124 @@ class EupsTestCase(unittest.TestCase):
         self.assertNotIn("TCLTK_DIR", os.environ)
         self.assertNotIn("SETUP_TCLTK", os.environ)
 
+    def testVersionMatch(self):
+        self.assertEqual(self.eups.version_match("2.5.2", ">= 2.5 && < 2.6"), "2.5.2")
+        self.assertFalse(self.eups.version_match("2.6", ">= 2.5 && < 2.6"))
+        self.assertEqual(self.eups.version_match("2.6", "< 2.5 || 2.6"), "2.6")
+        self.assertFalse(self.eups.version_match("2.4", ">= 2.5 and < 2.6"))
+
+        expr = VersionExpression.compile(">= 2.5 && < 2.6")
+        self.assertTrue(VersionExpression.compile(">= 2.5 && < 2.6") is expr)
+        self.assertEqual(expr.filter(["2.4", "2.5", "2.5.2", "2.6"], self.eups.version_match_prim),
+                         ["2.5", "2.5.2"])
+
+        prods = self.eups.findProducts("python", ">= 2.5.2 && < 2.6")
+        self.assertEqual([p.version for p in prods], ["2.5.2"])
+
+    def testEnvSnapshot(self):
+        self.environ0 = os.environ.copy()
+
+        self.eups.setup("python")
+        self.assertEqual(sorted([p.name for p in self.eups.getSetupProducts()]),
+                         ["python", "tcltk"])
+
+        # the setup products have been found, so needn't be looked up again
+        def findProduct(*args, **kwargs):
+            raise AssertionError("setup product was looked up again")
+        self.eups.findProduct = findProduct
+        try:
+            prod = self.eups.findSetupProduct("python")
+            self.assertEqual(prod.version, "2.5.2")
+            self.assertEqual(len(self.eups.getSetupProducts()), 2)
+            self.assertTrue(self.eups.isSetup("tcltk"))
+        finally:
+            del self.eups.findProduct
+
+        # changes to the environment are noticed
+        self.eups.unsetEnv("SETUP_TCLTK")
+        self.assertEqual([p.name for p in self.eups.getSetupProducts()], ["python"])
+        os.environ["PYTHON_DIR"] = "/dev/null"
+        self.assertTrue(self.eups.findSetupProduct("python") is not prod)
+        del os.environ["SETUP_PYTHON"]
+        self.assertTrue(self.eups.findSetupProduct("python") is None)
+
+    def testPrefetch(self):
+        self.environ0 = os.environ.copy()
+
+        def setupEnviron():
+            os.environ = self.environ0.copy()
+            Eups(readCache=False).setup("python")
+            return os.environ
+
+        sequential = setupEnviron()
+
+        eups.hooks.config.Eups.setupPrefetchThreads = 2
+        try:
+            prefetched = setupEnviron()
+        finally:
+            eups.hooks.config.Eups.setupPrefetchThreads = 0
+
+        prefetcher = TablePrefetcher.get(2)
+        prefetcher.join()
+        self.assertTrue(prefetcher.filesRead > 0)   # tcltk's table file
+        self.assertEqual(prefetched, sequential)
+
+    def testExportEnv(self):
+        self.environ0 = os.environ.copy()
+        os.environ = os.environ.copy()  # as after popStack("env"); changes aren't passed on by os.putenv
+
+        writes, exports = Eups.envWrites, Eups.envExports
+        self.eups.setup("python")
+        try:
+            self.assertTrue(Eups.envWrites > writes)
+            # each variable is exported once, whatever the number of changes to it
+            self.assertTrue(0 < Eups.envExports - exports <= Eups.envWrites - writes)
+
+            out = subprocess.Popen(["sh", "-c", "echo $SETUP_TCLTK"], stdout=subprocess.PIPE).communicate()[0]
+            self.assertEqual(out.decode().strip(), os.environ["SETUP_TCLTK"])
+        finally:                        # don't pass the setup on to other tests' children
+            for key, val in os.environ.items():
+                if key not in self.environ0:
+                    os.unsetenv(key)
+                elif val != self.environ0[key]:
+                    os.putenv(key, self.environ0[key])
+
+    def testDependencies(self):
+        python = self.eups.findProduct("python", "2.5.2")
+        deps = self.eups.getDependentProducts(python)
+        self.assertIn("tcltk", [p[0].name for p in deps])
+
+        # the dependencies have been resolved, so needn't be looked up again
+        def findProductFromVRO(*args, **kwargs):
+            raise AssertionError("dependency was looked up again")
+        self.eups.findProductFromVRO = findProductFromVRO
+        try:
+            again = self.eups.getDependentProducts(python)
+            self.eups.uses("tcltk")
+        finally:
+            del self.eups.findProductFromVRO
+        self.assertEqual([(p[0].name, p[0].version) for p in again],
+                         [(p[0].name, p[0].version) for p in deps])
+
+        # but a change to the database forgets them
+        self.eups.assignTag("beta", "python", "2.5.2")
+        self.assertEqual(self.eups.resolver._products, {})
+
+    def testUses(self):
+        users = self.eups.uses("tcltk")
+        self.assertEqual([(u[0], u[1], u[2].version) for u in users],
+                         [("python", "2.5.2", "8.5a4")])
+        self.assertEqual(self.eups.uses("tcltk", "1.0"), [])
+
+        # only possible users of a product are examined
+        stack = self.eups.versions[testEupsStack]
+        self.assertEqual(stack.dependencyNames(self.eups.findProduct("python", "2.5.2")),
+                         set(["tcltk", "implicitProducts"]))
+        self.assertEqual([p.name for p in self.eups._possibleUsers(["tcltk"], self.eups.findProducts())],
+                         ["python", "python"])
+        self.assertEqual(sorted(self.eups._possibleDependencies("python")),
+                         ["implicitProducts", "python", "tcltk"])
+
     def testRemove(self):
         os.environ = self.environ0
 
@@ -553,6 +675,7 @@ class EupsCacheTestCase(unittest.TestCase):
         usercachedir = os.path.join(testEupsStack,"_userdata_","_caches_")
         if os.path.exists(usercachedir):
             os.system("rm -rf " + usercachedir)
+        testCommon.removeJournal()
 
         newprod = os.path.join(self.dbpath,"newprod")
         if os.path.exists(newprod):
@@ -7,12 +7,17 @@ import os
 import sys
 import shutil
 import re
+import subprocess
 import unittest
 import time
+import json
 import testCommon
 from testCommon import testEupsStack
 
 import eups
+from eups.VersionCompare import VersionCompare, sortArgs
+from eups import timing
+from eups import hooks
 
 class MiscTestCase(unittest.TestCase):
 
@@ -25,13 +30,217 @@ class MiscTestCase(unittest.TestCase):
     def testNothing(self):
         pass
 
+class ImportTestCase(unittest.TestCase):
+    """Check that setup doesn't import more than it needs"""
+
+    budget = float(os.environ.get("EUPS_SETUP_IMPORT_BUDGET", 1.0)) # seconds to import eups.setupcmd
+
+    def importTimes(self, module):
+        """Return {module : cumulative import time (s)} from python -X importtime"""
+        env = os.environ.copy()
+        env["PYTHONPATH"] = os.path.join(testCommon.EUPS_DIR, "python")
+        p = subprocess.Popen([sys.executable, "-X", "importtime", "-c", "import %s" % module],
+                             stderr=subprocess.PIPE, env=env, universal_newlines=True)
+        err = p.communicate()[1]
+        self.assertEqual(p.returncode, 0, err)
+
+        times = {}
+        for line in err.splitlines():
+            mat = re.search(r"^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|\s*(\S+)", line)
+            if mat:
+                times[mat.group(3)] = 1e-6*int(mat.group(2))
+        return times
+
+    def testSetupImports(self):
+        if sys.version_info < (3, 7):
+            self.skipTest("python -X importtime requires python 3.7")
+
+        times = self.importTimes("eups.setupcmd")
+        self.assertIn("eups.setupcmd", times)
+
+        for module in times:
+            self.assertFalse(module == "eups.cmd" or module.startswith("eups.distrib") or
+                             module.startswith("urllib") or module.startswith("http"),
+                             "setup imported %s" % module)
+
+        self.assertTrue(times["eups.setupcmd"] < self.budget,
+                        "importing eups.setupcmd took %.3fs (budget %.3fs)" %
+                        (times["eups.setupcmd"], self.budget))
+
+class VersionCompareTestCase(unittest.TestCase):
+
+    versions = ["1.2.3+svn666", "1.2-rc1", "1-a", "v1_0_3m1", "1.2", "1.2.3+svn1000",
+                "1.10", "1.2.3", "1.2-rc1+h1", "1", "1.2-rc2", "1+a", "1.9", "1.2.3-svn666"]
+
+    def testSortKey(self):
+        vc = VersionCompare()
+        byCmp = sorted(self.versions, **eups.utils.cmp_or_key(vc))
+        self.assertEqual(sorted(self.versions, key=vc.sortKey), byCmp)
+        self.assertEqual(sorted(self.versions, **sortArgs(vc)), byCmp)
+        self.assertEqual(byCmp[:3], ["1-a", "1", "1+a"])
+        self.assertEqual(byCmp[-3:], ["1.9", "1.10", "v1_0_3m1"])
+
+        for v1 in self.versions:
+            for v2 in self.versions:
+                c = vc(v1, v2)
+                if c:
+                    self.assertEqual(c < 0, vc.sortKey(v1) < vc.sortKey(v2), "%s %s" % (v1, v2))
+
+        # keys are remembered, but only so many of them
+        vc = VersionCompare()
+        vc.sortKeyCacheSize = 3
+        for v in self.versions:
+            vc.sortKey(v)
+        self.assertEqual(len(vc._sortKeys), 3)
+
+    def testCustomCompare(self):
+        class Reversed(VersionCompare):
+            def compare(self, v1, v2, mustReturnInt=True):
+                return -VersionCompare.compare(self, v1, v2, mustReturnInt)
+
+        vc = Reversed()
+        self.assertFalse(vc.hasSortKey())
+        self.assertEqual(sorted(self.versions, **sortArgs(vc)),
+                         list(reversed(sorted(self.versions, key=VersionCompare().sortKey))))
+
+        pairs = [(v, i) for i, v in enumerate(self.versions)]
+        self.assertEqual([p[0] for p in sorted(pairs, **sortArgs(vc, lambda p: p[0]))],
+                         sorted(self.versions, **sortArgs(vc)))
+
 #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
 
+class TimingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.environ0 = os.environ.copy()
+        os.environ["EUPS_PATH"] = testEupsStack
+        os.environ["EUPS_FLAVOR"] = "Linux"
+        self.traceFile = os.path.join(testEupsStack, "timing.json")
+
+    def tearDown(self):
+        timing.disable()
+        os.environ = self.environ0
+        if os.path.exists(self.traceFile):
+            os.remove(self.traceFile)
+
+    def testTrace(self):
+        self.assertFalse(timing.isEnabled())
+
+        timing.enable(self.traceFile)
+        eups.setup("python", "2.5.2")
+        timing.write()
+
+        fd = open(self.traceFile)
+        events = json.load(fd)["traceEvents"]
+        fd.close()
+
+        self.assertEqual(set(e["ph"] for e in events), set(["X"]))
+        setups = [e for e in events if e["name"] == "setup"]
+        self.assertEqual([e["args"]["product"] for e in setups][0:2], ["python", "tcltk"])
+        # tcltk is setup while processing python's table
+        self.assertTrue(setups[0]["ts"] <= setups[1]["ts"] and
+                        setups[1]["ts"] + setups[1]["dur"] <= setups[0]["ts"] + setups[0]["dur"])
+        for name in ("resolveVRO", "actions", "setupCommands"):
+            self.assertIn(name, [e["name"] for e in events])
+
+class StartupCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.environ0 = os.environ.copy()
+        self.userDataDir = os.path.join(testEupsStack, "_startupdata_")
+        os.makedirs(self.userDataDir)
+        os.environ["EUPS_USERDATA"] = self.userDataDir
+        self.startupFile = os.path.join(self.userDataDir, "startup.py")
+
+        self.config0 = dict([(k, v) for k, v in hooks._configSnapshot().items() if v is not None])
+        self.execute_file = hooks.execute_file
+        self.executed = []
+        def execute_file(startupFile, code=None):
+            self.executed.append(startupFile)
+            self.execute_file(startupFile, code)
+        hooks.execute_file = execute_file
+
+    def tearDown(self):
+        hooks.execute_file = self.execute_file
+        hooks._restoreConfig(self.config0)
+        os.environ = self.environ0
+        shutil.rmtree(self.userDataDir)
+
+    def writeStartup(self, text):
+        fd = open(self.startupFile, "w")
+        fd.write(text)
+        fd.close()
+        mtime = time.time() + len(self.executed) # make sure that the mtime changes
+        os.utime(self.startupFile, (mtime, mtime))
+
+    def load(self, userTags=[]):
+        hooks._restoreConfig(self.config0)
+        hooks.config.Eups.userTags = list(userTags)
+        return hooks.executeStartupFiles([(self.startupFile, False)])
+
+    def testOnlySetsConfig(self):
+        self.assertTrue(hooks._onlySetsConfig("""
+"A docstring"
+import eups.hooks as hooks
+from eups import hooks
+hooks.config.Eups.userTags += ["rhl"]
+hooks.config.Eups.VRO["default"] = "type:exact commandLine version current"
+eups.hooks.config.Eups.setupTypes.append("sdss")
+"""))
+        for source in ("import os",
+                       "hooks.config.Eups.userTags += os.environ['TAGS'].split()",
+                       "hooks.setFallbackFlavors('Linux64', 'Linux')",
+                       "if True:\n    hooks.config.Eups.verbose = 1",
+                       "foo.config.Eups.verbose = 1",
+                       "hooks.config.Eups.VRO[key] = 'current'",
+                       "hooks.config.Eups.userTags.pop()",
+                       "syntax error",
+                       ):
+            self.assertFalse(hooks._onlySetsConfig(source), source)
+
+    def testCache(self):
+        self.writeStartup('import eups.hooks as hooks\nhooks.config.Eups.userTags += ["rhl"]\n')
+        self.assertEqual(self.load(), [self.startupFile])
+        self.assertEqual(self.executed, [self.startupFile])
+        self.assertIn("rhl", hooks.config.Eups.userTags)
+        self.assertTrue(os.path.exists(os.path.join(self.userDataDir, "_caches_",
+                                                    hooks.startupCacheFileName)))
+
+        self.assertEqual(self.load(), [self.startupFile])
+        self.assertEqual(len(self.executed), 1)
+        self.assertEqual(hooks.config.Eups.userTags, ["rhl"])
+
+        # the result depends on the initial values of the properties
+        self.load(["beta"])
+        self.assertEqual(len(self.executed), 2)
+        self.assertEqual(hooks.config.Eups.userTags, ["beta", "rhl"])
+
+        # changing the file invalidates the cache
+        self.writeStartup('import eups.hooks as hooks\nhooks.config.Eups.userTags += ["t1570"]\n')
+        self.load()
+        self.assertEqual(len(self.executed), 3)
+        self.assertIn("t1570", hooks.config.Eups.userTags)
+        self.assertNotIn("rhl", hooks.config.Eups.userTags)
+
+    def testNoCache(self):
+        for text in ('import os\nimport eups.hooks as hooks\nhooks.config.Eups.userTags += ["rhl"]\n',
+                     '# eups: nocache\nimport eups.hooks as hooks\nhooks.config.Eups.userTags += ["rhl"]\n',):
+            self.executed = []
+            self.writeStartup(text)
+            self.load()
+            self.load()
+            self.assertEqual(self.executed, [self.startupFile, self.startupFile])
+            self.assertEqual(hooks.config.Eups.userTags, ["rhl"])
+
 def suite(makeSuite=True):
     """Return a test suite"""
 
     return testCommon.makeSuite([
         MiscTestCase,
+        ImportTestCase,
+        VersionCompareTestCase,
+        TimingTestCase,
+        StartupCacheTestCase,
         ], makeSuite)
 
 def run(shouldExit=False):
@@ -3,12 +3,18 @@
 Tests for eups.server, focussing on local (cp) tranport mechanisms
 """
 
+from __future__ import print_function
 import os
+import shutil
 import unittest
 from testCommon import testEupsStack
+from eups.utils import StringIO
+import eups.cmd
+import eups.hooks as hooks
 
 from eups.distrib.server import Transporter, LocalTransporter
-from eups.distrib.server import ConfigurableDistribServer
+from eups.distrib.server import ConfigurableDistribServer, DistribServer, DownloadPrefetcher
+from eups.distrib.server import Manifest, RemoteFileInvalid, fileChecksum
 
 class LocalTransporterTestCase(unittest.TestCase):
 
@@ -315,8 +321,300 @@ class LocalRepositoriesTestCase(unittest.TestCase):
         self.assertEqual(pkg[3], self.pkgroot)
 
 
+class ParallelInstallTestCase(unittest.TestCase):
+    """test installing several products at once from a local tarball server"""
 
-__all__ = "LocalTransporterTestCase LocalConfigFileTestCase LocalServerConfTestCase LocalDistribServerTestCase LocalRepositoryTestCase LocalRepositoriesTestCase".split()
+    def setUp(self):
+        self.environ0 = os.environ.copy()
+        self.tmp = os.path.join(testEupsStack, "_parallel_")
+        if os.path.exists(self.tmp):
+            shutil.rmtree(self.tmp)
+        os.environ["EUPS_DIR"] = os.path.dirname(testEupsStack)
+        os.environ["EUPS_FLAVOR"] = "Linux"
+        os.environ["EUPS_USERDATA"] = os.path.join(self.tmp, "_userdata_")
+        #
+        # a stack of products a, b, and c (which requires a and b), and a server to install them from
+        #
+        self.stack = os.path.join(self.tmp, "stack")
+        os.makedirs(os.path.join(self.stack, "ups_db"))
+        os.environ["EUPS_PATH"] = self.stack
+        eupsenv = Eups()
+        for p, requires in [("a", []), ("b", []), ("c", ["a", "b"])]:
+            pdir = os.path.join(self.stack, "Linux", p, "1.0")
+            os.makedirs(os.path.join(pdir, "ups"))
+            fd = open(os.path.join(pdir, "ups", "%s.table" % p), "w")
+            for r in requires:
+                print("setupRequired(%s)" % r, file=fd)
+            fd.close()
+            eupsenv.declare(p, "1.0", pdir, tablefile=os.path.join(pdir, "ups", "%s.table" % p))
+
+        self.serverDir = os.path.join(self.tmp, "server")
+        os.mkdir(self.serverDir)
+        cmd = eups.cmd.EupsCmd(args=("distrib create -q --server-dir %s -d tarball -f generic c 1.0" %
+                                     self.serverDir).split(), toolname="eups")
+        self.assertEqual(cmd.run(), 0)
+
+        self.installStack = os.path.join(self.tmp, "install")
+        os.makedirs(os.path.join(self.installStack, "ups_db"))
+        os.environ["EUPS_PATH"] = self.installStack
+        DistribServer._fileCache.clear() # we've just (re)created the server's files
+
+    def tearDown(self):
+        os.environ = self.environ0
+        if os.path.exists(self.tmp):
+            shutil.rmtree(self.tmp)
+
+    def testInstall(self):
+        log = StringIO.StringIO()
+        eupsenv = Eups()
+        opts = dict(config={}, noeups=False, noaction=False, nobuild=False, noclean=False,
+                    installCurrent=False, flavor="Linux")
+        repos = Repositories(self.serverDir, opts, eupsenv, "Linux", log=log)
+        repos.install("c", "1.0", options=opts, jobs=2)
+
+        for p in ("a", "b", "c"):
+            self.assertTrue(eupsenv.findProduct(p, "1.0", self.installStack), p)
+
+        lines = [l.split() for l in log.getvalue().splitlines() if l.startswith("  [")]
+        self.assertEqual([l[3:] for l in lines],
+                         [["a", "1.0", "done."], ["b", "1.0", "done."], ["c", "1.0", "done."]])
+
+    def testForcedReinstall(self):
+        """Check that --force reinstalls products into the stacks they're already in"""
+        opts = dict(config={}, noeups=False, noaction=False, nobuild=False, noclean=False,
+                    installCurrent=False, flavor="Linux")
+        otherStack = os.path.join(self.tmp, "other")
+        os.makedirs(os.path.join(otherStack, "ups_db"))
+        os.environ["EUPS_PATH"] = otherStack
+        eupsenv = Eups()
+        Repositories(self.serverDir, opts, eupsenv, "Linux", log=StringIO.StringIO()).install(
+            "a", "1.0", options=opts)
+
+        os.environ["EUPS_PATH"] = "%s:%s" % (self.installStack, otherStack)
+        eupsenv = Eups(force=True)
+        repos = Repositories(self.serverDir, opts, eupsenv, "Linux", log=StringIO.StringIO())
+        repos.install("c", "1.0", options=opts, jobs=2)
+
+        self.assertEqual(eupsenv.findProduct("a", "1.0").stackRoot(), otherStack)
+        self.assertFalse(os.path.exists(os.path.join(self.installStack, "Linux", "a")))
+        self.assertTrue(eupsenv.findProduct("c", "1.0", self.installStack))
+
+    def testPrefetch(self):
+        retrieved = []                  # the files successfully copied from the server
+        cacheToFile = LocalTransporter.cacheToFile
+        def countingCacheToFile(trx, filename, noaction=False):
+            cacheToFile(trx, filename, noaction)
+            retrieved.append(trx.loc)
+
+        DistribServer._fileCache.clear()
+        LocalTransporter.cacheToFile = countingCacheToFile
+        nthread = hooks.config.Eups.distribPrefetchThreads
+        hooks.config.Eups.distribPrefetchThreads = 2
+        try:
+            eupsenv = Eups()
+            opts = dict(config={}, noeups=False, noaction=False, nobuild=False, noclean=False,
+                        installCurrent=False, flavor="Linux")
+            repos = Repositories(self.serverDir, opts, eupsenv, "Linux", log=StringIO.StringIO())
+            repos.install("c", "1.0", options=opts)
+        finally:
+            LocalTransporter.cacheToFile = cacheToFile
+            hooks.config.Eups.distribPrefetchThreads = nthread
+
+        for p in ("a", "b", "c"):
+            self.assertTrue(eupsenv.findProduct(p, "1.0", self.installStack), p)
+
+        prefetcher = DownloadPrefetcher.get(2)
+        prefetcher.join()
+        self.assertTrue(prefetcher.filesFetched > 0)
+        self.assertEqual(sorted(retrieved), sorted(set(retrieved))) # nothing was retrieved twice
+
+    def testPrefetchAhead(self):
+        """Check that only 2*distribPrefetchThreads products are prefetched ahead of the one being installed"""
+        events = []
+        prefetchFileForProduct = DistribServer.prefetchFileForProduct
+        def recordingPrefetch(ds, path, product, version, flavor, ftype=None, checksum=None):
+            if ftype != "manifest":
+                events.append(("prefetch", product))
+            prefetchFileForProduct(ds, path, product, version, flavor, ftype, checksum)
+
+        prepareInstall = Repositories._prepareInstall
+        def recordingPrepareInstall(repos, pkgroot, prod, *args):
+            events.append(("install", prod.product))
+            return prepareInstall(repos, pkgroot, prod, *args)
+
+        DistribServer.prefetchFileForProduct = recordingPrefetch
+        Repositories._prepareInstall = recordingPrepareInstall
+        nthread = hooks.config.Eups.distribPrefetchThreads
+        hooks.config.Eups.distribPrefetchThreads = 1
+        try:
+            eupsenv = Eups()
+            opts = dict(config={}, noeups=False, noaction=False, nobuild=False, noclean=False,
+                        installCurrent=False, flavor="Linux")
+            repos = Repositories(self.serverDir, opts, eupsenv, "Linux", log=StringIO.StringIO())
+            repos.install("c", "1.0", options=opts)
+        finally:
+            DistribServer.prefetchFileForProduct = prefetchFileForProduct
+            Repositories._prepareInstall = prepareInstall
+            hooks.config.Eups.distribPrefetchThreads = nthread
+
+        self.assertEqual(events, [("prefetch", "a"), ("prefetch", "b"), ("install", "a"),
+                                  ("prefetch", "c"), ("install", "b"), ("install", "c")])
+
+    def testChecksums(self):
+        manifestDir = os.path.join(self.serverDir, "manifests")
+        manifestFile = [f for f in os.listdir(manifestDir) if f.startswith("c-1.0")][0]
+        man = Manifest.fromFile(os.path.join(manifestDir, manifestFile), Eups())
+        for dep in man.getProducts():
+            tarball = os.path.join(self.serverDir, dep.distId)
+            self.assertEqual(dep.checksum, fileChecksum(tarball))
+        #
+        # Check that the checksums survive being written and read again
+        #
+        copyFile = os.path.join(self.tmp, "copy.manifest")
+        man.write(copyFile, noOptional=False)
+        self.assertEqual([d.checksum for d in Manifest.fromFile(copyFile, Eups()).getProducts()],
+                         [d.checksum for d in man.getProducts()])
+        #
+        # Corrupt a's tarball;  it mustn't be installed
+        #
+        fd = open(os.path.join(self.serverDir, man.getDependency("a").distId), "ab")
+        fd.write(b"corrupted")
+        fd.close()
+
+        eupsenv = Eups()
+        opts = dict(config={}, noeups=False, noaction=False, nobuild=False, noclean=False,
+                    installCurrent=False, flavor="Linux")
+        repos = Repositories(self.serverDir, opts, eupsenv, "Linux", log=StringIO.StringIO())
+        self.assertRaises(RemoteFileInvalid, repos.install, "c", "1.0", options=opts)
+        self.assertFalse(os.path.exists(os.path.join(self.installStack, "Linux", "a")))
+
+from eups.distrib.DownloadCache import DownloadCache
+
+class DownloadCacheTestCase(unittest.TestCase):
+    """test the persistent cache of downloaded files"""
+
+    def setUp(self):
+        self.environ0 = os.environ.copy()
+        self.tmp = os.path.join(testEupsStack, "_downloads_")
+        if os.path.exists(self.tmp):
+            shutil.rmtree(self.tmp)
+        os.makedirs(self.tmp)
+        os.environ["EUPS_USERDATA"] = os.path.join(self.tmp, "_userdata_")
+
+    def tearDown(self):
+        os.environ = self.environ0
+        if os.path.exists(self.tmp):
+            shutil.rmtree(self.tmp)
+
+    def writeFile(self, name, contents):
+        fileName = os.path.join(self.tmp, name)
+        fd = open(fileName, "w")
+        fd.write(contents)
+        fd.close()
+        return fileName
+
+    def testLookup(self):
+        cache = DownloadCache(1000)
+        url = "http://example.com/a.tar.gz"
+        cached = cache.store(url, "ETag: 1", self.writeFile("a", "contents of a"))
+
+        self.assertEqual(cache.lookup(url, "ETag: 1"), cached)
+        self.assertEqual(open(cached).read(), "contents of a")
+        self.assertEqual(cache.getEntry(url), ("ETag: 1", cached))
+        self.assertIsNone(cache.lookup(url, "ETag: 2"))
+        self.assertIsNone(cache.lookup(url))
+        self.assertIsNone(cache.lookup("http://example.com/b.tar.gz", "ETag: 1"))
+        self.assertEqual(cache.lookup("http://example.com/b.tar.gz", checksum=os.path.basename(cached)),
+                         cached)
+        #
+        # Identical files are only stored once
+        #
+        self.assertEqual(cache.store("http://example.com/c.tar.gz", "ETag: 3",
+                                     self.writeFile("c", "contents of a")), cached)
+        self.assertEqual(cache.size(), (1, len("contents of a")))
+
+    def testPrune(self):
+        cache = DownloadCache(25)
+        a = cache.store("http://example.com/a", "1", self.writeFile("a", "a"*10))
+        b = cache.store("http://example.com/b", "1", self.writeFile("b", "b"*10))
+        os.utime(a, (1, 1))             # a is the least recently used...
+        os.utime(b, (2, 2))
+        self.assertEqual(cache.lookup("http://example.com/a", "1"), a) # ... until we use it
+
+        cache.store("http://example.com/c", "1", self.writeFile("c", "c"*10))
+        self.assertEqual(cache.lookup("http://example.com/a", "1"), a)
+        self.assertIsNone(cache.lookup("http://example.com/b", "1"))
+        self.assertEqual(cache.size()[0], 2)
+
+        self.assertEqual(cache.clean(), (2, 20))
+        self.assertEqual(cache.size(), (0, 0))
+        self.assertIsNone(cache.lookup("http://example.com/c", "1"))
+
+    def testServer(self):
+        """Check that DistribServer uses the cache for files with validators"""
+        serverDir = os.path.join(self.tmp, "server")
+        os.mkdir(serverDir)
+        fd = open(os.path.join(serverDir, "a.tar.gz"), "w")
+        fd.write("contents of a")
+        fd.close()
+
+        retrieved = []
+        cacheToFile = LocalTransporter.cacheToFile
+        def countingCacheToFile(trx, filename, noaction=False):
+            cacheToFile(trx, filename, noaction)
+            retrieved.append(trx.loc)
+
+        LocalTransporter.cacheToFile = countingCacheToFile
+        LocalTransporter.validator = lambda trx: "mtime: %s" % os.stat(trx.loc).st_mtime
+        try:
+            for i in range(2):          # as if we'd run eups twice
+                DistribServer._fileCache.clear()
+                ds = DistribServer(serverDir)
+                fileName = ds.getFile("a.tar.gz", filename=os.path.join(self.tmp, "a%d.tar.gz" % i))
+                self.assertEqual(open(fileName).read(), "contents of a")
+        finally:
+            LocalTransporter.cacheToFile = cacheToFile
+            del LocalTransporter.validator
+
+        self.assertEqual(len(retrieved), 1)
+        #
+        # Files with known checksums are found in the cache without asking the server, and
+        # are checked when they are retrieved
+        #
+        DistribServer._fileCache.clear()
+        ds = DistribServer(serverDir)
+        checksum = fileChecksum(os.path.join(serverDir, "a.tar.gz"))
+        fileName = ds.getFile("a.tar.gz", filename=os.path.join(self.tmp, "a2.tar.gz"), checksum=checksum)
+        self.assertEqual(open(fileName).read(), "contents of a")
+
+        fileName = os.path.join(self.tmp, "a3.tar.gz")
+        self.assertRaises(RemoteFileInvalid, ds.getFile, "a.tar.gz", filename=fileName,
+                          checksum="sha256:" + "0"*64)
+        self.assertFalse(os.path.exists(fileName))
+        #
+        # Corrupt copies, whether retrieved earlier by this process or in the download cache,
+        # are replaced by new ones from the server
+        #
+        self.writeFile("a2.tar.gz", "corrupted")
+        fileName = ds.getFile("a.tar.gz", filename=os.path.join(self.tmp, "a4.tar.gz"), checksum=checksum)
+        self.assertEqual(open(fileName).read(), "contents of a")
+
+        DistribServer._fileCache.clear()
+        cachedFile = DownloadCache.fromConfig().lookup("", checksum=checksum.split(":")[1])
+        fd = open(cachedFile, "w")
+        fd.write("corrupted")
+        fd.close()
+        fileName = ds.getFile("a.tar.gz", filename=os.path.join(self.tmp, "a5.tar.gz"), checksum=checksum)
+        self.assertEqual(open(fileName).read(), "contents of a")
+        self.assertEqual(open(cachedFile).read(), "contents of a")
+
+        DistribServer._fileCache.clear()
+        cmd = eups.cmd.EupsCmd(args=["distrib", "clean", "--cache"], toolname="eups")
+        self.assertEqual(cmd.run(), 0)
+        self.assertEqual(DownloadCache.fromConfig().size(), (0, 0))
+
+
+__all__ = "LocalTransporterTestCase LocalConfigFileTestCase LocalServerConfTestCase LocalDistribServerTestCase LocalRepositoryTestCase LocalRepositoriesTestCase ParallelInstallTestCase DownloadCacheTestCase".split()
 
 if __name__ == "__main__":
     unittest.main()
@@ -4,19 +4,29 @@ Tests for eups.server, focussing on web tranport mechanisms
 """
 
 import os
+import re
 import sys
 import unittest
 from testCommon import testEupsStack
 
 from eups.distrib.server import WebTransporter
-from eups.distrib.server import RemoteFileNotFound
+from eups.distrib.server import RemoteFileNotFound, RemoteFileInvalid, ServerNotResponding
 
 # the package server root:
 pkgroot = "http://dev.lsstcorp.org/eupstest"
 
-class WebTransporterTestCase(unittest.TestCase):
+class NetworkTestCase(unittest.TestCase):
+    """a test that uses the real package server;  don't retry if it can't be reached"""
 
     def setUp(self):
+        # restored even if a subclass's setUp fails (when tearDown isn't called)
+        self.addCleanup(setattr, WebTransporter, "maxRetries", WebTransporter.maxRetries)
+        WebTransporter.maxRetries = 0
+
+class WebTransporterTestCase(NetworkTestCase):
+
+    def setUp(self):
+        NetworkTestCase.setUp(self)
         self.base = pkgroot + "/"
         if "EUPS_DIR" not in os.environ:
             os.environ["EUPS_DIR"] = os.path.dirname(testEupsStack)
@@ -46,9 +56,10 @@ class WebTransporterTestCase(unittest.TestCase):
 
 from eups.distrib.server import DistribServer
 
-class WebConfigFileTestCase(unittest.TestCase):
+class WebConfigFileTestCase(NetworkTestCase):
 
     def setUp(self):
+        NetworkTestCase.setUp(self)
         self.base = pkgroot + "/s2/"
         self.configFile = os.path.join(testEupsStack, "eups-config.txt")
 
@@ -65,28 +76,24 @@ class WebConfigFileTestCase(unittest.TestCase):
 
 from eups.distrib.server import ServerConf
 
-class WebServerConfTestCase(unittest.TestCase):
+class WebServerConfTestCase(NetworkTestCase):
 
     def setUp(self):
+        NetworkTestCase.setUp(self)
         os.environ["EUPS_PATH"] = testEupsStack
         self.pkgbase = pkgroot + "/s2/"
         self.servconf = ServerConf(self.pkgbase)
 
-    def tearDown(self):
-        pass
-
     def testGetConfigFile(self):
         pass
 
-class WebDistribServerTestCase(unittest.TestCase):
+class WebDistribServerTestCase(NetworkTestCase):
 
     def setUp(self):
+        NetworkTestCase.setUp(self)
         self.pkgbase = pkgroot + "/s2/"
         self.ds = DistribServer(self.pkgbase)
 
-    def tearDown(self):
-        pass
-
     def testInit(self):
         pass
 
@@ -101,8 +108,260 @@ class WebDistribServerTestCase(unittest.TestCase):
         self.assertEqual(len(tags), 1)
         self.assertIn("current", tags)
 
+#
+# A web server on localhost, so that we can test WebTransporter without the network
+#
+import hashlib
+import shutil
+import socket
+import threading
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+from eups.distrib import server
+from eups.utils import StringIO
+
+class TestRequestHandler(BaseHTTPRequestHandler):
+    """serve the files in self.server.files, with ETags and byte ranges, and keeping connections alive"""
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def do_GET(self, body=True):
+        srv = self.server
+        srv.requests.append((self.command, self.path))
+
+        if srv.failures.get(self.path):
+            srv.failures[self.path] -= 1
+            return self.reply(503)
+
+        if self.path in srv.redirects:
+            return self.reply(302, headers={"Location" : srv.redirects[self.path]})
+
+        if self.path not in srv.files:
+            return self.reply(404)
+
+        data = srv.files[self.path]
+        etag = '"%s"' % hashlib.sha1(data).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            srv.notModified += 1
+            return self.reply(304, headers={"ETag" : etag})
+
+        mat = re.search(r"^bytes=(\d+)-$", self.headers.get("Range", ""))
+        if mat and self.headers.get("If-Range") == etag:
+            start = int(mat.group(1))
+            srv.ranges.append(start)
+            return self.reply(206, data[start:] if body else None,
+                              {"ETag" : etag,
+                               "Content-Range" : "bytes %d-%d/%d" % (start, len(data) - 1, len(data))},
+                              length=len(data) - start)
+
+        if body and self.path in srv.truncate:  # send part of the file, then drop the connection
+            self.reply(200, data[:srv.truncate.pop(self.path)], {"ETag" : etag}, length=len(data))
+            self.close_connection = True
+            return
+
+        self.reply(200, data if body else None, {"ETag" : etag}, length=len(data))
+
+    def reply(self, status, data=None, headers={}, length=None):
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(length if length is not None else len(data or b"")))
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+class TestHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), TestRequestHandler)
+        self.files = {}                 # path: contents
+        self.failures = {}              # path: number of times to reply 503
+        self.redirects = {}             # path: where to redirect to
+        self.truncate = {}              # path: number of bytes to send before dropping the connection
+        self.ranges = []                # the starts of the byte ranges requested
+        self.requests = []              # (method, path)
+        self.connections = 0
+        self.notModified = 0            # the number of 304 (not modified) replies
+
+class LocalWebTransporterTestCase(unittest.TestCase):
+    """test WebTransporter against a web server on localhost"""
+
+    def setUp(self):
+        self.environ0 = os.environ.copy()
+        for k in list(os.environ.keys()):
+            if k.lower().endswith("_proxy"):
+                del os.environ[k]
+        self.tmp = os.path.join(testEupsStack, "_webserver_")
+        if os.path.exists(self.tmp):
+            shutil.rmtree(self.tmp)
+        os.makedirs(self.tmp)
+        os.environ["EUPS_USERDATA"] = os.path.join(self.tmp, "_userdata_")
+
+        self.server = TestHTTPServer()
+        self.base = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.retryDelay = WebTransporter.retryDelay
+        WebTransporter.retryDelay = 0.01
+        server._connectionPool.clear()
+        DistribServer._fileCache.clear()
+
+    def tearDown(self):
+        WebTransporter.retryDelay = self.retryDelay
+        server._connectionPool.clear()
+        DistribServer._fileCache.clear()
+        self.server.shutdown()
+        self.server.server_close()
+        os.environ = self.environ0
+        if os.path.exists(self.tmp):
+            shutil.rmtree(self.tmp)
+
+    def read(self, fileName):
+        fd = open(fileName, "rb")
+        try:
+            return fd.read()
+        finally:
+            fd.close()
+
+    def testKeepAlive(self):
+        """Check that files are streamed to disk, over a single connection"""
+        for i in range(3):
+            self.server.files["/f%d" % i] = os.urandom(3*WebTransporter.chunkSize//2 + i)
+
+        for i in range(3):
+            localfile = os.path.join(self.tmp, "f%d" % i)
+            WebTransporter("%s/f%d" % (self.base, i)).cacheToFile(localfile)
+            self.assertEqual(self.read(localfile), self.server.files["/f%d" % i])
+
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.connections, 1)
+
+    def testNotFound(self):
+        localfile = os.path.join(self.tmp, "missing")
+        trx = WebTransporter(self.base + "/missing")
+        self.assertRaises(RemoteFileNotFound, trx.cacheToFile, localfile)
+        self.assertFalse(os.path.exists(localfile))
+        self.assertEqual(len(self.server.requests), 1) # not worth retrying
+
+    def testRetry(self):
+        self.server.files["/f"] = b"contents of f"
+        self.server.failures["/f"] = WebTransporter.maxRetries
+
+        localfile = os.path.join(self.tmp, "f")
+        trx = WebTransporter(self.base + "/f", verbosity=-1)
+        trx.cacheToFile(localfile)
+        self.assertEqual(self.read(localfile), b"contents of f")
+        self.assertEqual(len(self.server.requests), WebTransporter.maxRetries + 1)
+
+        self.server.failures["/f"] = WebTransporter.maxRetries + 1
+        os.remove(localfile)
+        self.assertRaises(RemoteFileNotFound, trx.cacheToFile, localfile)
+        self.assertFalse(os.path.exists(localfile))
+
+    def testResume(self):
+        """Check that a transfer that's interrupted is resumed where it left off"""
+        data = os.urandom(3*WebTransporter.chunkSize)
+        self.server.files["/f"] = data
+        self.server.truncate["/f"] = 2*WebTransporter.chunkSize + 10
+
+        localfile = os.path.join(self.tmp, "f")
+        trx = WebTransporter(self.base + "/f", verbosity=-1)
+        trx.cacheToFile(localfile)
+        self.assertEqual(self.read(localfile), data)
+        self.assertFalse(os.path.exists(localfile + ".partial"))
+        self.assertEqual(len(self.server.ranges), 1)
+        self.assertTrue(self.server.ranges[0] > 0)
+        self.assertEqual(trx.checksum, "sha256:%s" % hashlib.sha256(data).hexdigest())
+
+    def testChecksum(self):
+        """Check that files whose checksum is wrong are rejected"""
+        self.server.files["/f.tar.gz"] = b"contents of f"
+        checksum = "sha256:%s" % hashlib.sha256(b"contents of f").hexdigest()
+
+        ds = DistribServer(self.base)
+        fileName = ds.getFile("f.tar.gz", filename=os.path.join(self.tmp, "f.tar.gz"), checksum=checksum)
+        self.assertEqual(self.read(fileName), b"contents of f")
+
+        self.server.files["/g.tar.gz"] = b"corrupted contents of g"
+        checksum = "sha256:%s" % hashlib.sha256(b"contents of g").hexdigest()
+        fileName = os.path.join(self.tmp, "g.tar.gz")
+        self.assertRaises(RemoteFileInvalid, ds.getFile, "g.tar.gz", filename=fileName, checksum=checksum)
+        self.assertFalse(os.path.exists(fileName))
+
+    def testUnreachable(self):
+        """Check that we don't retry if the server isn't there"""
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))     # a port that nothing is listening on
+        port = sock.getsockname()[1]
+        sock.close()
+
+        log = StringIO.StringIO()
+        trx = WebTransporter("http://127.0.0.1:%d/f" % port, log=log)
+        self.assertRaises(ServerNotResponding, trx.cacheToFile, os.path.join(self.tmp, "f"))
+        self.assertNotIn("retrying", log.getvalue())
+
+    def testRedirect(self):
+        self.server.files["/new/f"] = b"contents of f"
+        self.server.redirects["/old/f"] = self.base + "/new/f"
+
+        localfile = os.path.join(self.tmp, "f")
+        WebTransporter(self.base + "/old/f").cacheToFile(localfile)
+        self.assertEqual(self.read(localfile), b"contents of f")
+
+    def testConditional(self):
+        self.server.files["/f"] = b"contents of f"
+
+        cachedfile = os.path.join(self.tmp, "cached")
+        trx = WebTransporter(self.base + "/f")
+        trx.cacheToFile(cachedfile)
+        validator = trx.validator()
+        self.assertTrue(validator.startswith("ETag: "))
+
+        localfile = os.path.join(self.tmp, "f")
+        trx = WebTransporter(self.base + "/f")
+        self.assertFalse(trx.cacheToFileIfModified(localfile, validator, cachedfile))
+        self.assertEqual(self.read(localfile), b"contents of f")
+        self.assertEqual(trx.validator(), validator)
+
+        self.server.files["/f"] = b"new contents of f"
+        trx = WebTransporter(self.base + "/f")
+        self.assertTrue(trx.cacheToFileIfModified(localfile, validator, cachedfile))
+        self.assertEqual(self.read(localfile), b"new contents of f")
+        self.assertNotEqual(trx.validator(), validator)
+
+    def testDownloadCache(self):
+        """Check that a DistribServer only retrieves unchanged files once, even in different processes"""
+        self.server.files["/f.tar.gz"] = b"contents of f"
+
+        for i in range(2):
+            DistribServer._fileCache.clear() # as if we'd started a new process
+            ds = DistribServer(self.base)
+            fileName = ds.getFile("f.tar.gz", filename=os.path.join(self.tmp, "f%d.tar.gz" % i))
+            self.assertEqual(self.read(fileName), b"contents of f")
+
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.notModified, 1)
+        self.assertEqual(self.server.connections, 1)
+
 
-__all__ = "WebTransporterTestCase WebConfigFileTestCase WebServerConfTestCase WebDistribServerTestCase".split()
+__all__ = "WebTransporterTestCase WebConfigFileTestCase WebServerConfTestCase WebDistribServerTestCase LocalWebTransporterTestCase".split()
 
 if __name__ == "__main__":
     if len(sys.argv) > 1:
@@ -4,6 +4,7 @@ Tests for eups.stack
 """
 
 import os
+import shutil
 import unittest
 import time
 import testCommon
@@ -134,7 +135,7 @@ class ProductStackTestCase(unittest.TestCase):
 
     def testMisc(self):
         self.assertEqual(ProductStack.persistFilename("Linux"),
-                          "Linux.pickleDB1_3_0")
+                          "Linux.pickleDB2_2_0")
         self.assertEqual(self.stack.getDbPath(),
                           os.path.join(testEupsStack, "ups_db"))
 
@@ -423,7 +424,9 @@ class ProductStackTestCase(unittest.TestCase):
 
 
 
-from eups.stack import CacheOutOfSync
+from eups.stack import CacheOutOfSync, CacheFormatError
+from eups.db import Database
+from eups.table import Table
 
 class CacheTestCase(unittest.TestCase):
 
@@ -437,6 +440,7 @@ class CacheTestCase(unittest.TestCase):
     def tearDown(self):
         if os.path.exists(self.cache):
             os.remove(self.cache)
+        testCommon.removeJournal()
 
     def testRegen(self):
         ps = ProductStack.fromCache(self.dbpath, "Linux", autosave=True,
@@ -468,6 +472,214 @@ class CacheTestCase(unittest.TestCase):
                                "/opt/sw/Darwin/fw/1.2", "none"))
         self.assertRaises(CacheOutOfSync, ps2.save)
 
+    def testLazyReload(self):
+        ps = ProductStack.fromCache(self.dbpath, "Linux", autosave=False,
+                                    updateCache=True, verbose=False)
+        names = sorted(ps.getProductNames("Linux"))
+
+        ps = ProductStack(self.dbpath, autosave=False)
+        ps.reload("Linux")
+        lookup = ps.lookup["Linux"]
+        self.assertEqual(sorted(ps.getProductNames("Linux")), names)
+        self.assertEqual(len(lookup._families), 0)
+
+        prod = ps.getProduct("python", "2.5.2", "Linux")
+        self.assertEqual(prod.version, "2.5.2")
+        self.assertEqual(list(lookup._families.keys()), ["python"])
+
+        # undecoded families are written back unchanged
+        ps.addProduct(Product("afw", "1.2", "Linux", "/opt/sw/Linux/afw/1.2",
+                              "none"))
+        ps.save()
+        ps.reload("Linux")
+        self.assertEqual(sorted(ps.getProductNames("Linux")),
+                         sorted(names + ["afw"]))
+        self.assert_(ps.getTaggedProduct("doxygen", "Linux", "current") is not None)
+
+    def testUnreadableCache(self):
+        with open(self.cache, "w") as fd:
+            fd.write("gurn")
+        ps = ProductStack(self.dbpath, autosave=False)
+        self.assertRaises(CacheFormatError, ps.reload, "Linux")
+
+        ps = ProductStack.fromCache(self.dbpath, "Linux", autosave=False,
+                                    updateCache=True, verbose=False)
+        self.assert_(ps.hasProduct("python", "Linux"))
+
+    def testIncrementalUpdate(self):
+        ps = ProductStack.fromCache(self.dbpath, "Linux", autosave=False,
+                                    updateCache=True, verbose=False)
+        self.assert_(ps.getTaggedProduct("python", "Linux", "beta") is None)
+        self.assert_(os.path.exists(self.cache))
+
+        db = Database(self.dbpath)
+        chain = os.path.join(self.dbpath, "python", "beta.chain")
+        db.assignTag("beta", "python", "2.5.2")
+
+        # a changed product should be patched into the cache, not trigger
+        # a full regeneration
+        def refreshFromDatabase(self, userTagDir=None):
+            raise AssertionError("cache was regenerated from scratch")
+        refresh = ProductStack.refreshFromDatabase
+        ProductStack.refreshFromDatabase = refreshFromDatabase
+        try:
+            ps = ProductStack.fromCache(self.dbpath, "Linux", autosave=False,
+                                        updateCache=True, verbose=False)
+            prod = ps.getTaggedProduct("python", "Linux", "beta")
+            self.assert_(prod is not None)
+            self.assertEqual(prod.version, "2.5.2")
+            self.assert_(ps.hasProduct("doxygen", "Linux"))
+
+            db.unassignTag("beta", "python")
+            ps = ProductStack.fromCache(self.dbpath, "Linux", autosave=False,
+                                        updateCache=True, verbose=False)
+            self.assert_(ps.getTaggedProduct("python", "Linux", "beta") is None)
+            self.assert_(ps.getTaggedProduct("python", "Linux", "current")
+                         is not None)
+        finally:
+            ProductStack.refreshFromDatabase = refresh
+            if os.path.exists(chain):
+                os.remove(chain)
+
+    def testJournal(self):
+        ProductStack.fromCache(self.dbpath, "Linux", autosave=False,
+                               updateCache=True, verbose=False)
+
+        db = Database(self.dbpath)
+        chain = os.path.join(self.dbpath, "python", "beta.chain")
+        db.assignTag("beta", "python", "2.5.2")
+
+        # the journal says what changed, so the database needn't be scanned
+        def getProductTimestamps(self, productNames=None):
+            raise AssertionError("database was scanned")
+        scan = db.__class__.getProductTimestamps
+        db.__class__.getProductTimestamps = getProductTimestamps
+        try:
+            ps = ProductStack.fromCache(self.dbpath, "Linux", autosave=False,
+                                        updateCache=True, verbose=False)
+            self.assert_(ps.getTaggedProduct("python", "Linux", "beta") is not None)
+            self.assert_(ps.hasProduct("doxygen", "Linux"))
+
+            db.unassignTag("beta", "python")
+            ps = ProductStack.fromCache(self.dbpath, "Linux", autosave=False,
+                                        updateCache=True, verbose=False)
+            self.assert_(ps.getTaggedProduct("python", "Linux", "beta") is None)
+        finally:
+            db.__class__.getProductTimestamps = scan
+            if os.path.exists(chain):
+                os.remove(chain)
+
+    def testUserCache(self):
+        # a user cache directory without a generation (no user tags have been
+        # assigned) mustn't stop the cache from being trusted
+        userCache = os.path.join(testEupsStack, "_usercache_")
+        if not os.path.exists(userCache):
+            os.makedirs(userCache)
+
+        def getProductTimestamps(self, productNames=None):
+            raise AssertionError("database was scanned")
+        dbClass = Database(self.dbpath).__class__
+        scan = dbClass.getProductTimestamps
+        try:
+            ProductStack.fromCache(self.dbpath, "Linux", userCache, autosave=False,
+                                   updateCache=True, verbose=False)
+
+            dbClass.getProductTimestamps = getProductTimestamps
+            ps = ProductStack.fromCache(self.dbpath, "Linux", userCache, autosave=False,
+                                        updateCache=True, verbose=False)
+            self.assert_(ps.hasProduct("python", "Linux"))
+        finally:
+            dbClass.getProductTimestamps = scan
+            shutil.rmtree(userCache)
+
+    def testGeneration(self):
+        db = Database(self.dbpath)
+        db.assignTag("beta", "python", "2.5.2")
+        chain = os.path.join(self.dbpath, "python", "beta.chain")
+        try:
+            ps = ProductStack.fromCache(self.dbpath, "Linux", autosave=False,
+                                        updateCache=True, verbose=False)
+            self.assert_(ps.getTaggedProduct("python", "Linux", "beta") is not None)
+
+            # a change that bypasses Database doesn't update the generation,
+            # so it is only noticed when the cache is explicitly verified
+            os.remove(chain)
+            ps = ProductStack.fromCache(self.dbpath, "Linux", autosave=False,
+                                        updateCache=True, verbose=False)
+            self.assert_(ps.getTaggedProduct("python", "Linux", "beta") is not None)
+
+            ps = ProductStack.fromCache(self.dbpath, "Linux", autosave=False,
+                                        updateCache=True, verify=True,
+                                        verbose=False)
+            self.assert_(ps.getTaggedProduct("python", "Linux", "beta") is None)
+        finally:
+            if os.path.exists(chain):
+                os.remove(chain)
+
+    def testDependencyIndex(self):
+        ps = ProductStack.fromDatabase(self.dbpath, autosave=False)
+        usesFile = ps._usesPath("Linux")
+        try:
+            python = ps.getProduct("python", "2.5.2", "Linux")
+            self.assertIn("tcltk", ps.dependencyNames(python))
+            ps.saveDependencyIndex()
+            self.assert_(os.path.exists(usesFile))
+
+            # a fresh stack gets the names from the index
+            ps = ProductStack.fromDatabase(self.dbpath, autosave=False)
+            python = ps.getProduct("python", "2.5.2", "Linux")
+            def getTable(*args, **kwargs):
+                raise AssertionError("table was read")
+            python.getTable = getTable
+            self.assertIn("tcltk", ps.dependencyNames(python))
+
+            # until the product is redeclared
+            ps.removeProduct("python", "Linux", "2.5.2")
+            self.assertRaises(AssertionError, ps.dependencyNames, python)
+        finally:
+            if os.path.exists(usesFile):
+                os.remove(usesFile)
+
+    def testTableCache(self):
+        ps = ProductStack.fromDatabase(self.dbpath, autosave=False)
+        try:
+            table = ps.getProduct("python", "2.5.2", "Linux").getTable()
+            tableDir = os.path.join(self.dbpath, ProductStack.tableCacheDirName)
+            self.assertEqual(len(os.listdir(tableDir)), 1)
+
+            # a fresh stack gets the parsed table from the cache
+            read = Table._read
+            def _read(self, *args, **kwargs):
+                raise AssertionError("table was parsed")
+            Table._read = _read
+            try:
+                ps = ProductStack.fromDatabase(self.dbpath, autosave=False)
+                prod = ps.getProduct("python", "2.5.2", "Linux")
+                cached = prod.getTable()
+            finally:
+                Table._read = read
+            self.assert_(cached.topProduct is prod)
+            self.assertEqual([str(a) for a in cached.actions("Linux")],
+                             [str(a) for a in table.actions("Linux")])
+            for a in cached.actions("Linux"):
+                self.assert_(a.topProduct in (None, prod))
+
+            # an edited table replaces its old entry
+            tablefile = prod.tablefile
+            st = os.stat(tablefile)
+            os.utime(tablefile, (st.st_atime, st.st_mtime + 10))
+            try:
+                ps = ProductStack.fromDatabase(self.dbpath, autosave=False)
+                ps.getProduct("python", "2.5.2", "Linux").getTable()
+            finally:
+                os.utime(tablefile, (st.st_atime, st.st_mtime))
+            self.assertEqual(len(os.listdir(tableDir)), 1)
+
+            ps.clearCache()
+            self.assertFalse(os.path.exists(tableDir))
+        finally:
+            ps.clearTableCache()
+
 #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
 
 def suite(makeSuite=True):
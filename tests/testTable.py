@@ -4,11 +4,12 @@ Tests for eups.product
 """
 
 import os
+import tempfile
 import unittest
 import testCommon
 from testCommon import testEupsStack
 
-from eups.table import Table
+from eups.table import Table, Action
 from eups.Eups import Eups
 
 class TableTestCase1(unittest.TestCase):
@@ -128,6 +129,35 @@ class TableTestCase2(unittest.TestCase):
         for action in actions:
             action.execute(self.eups, 1, True)
 
+    def testEnvPrepend(self):
+        os.environ["GOOBPATH"] = "/a::/b:/a"
+        for value, append, expected in [("/b", False, "/b:/a"),
+                                        ("/c:/d", False, "/d:/c:/b:/a"),
+                                        ("/a", True, "/d:/c:/b:/a"),
+                                        ("/e:", True, "/d:/c:/b:/a:/e:"),
+                                        (":/c", False, ":/c:/d:/b:/a:/e"),
+                                        ]:
+            Action(self.tablefile, Action.envPrepend, ["GOOBPATH", value],
+                   dict(append=append)).execute(self.eups, 1, True)
+            self.assertEqual(os.environ["GOOBPATH"], expected)
+
+        Action(self.tablefile, Action.envPrepend, ["GOOBPATH", "/b:/c"],
+               dict(append=False)).execute(self.eups, 1, False)
+        self.assertEqual(os.environ["GOOBPATH"], "/d:/a:/e")
+
+    def testEnvPath(self):
+        os.environ["GOOBPATH"] = "/a:/b"
+        path = self.eups.getEnvPath("GOOBPATH")
+        path.prepend("/b")
+        path.append("/c")
+        self.assertEqual(os.environ["GOOBPATH"], "/a:/b") # not yet written
+
+        self.eups.pushStack("env")
+        path.remove("/a")
+        self.eups.popStack("env")
+
+        self.eups.flushEnv()
+        self.assertEqual(os.environ["GOOBPATH"], "/b:/a:/c")
 
 class EmptyTableTestCase(unittest.TestCase):
     """
@@ -210,6 +240,71 @@ class ExternalProductsTestCase(unittest.TestCase):
         ]:
             self.assertEqual(self.table.dependencies(listExternalDependencies=led)[i][0].name, productName)
 
+class SyntaxTestCase(unittest.TestCase):
+    """
+    Check the parsing of quoted arguments and of archaic forms
+    """
+    def setUp(self):
+        fd, self.tablefile = tempfile.mkstemp(suffix=".table")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.tablefile)
+
+    def readTable(self, contents):
+        fd = open(self.tablefile, "w")
+        fd.write(contents)
+        fd.close()
+        return Table(self.tablefile, addDefaultProduct=False)
+
+    def testQuoting(self):
+        table = self.readTable("""
+envSet(FOO, "a b, c")   # a comment
+envAppend(BAR, ${UPS_PROD_DIR}/lib, " ")
+envSet(GOOB, "say \\"hi\\"")
+setupRequired(doxygen 1.5.9 [>= 1.5.7.1])
+""")
+        self.assertEqual([(a.cmd, a.args) for a in table.actions("Linux")], [
+            ("envSet", ["FOO", "a b, c"]),
+            ("envPrepend", ["BAR", "${PRODUCT_DIR}/lib", " "]),
+            ("envSet", ["GOOB", 'say "hi"']),
+            ("setupRequired", ["doxygen", "1.5.9", "[>=", "1.5.7.1]"]),
+            ])
+
+    def testDependencyNames(self):
+        table = self.readTable("""
+setupRequired(python)
+if (flavor == Darwin) {
+    setupOptional(-f Darwin --tag beta tcltk 8.5a4)
+} else {
+    unsetupRequired(-j doxygen)
+}
+""")
+        self.assertEqual(table.dependencyNames(), set(["python", "tcltk", "doxygen"]))
+
+        table = self.readTable("setupRequired(-r ${FOO_DIR})\n")
+        self.assert_(table.dependencyNames() is None)
+
+    def testGroups(self):
+        table = self.readTable("""
+File = Table
+Product = foo
+Group:
+   Flavor = Linux
+   Flavor = Linux64
+   Qualifiers = ""
+Common:
+   Action = setup
+      setupRequired(bar)
+End:
+Flavor = Darwin
+   envSet(FOO, ${UPS_DB})
+""")
+        self.assert_(table.old)
+        self.assertEqual([a.args for a in table.actions("Linux64")], [["bar"]])
+        self.assertEqual([a.args for a in table.actions("Darwin")],
+                         [["FOO", "${PRODUCTS}"]])
+
 #-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
 
 def suite(makeSuite=True):
@@ -217,6 +312,7 @@ def suite(makeSuite=True):
 
     return testCommon.makeSuite([
         EmptyTableTestCase,
+        SyntaxTestCase,
         TableTestCase1,
         TableTestCase2,
         IfElseTestCase,